@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, DatabaseError
+
+from cards import issuer
+from cards.accounting.models import Account
+
+
+class Command(BaseCommand):
+    help = ('Measures the authorisations throughput against the configured '
+            'database, run it once per database profile to compare them '
+            '(e.g. CARDS_DB_ENGINE=postgresql). Benchmark cards and '
+            'transactions are left on the database, use a scratch one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--authorisations',
+                            type=int,
+                            default=200,
+                            help='Authorisations by thread.')
+        parser.add_argument('--cards',
+                            type=int,
+                            default=10,
+                            help='Cards shared by the threads, fewer cards '
+                                 'mean more contention.')
+        parser.add_argument('--currency', default='BRL')
+
+    def handle(self, *args, **params):
+        currency = params['currency']
+        cards = ['BENCH{:05d}'.format(i) for i in range(params['cards'])]
+        amount = params['threads'] * params['authorisations']
+
+        for card_id in cards:
+            Account.objects.get_or_create(card_id=card_id, currency=currency)
+        issuer.service.load_money_bulk((card_id, amount, currency)
+                                       for card_id in cards)
+
+        def authorise(thread):
+            latencies = []
+            errors = 0
+            try:
+                for i in range(params['authorisations']):
+                    card_id = cards[(thread + i) % len(cards)]
+                    start = time.perf_counter()
+                    try:
+                        issuer.service.make_authorisation(
+                            card_id, uuid.uuid4().hex[:10], 'Benchmark',
+                            'BR', 1234, 1, currency, 1, currency)
+                    except DatabaseError:
+                        # Conflicts still failing after the retries
+                        errors += 1
+                    else:
+                        latencies.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+            return latencies, errors
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(params['threads']) as executor:
+            results = list(executor.map(authorise, range(params['threads'])))
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(sum((i[0] for i in results), []))
+        errors = sum(i[1] for i in results)
+
+        message = ('{vendor}: {count} authorisations in {elapsed:.2f}s, '
+                   '{rate:.0f}/s, p50 {p50:.2f}ms, p99 {p99:.2f}ms, '
+                   '{errors} errors')
+        self.stdout.write(self.style.SUCCESS(message.format(
+            vendor=connection.vendor,
+            errors=errors,
+            count=len(latencies),
+            elapsed=elapsed,
+            rate=len(latencies) / elapsed,
+            p50=statistics.median(latencies) * 1000,
+            p99=latencies[int(len(latencies) * 0.99)] * 1000)))
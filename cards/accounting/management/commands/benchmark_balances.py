@@ -0,0 +1,70 @@
+from concurrent.futures import ThreadPoolExecutor
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from cards import balances, issuer
+
+
+class Command(BaseCommand):
+    help = ('Measures the balance inquiries latency and the balances cache '
+            'hit ratio, while a share of the requests load money into the '
+            'polled cards. Benchmark cards are left on the database, use a '
+            'scratch one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--requests',
+                            type=int,
+                            default=1000,
+                            help='Requests by thread.')
+        parser.add_argument('--cards', type=int, default=100)
+        parser.add_argument('--writes',
+                            type=float,
+                            default=0.05,
+                            help='Share of the requests loading money.')
+        parser.add_argument('--currency', default='BRL')
+
+    def handle(self, *args, **params):
+        currency = params['currency']
+        cards = ['BAL{:05d}'.format(i) for i in range(params['cards'])]
+        issuer.service.load_money_bulk((card_id, 1000, currency)
+                                       for card_id in cards)
+        balances.clear()
+
+        def poll(thread):
+            latencies = []
+            try:
+                for i in range(params['requests']):
+                    card_id = random.choice(cards)
+                    if random.random() < params['writes']:
+                        issuer.service.load_money(card_id, 1, currency)
+                        continue
+
+                    start = time.perf_counter()
+                    issuer.service.get_balance(card_id, currency)
+                    latencies.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+            return latencies
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(params['threads']) as executor:
+            results = list(executor.map(poll, range(params['threads'])))
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(sum(results, []))
+        stats = balances.BALANCES.stats()
+        message = ('{vendor}: {count} balance inquiries in {elapsed:.2f}s, '
+                   'hit ratio {ratio:.1%}, p50 {p50:.3f}ms, '
+                   'p99 {p99:.3f}ms')
+        self.stdout.write(self.style.SUCCESS(message.format(
+            vendor=connection.vendor,
+            count=len(latencies),
+            elapsed=elapsed,
+            ratio=stats['hits'] / max(stats['hits'] + stats['misses'], 1),
+            p50=statistics.median(latencies) * 1000,
+            p99=latencies[int(len(latencies) * 0.99)] * 1000)))
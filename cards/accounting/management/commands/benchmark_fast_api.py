@@ -0,0 +1,63 @@
+from unittest.mock import patch
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from cards.api import fast
+from cards.api.views import AuthorisationView
+
+
+PAYLOAD = {
+    'card_id': 'CARD123',
+    'merchant_name': 'Game Store',
+    'merchant_country': 'BR',
+    'merchant_mcc': 1234,
+    'billing_amount': '100.50',
+    'billing_currency': 'BRL',
+    'transaction_amount': 100,
+    'transaction_currency': 'BRL',
+}
+
+
+class Command(BaseCommand):
+    help = ('Compares the authorisation handlers overhead of the DRF view '
+            'and the fast path. The service is replaced by one approving '
+            'every authorisation, so the database time does not hide the '
+            'handlers and nothing is written.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests',
+                            type=int,
+                            default=1000,
+                            help='Requests by handler.')
+
+    def handle(self, *args, **params):
+        factory = RequestFactory()
+
+        def measure(view):
+            latencies = []
+            with patch('cards.issuer.service.make_authorisation',
+                       return_value=True):
+                for i in range(params['requests']):
+                    data = dict(PAYLOAD,
+                                transaction_id=uuid.uuid4().hex[:10])
+                    request = factory.post('/', data,
+                                           content_type='application/json')
+                    start = time.perf_counter()
+                    view(request)
+                    latencies.append(time.perf_counter() - start)
+
+            latencies.sort()
+            return {'p50': statistics.median(latencies) * 1000,
+                    'p99': latencies[int(len(latencies) * 0.99)] * 1000,
+                    'rate': len(latencies) / sum(latencies)}
+
+        message = ('{handler}: p50 {p50:.3f}ms, p99 {p99:.3f}ms, '
+                   '{rate:.0f} requests/s')
+        for handler, view in (('DRF view', AuthorisationView.as_view()),
+                              ('Fast path', fast.authorisation)):
+            self.stdout.write(self.style.SUCCESS(
+                message.format(handler=handler, **measure(view))))
@@ -0,0 +1,75 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, DatabaseError
+
+from cards import issuer
+
+
+class Command(BaseCommand):
+    help = ('Measures the presentments throughput by number of system '
+            'sub-accounts (SYSTEM_ACCOUNTS_BUCKETS), every presentment '
+            'credits the Scheme and Issuer accounts. Run it against a '
+            'database with row locks (e.g. CARDS_DB_ENGINE=postgresql), '
+            'SQLite serializes every write anyway. Benchmark cards and '
+            'transactions are left on the database, use a scratch one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buckets',
+                            type=int,
+                            nargs='+',
+                            default=[1, 2, 4, 8, 16])
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--presentments',
+                            type=int,
+                            default=200,
+                            help='Presentments by thread.')
+        parser.add_argument('--currency', default='BRL')
+
+    def handle(self, *args, **params):
+        currency = params['currency']
+        count = params['threads'] * params['presentments']
+
+        for buckets in params['buckets']:
+            db = issuer.CardsIssuerDatabase(settings.CURRENCIES,
+                                            settings.AUTHORISATION_LOCKING,
+                                            system_buckets=buckets)
+
+            # A card by presentment, only the system accounts are shared.
+            prefix = uuid.uuid4().hex[:4]
+            cards = ['{}{:06d}'.format(prefix, i) for i in range(count)]
+            db.load_money_bulk((card_id, 1, currency) for card_id in cards)
+            for card_id in cards:
+                db.make_authorisation(card_id, card_id, 'Benchmark', 'BR',
+                                      1234, 1, currency, 1, currency)
+
+            def present(thread):
+                errors = 0
+                try:
+                    for card_id in cards[thread::params['threads']]:
+                        try:
+                            db.set_presentment(card_id, 1, currency)
+                        except DatabaseError:
+                            # Conflicts still failing after the retries
+                            errors += 1
+                finally:
+                    connection.close()
+                return errors
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(params['threads']) as executor:
+                errors = sum(executor.map(present, range(params['threads'])))
+            elapsed = time.perf_counter() - start
+
+            message = ('{vendor}: {buckets} buckets, {count} presentments '
+                       'in {elapsed:.2f}s, {rate:.0f}/s, {errors} errors')
+            self.stdout.write(self.style.SUCCESS(message.format(
+                vendor=connection.vendor,
+                buckets=buckets,
+                count=count - errors,
+                elapsed=elapsed,
+                rate=(count - errors) / elapsed,
+                errors=errors)))
@@ -0,0 +1,126 @@
+import random
+import resource
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from issuer.velocity import VelocityExceeded, VelocityLimits, compile_rule
+
+
+class Command(BaseCommand):
+    help = ('Measures the velocity rules evaluation cost of an authorisation '
+            'with random rules and cards histories, in memory only: the '
+            'histories are rebuilt as on startup and the authorisations are '
+            'evaluated and recorded by a single thread.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rules', type=int, default=10000)
+        parser.add_argument('--cards', type=int, default=1000000)
+        parser.add_argument('--history',
+                            type=int,
+                            default=4,
+                            help='Authorisations by card on startup.')
+        parser.add_argument('--history-size',
+                            type=int,
+                            default=settings.VELOCITY_HISTORY_SIZE)
+        parser.add_argument('--authorisations', type=int, default=100000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **params):
+        rng = random.Random(params['seed'])
+        currencies = settings.CURRENCIES
+        mccs = rng.sample(range(1000, 10000), 1000)
+        countries = ['C{:02d}'.format(i) for i in range(50)]
+        now = time.time()
+
+        def make_rule(i):
+            rule = {'name': 'rule{}'.format(i),
+                    'window': rng.choice([60, 600, 3600, 86400]),
+                    'max_count': rng.randint(params['history_size'] // 2,
+                                             params['history_size'])}
+            if rng.random() < 0.9:
+                rule['mcc'] = rng.sample(mccs, rng.randint(1, 3))
+            if rng.random() < 0.3:
+                rule['country'] = rng.sample(countries, rng.randint(1, 5))
+            if rng.random() < 0.5:
+                rule['currency'] = rng.choice(currencies)
+                rule['max_amount'] = rng.randint(1000, 100000)
+            if rng.random() < 0.2:
+                rule['per'] = [rng.choice(['mcc', 'country'])]
+            return rule
+
+        def make_authorisation(card_id, transaction_id):
+            return (card_id, transaction_id, rng.randint(1, 500),
+                    rng.choice(currencies), rng.choice(mccs),
+                    rng.choice(countries))
+
+        def history(since):
+            # Oldest first, spread over the last day
+            for n in range(params['history']):
+                for card in range(params['cards']):
+                    (card_id, transaction_id, amount, currency, mcc,
+                     country) = make_authorisation(
+                         'C{:09d}'.format(card), 'H{}-{}'.format(n, card))
+                    yield (card_id, transaction_id,
+                           now - 86400 + 86400 * n / params['history'],
+                           amount, currency, mcc, country)
+
+        start = time.perf_counter()
+        rules = [compile_rule(make_rule(i)) for i in range(params['rules'])]
+        compiled = time.perf_counter() - start
+
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        limits = VelocityLimits(rules, params['history_size'], history)
+
+        # The first authorisation rebuilds the histories
+        start = time.perf_counter()
+        limits.authorise('WARMUP', 'WARMUP', 1, currencies[0], mccs[0],
+                         countries[0])
+        rebuilt = time.perf_counter() - start
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+
+        authorisations = [
+            make_authorisation(
+                'C{:09d}'.format(rng.randrange(params['cards'])),
+                'A{}'.format(i))
+            for i in range(params['authorisations'])]
+
+        timings = []
+        declined = 0
+        for card_id, transaction_id, amount, currency, mcc, country in (
+                authorisations):
+            start = time.perf_counter()
+            try:
+                limits.authorise(card_id, transaction_id, amount, currency,
+                                 mcc, country)
+            except VelocityExceeded:
+                declined += 1
+            timings.append(time.perf_counter() - start)
+
+        timings.sort()
+        chains = [sum(len(chain.rules) for chain in
+                      limits._get_chains(currency, mcc, country))
+                  for _, _, _, currency, mcc, country in authorisations]
+
+        self.stdout.write(
+            '{rules} rules compiled in {compiled:.2f}s, {cards} cards '
+            'histories of {history} authorisations rebuilt in '
+            '{rebuilt:.2f}s, {rss:.0f}MB'.format(
+                rules=params['rules'],
+                compiled=compiled,
+                cards=params['cards'],
+                history=params['history'],
+                rebuilt=rebuilt,
+                rss=rss / 1024))
+
+        self.stdout.write(self.style.SUCCESS(
+            '{count} authorisations, {declined} declined, {chain:.1f} rules '
+            'by authorisation: p50 {p50:.1f}us, p99 {p99:.1f}us, '
+            'max {max:.1f}us'.format(
+                count=len(timings),
+                declined=declined,
+                chain=sum(chains) / len(chains),
+                p50=timings[len(timings) // 2] * 1e6,
+                p99=timings[int(len(timings) * 0.99)] * 1e6,
+                max=timings[-1] * 1e6)))
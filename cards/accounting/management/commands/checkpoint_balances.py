@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils import timezone
+
+from cards.accounting.models import AccountCheckpoint, Journal
+
+
+class Command(BaseCommand):
+    help = ('Writes the Accounts journals balance checkpoints, so balance '
+            'recomputation only sums the journals after them.')
+
+    def add_arguments(self, parser):
+        # Journals ids are assigned before commit, a recent id may still
+        # have lower ids not committed yet.
+        parser.add_argument('--lag',
+                            type=int,
+                            default=60,
+                            help='Only journals older than this many seconds '
+                                 'are included.')
+
+    def handle(self, *args, **params):
+        until = timezone.now() - timedelta(seconds=params['lag'])
+
+        # Journal ids are assigned by each shard, checkpoints are written
+        # shard by shard.
+        for using in settings.SHARDS:
+            journal_id = (Journal.objects
+                          .using(using)
+                          .filter(creation_date__lte=until)
+                          .aggregate(journal_id=Max('id'))['journal_id'])
+
+            if journal_id is None:
+                self.stdout.write(self.style.WARNING(
+                    'No journals to checkpoint on {}'.format(using)))
+                continue
+
+            created = (AccountCheckpoint.objects
+                       .db_manager(using)
+                       .create_until(journal_id))
+            message = 'Created {} checkpoints until journal {} on {}'
+            self.stdout.write(self.style.SUCCESS(
+                message.format(created, journal_id, using)))
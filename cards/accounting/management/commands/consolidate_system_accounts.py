@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from cards import issuer
+
+
+class Command(BaseCommand):
+    help = ('Sums the Issuer and Scheme accounts of every shard, each shard '
+            'holds its own system accounts.')
+
+    def handle(self, *args, **params):
+        db = issuer.CardsIssuerDatabase()
+        message = 'Account {}:{} balance {} held {}'
+
+        balances = db.get_system_balances()
+        for (card_id, currency), (balance, held) in sorted(balances.items()):
+            self.stdout.write(message.format(card_id, currency, balance, held))
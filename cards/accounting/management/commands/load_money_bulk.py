@@ -0,0 +1,34 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand
+
+from cards import issuer
+
+
+def read_loads(path):
+    """Streams the (card_id, amount, currency) rows of a CSV file with
+    these columns on its header."""
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            yield row['card_id'], row['amount'], row['currency']
+
+
+class Command(BaseCommand):
+    help = ('Loads money into many accounts from a CSV file with the '
+            'card_id, amount and currency columns. Missing accounts are '
+            'created.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **params):
+        start = time.perf_counter()
+        count = issuer.service.load_money_bulk(read_loads(params['path']),
+                                               params['chunk_size'])
+        elapsed = time.perf_counter() - start
+
+        message = 'Loaded {} cards in {:.2f}s ({:.0f} loads/s)'
+        self.stdout.write(self.style.SUCCESS(
+            message.format(count, elapsed, count / elapsed if elapsed else 0)))
@@ -0,0 +1,204 @@
+import csv
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cards import issuer
+from cards.api.serializers import PresentmentSerializer
+
+
+FORMATS = ('csv', 'jsonl')
+
+FIELDS = ('transaction_id', 'settlement_amount', 'settlement_currency')
+
+
+def read_lines(stream, offset):
+    """Reads the lines from a binary stream starting at a byte offset.
+
+    :param stream: The clearing file opened in binary mode.
+    :type stream: file
+
+    :param offset: The byte offset to start reading from.
+    :type offset: int
+
+    :returns: Tuples of (end offset, line), the line still encoded.
+    """
+    stream.seek(offset)
+    for line in iter(stream.readline, b''):
+        offset += len(line)
+        yield offset, line.rstrip(b'\r\n')
+
+
+def parse_rows(lines, fmt, header=None):
+    """Parses the clearing file lines into dicts, blank lines are skipped.
+
+    :param lines: Tuples of (end offset, line).
+    :param fmt: The clearing file format, csv or jsonl.
+    :param header: The CSV columns names.
+
+    :returns: Tuples of (end offset, line, row). The row is None when the
+              line can't be decoded or parsed.
+    """
+    for offset, line in lines:
+        if not line.strip():
+            continue
+
+        try:
+            line = line.decode('utf-8')
+        except UnicodeDecodeError:
+            yield offset, line.decode('utf-8', 'replace'), None
+            continue
+
+        try:
+            if fmt == 'csv':
+                row = dict(zip(header, next(csv.reader([line]))))
+            else:
+                row = json.loads(line)
+        except ValueError:
+            row = None
+
+        yield offset, line, row
+
+
+def validate_rows(rows):
+    """Validates the rows with the presentment endpoint rules.
+
+    :param rows: Tuples of (end offset, line, row).
+
+    :returns: Tuples of (end offset, line, presentment, errors). The
+              presentment is a (transaction_id, settlement_amount,
+              settlement_currency) tuple, None when the row is invalid.
+    """
+    for offset, line, row in rows:
+        if not isinstance(row, dict):
+            yield offset, line, None, 'Malformed row'
+            continue
+
+        serializer = PresentmentSerializer(data=row)
+        if serializer.is_valid():
+            data = serializer.validated_data
+            yield offset, line, tuple(data[i] for i in FIELDS), None
+        else:
+            yield offset, line, None, serializer.errors
+
+
+def chunk_rows(rows, size):
+    """Groups the rows into lists of a maximum size.
+
+    :param rows: Any iterable.
+    :param size: The maximum chunk size.
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = ('Sets the presentments from a clearing file (CSV or JSONL). The '
+            'file is streamed and committed in chunks, the committed byte '
+            'offset is saved after each chunk so the load can be resumed, '
+            'the rows presented after the saved offset are skipped. Rows '
+            'which are invalid or which authorisation is not found are '
+            'written to the rejects file.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str)
+        parser.add_argument('--format',
+                            choices=FORMATS,
+                            help='Defaults to the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--offset',
+                            type=int,
+                            help='Byte offset to resume from, defaults to '
+                                 'the offset saved on the state file.')
+        parser.add_argument('--state-file',
+                            help='Defaults to <path>.offset')
+        parser.add_argument('--rejects-file',
+                            help='Defaults to <path>.rejects')
+
+    def handle(self, *args, **params):
+        path = params['path']
+        fmt = params['format'] or os.path.splitext(path)[1].lstrip('.')
+        if fmt not in FORMATS:
+            raise CommandError('Unknown clearing file format "{}".'
+                               .format(fmt))
+
+        state_file = params['state_file'] or path + '.offset'
+        rejects_file = params['rejects_file'] or path + '.rejects'
+
+        offset = params['offset']
+        if offset is None:
+            offset = self._read_offset(state_file)
+
+        with open(path, 'rb') as stream, \
+                open(rejects_file, 'a') as rejects:
+            header = None
+            if fmt == 'csv':
+                header_line = stream.readline()
+                try:
+                    header = next(csv.reader([header_line.decode('utf-8')]))
+                except UnicodeDecodeError:
+                    raise CommandError('Malformed clearing file header.')
+                offset = max(offset, len(header_line))
+
+            rows = validate_rows(parse_rows(read_lines(stream, offset),
+                                            fmt,
+                                            header))
+
+            presented = skipped = rejected = 0
+            for chunk in chunk_rows(rows, params['chunk_size']):
+                valid = [row[2] for row in chunk if row[2] is not None]
+                results = issuer.service.set_presentments(valid)
+
+                # Set to presentment before, e.g. committed after the saved
+                # offset by a run which crashed.
+                missing = [presentment[0] for presentment, result
+                           in zip(valid, results) if not result]
+                done = (issuer.database.get_presented(missing) if missing
+                        else set())
+
+                results = iter(results)
+                for offset, line, presentment, errors in chunk:
+                    if presentment is not None:
+                        if next(results):
+                            presented += 1
+                            continue
+                        if presentment[0] in done:
+                            skipped += 1
+                            continue
+
+                    rejected += 1
+                    reason = errors or 'Authorisation not found'
+                    rejects.write(json.dumps({'line': line,
+                                              'reason': reason}) + '\n')
+
+                rejects.flush()
+                self._write_offset(state_file, offset)
+                self.stdout.write('Committed up to byte {}'.format(offset))
+
+        message = '{} presentments set, {} already set, {} rejected'
+        self.stdout.write(self.style.SUCCESS(message.format(presented,
+                                                            skipped,
+                                                            rejected)))
+
+    def _read_offset(self, state_file):
+        try:
+            with open(state_file) as f:
+                return int(f.read())
+        except FileNotFoundError:
+            return 0
+
+    def _write_offset(self, state_file, offset):
+        # Replaces the state file atomically, a crash never leaves it empty.
+        with open(state_file + '.tmp', 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(state_file + '.tmp', state_file)
@@ -0,0 +1,175 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import io
+import json
+import statistics
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from cards import issuer
+from cards.accounting.models import Account
+from cards.api.asgi import application as asgi_application
+from cards.wsgi import application as wsgi_application
+
+
+def authorisation_body(card_id, currency):
+    return json.dumps({
+        'card_id': card_id,
+        'transaction_id': uuid.uuid4().hex[:10],
+        'merchant_name': 'Load test',
+        'merchant_country': 'BR',
+        'merchant_mcc': 1234,
+        'billing_amount': 1,
+        'billing_currency': currency,
+        'transaction_amount': 1,
+        'transaction_currency': currency}).encode('utf-8')
+
+
+def summarize(results, elapsed):
+    """Summarizes the (latency, status code) of the webhooks, any status
+    other than approved or declined is an error."""
+    latencies = sorted(latency for latency, status_code in results)
+    return {'rate': len(latencies) / elapsed,
+            'p50': statistics.median(latencies) * 1000,
+            'p99': latencies[int(len(latencies) * 0.99)] * 1000,
+            'errors': sum(status_code not in (201, 403)
+                          for latency, status_code in results)}
+
+
+class Command(BaseCommand):
+    help = ('Load tests the authorisation webhook in process, for each '
+            'concurrency level: on the WSGI deployment served by a fixed '
+            'number of worker threads and on the ASGI deployment served by a '
+            'single event loop. Load test cards and transactions are left on '
+            'the database, use a scratch one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency',
+                            type=int,
+                            nargs='+',
+                            default=[1, 8, 32, 128],
+                            help='Concurrent webhooks in flight.')
+        parser.add_argument('--requests',
+                            type=int,
+                            default=400,
+                            help='Webhooks by concurrency level.')
+        parser.add_argument('--wsgi-threads',
+                            type=int,
+                            default=8,
+                            help='Threads of the WSGI worker.')
+        parser.add_argument('--cards', type=int, default=100)
+        parser.add_argument('--currency', default='BRL')
+
+    def handle(self, *args, **params):
+        currency = params['currency']
+        cards = ['LOAD{:05d}'.format(i) for i in range(params['cards'])]
+        amount = params['requests'] * len(params['concurrency']) * 2
+
+        for card_id in cards:
+            Account.objects.get_or_create(card_id=card_id, currency=currency)
+        issuer.service.load_money_bulk((card_id, amount, currency)
+                                       for card_id in cards)
+        connection.close()
+
+        bodies = (authorisation_body(cards[i % len(cards)], currency)
+                  for i in iter(int, 1))
+
+        message = ('{deployment} concurrency {concurrency}: {rate:.0f}/s, '
+                   'p50 {p50:.2f}ms, p99 {p99:.2f}ms, {errors} errors')
+        for concurrency in params['concurrency']:
+            for deployment, run in (('WSGI', self._wsgi),
+                                    ('ASGI', self._asgi)):
+                result = run(bodies, concurrency, params)
+                self.stdout.write(message.format(deployment=deployment,
+                                                 concurrency=concurrency,
+                                                 **result))
+
+    def _wsgi(self, bodies, concurrency, params):
+        """Each client waits for a free worker thread, as the WSGI server
+        does with the connections above its threads."""
+        workers = threading.BoundedSemaphore(params['wsgi_threads'])
+        lock = threading.Lock()
+
+        def client(count):
+            latencies = []
+            for i in range(count):
+                with lock:
+                    body = next(bodies)
+                start = time.perf_counter()
+                with workers:
+                    status_code = self._wsgi_post(body)
+                latencies.append((time.perf_counter() - start, status_code))
+            connection.close()
+            return latencies
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = executor.map(
+                client, self._split(params['requests'], concurrency))
+            latencies = sum(results, [])
+        return summarize(latencies, time.perf_counter() - start)
+
+    def _wsgi_post(self, body):
+        environ = {'REQUEST_METHOD': 'POST',
+                   'PATH_INFO': '/api/fast/authorisation/',
+                   'CONTENT_TYPE': 'application/json',
+                   'CONTENT_LENGTH': str(len(body)),
+                   'SERVER_NAME': 'localhost',
+                   'SERVER_PORT': '80',
+                   'wsgi.url_scheme': 'http',
+                   'wsgi.input': io.BytesIO(body),
+                   'wsgi.errors': io.StringIO()}
+        status = []
+        response = wsgi_application(
+            environ, lambda status_line, headers: status.append(status_line))
+        response.close()
+        return int(status[0].split()[0])
+
+    def _asgi(self, bodies, concurrency, params):
+        async def post(body):
+            scope = {'type': 'http',
+                     'method': 'POST',
+                     'path': '/api/authorisation/',
+                     'headers': [(b'content-type', b'application/json')]}
+
+            async def receive():
+                return {'type': 'http.request', 'body': body}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            status = []
+            try:
+                await asgi_application(scope, receive, send)
+            except Exception:
+                # The ASGI server answers 500
+                return 500
+            return status[0]
+
+        async def client(count):
+            latencies = []
+            for i in range(count):
+                start = time.perf_counter()
+                status_code = await post(next(bodies))
+                latencies.append((time.perf_counter() - start, status_code))
+            return latencies
+
+        async def clients():
+            results = await asyncio.gather(*(
+                client(count)
+                for count in self._split(params['requests'], concurrency)))
+            return sum(results, [])
+
+        start = time.perf_counter()
+        latencies = asyncio.new_event_loop().run_until_complete(clients())
+        return summarize(latencies, time.perf_counter() - start)
+
+    def _split(self, requests, clients):
+        """Splits the requests between the clients."""
+        return [requests // clients + (i < requests % clients)
+                for i in range(clients)]
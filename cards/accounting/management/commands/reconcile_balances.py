@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from cards import issuer
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the Accounts balances from the ledger and checks them '
+            'against the maintained balances.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix',
+                            action='store_true',
+                            help='Overwrites the diverging balances.')
+
+    def handle(self, *args, **params):
+        db = issuer.CardsIssuerDatabase()
+        message = ('Account {}:{} balance {} (ledger {}) held {} '
+                   '(authorisations {})')
+
+        unreconciled = db.get_unreconciled_accounts()
+        for account in unreconciled:
+            self.stdout.write(self.style.WARNING(message.format(*account)))
+
+        if params['fix'] and unreconciled:
+            fixed = db.reconcile_balances()
+            self.stdout.write(
+                self.style.SUCCESS('Fixed {} accounts'.format(fixed)))
+
+        elif not unreconciled:
+            self.stdout.write(self.style.SUCCESS('All accounts reconciled'))
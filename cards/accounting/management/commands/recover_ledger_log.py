@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from cards.ledger import LedgerWriter
+
+
+class Command(BaseCommand):
+    help = ('Writes the entries of a ledger log not yet written to the '
+            'database, e.g. the log left by a stopped process. The process '
+            'owning the log must not be running.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='The ledger log file.')
+        parser.add_argument('--name',
+                            help='The log position name, the absolute path '
+                                 'by default.')
+
+    def handle(self, *args, **params):
+        ledger = LedgerWriter(params['path'],
+                              name=params['name'],
+                              apply_interval_ms=None)
+        try:
+            written = ledger.flush()
+        finally:
+            ledger.stop()
+
+        self.stdout.write(
+            self.style.SUCCESS('Recovered {} entries'.format(written)))
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from cards import issuer
+
+
+class Command(BaseCommand):
+    help = ('Daily settlement: expires the authorisations not presented '
+            'in time, releasing their holds, and sums the presentments '
+            'settled with the Scheme by currency. Runs online, each chunk '
+            'of authorisations is expired by its own short transaction.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date',
+                            help='Settlement day, YYYY-MM-DD. Yesterday by '
+                                 'default.')
+        parser.add_argument('--expiry-days',
+                            type=int,
+                            default=settings.AUTHORISATION_EXPIRY_DAYS,
+                            help='Authorisations older than this many days '
+                                 'are expired.')
+        parser.add_argument('--chunk-size',
+                            type=int,
+                            default=issuer.CardsIssuerDatabase.CHUNK_SIZE,
+                            help='Authorisations expired by database '
+                                 'transaction.')
+
+    def handle(self, *args, **params):
+        if params['date']:
+            try:
+                day = datetime.strptime(params['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Invalid date "{}", expected YYYY-MM-DD'
+                                   .format(params['date']))
+        else:
+            day = timezone.localdate() - timedelta(days=1)
+
+        until = timezone.now() - timedelta(days=params['expiry_days'])
+        start = time.perf_counter()
+        expired = issuer.database.expire_authorisations(until,
+                                                        params['chunk_size'])
+        elapsed = time.perf_counter() - start
+
+        message = 'Expired {} authorisations in {:.2f}s, {:.0f} rows/s'
+        self.stdout.write(self.style.SUCCESS(message.format(
+            expired, elapsed, expired / elapsed if elapsed else 0)))
+
+        start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+        totals = issuer.database.get_settlement_totals(
+            start, start + timedelta(days=1))
+
+        message = 'Settlement {} {}: {:.2f} ({} presentments)'
+        for currency, (amount, count) in sorted(totals.items()):
+            self.stdout.write(message.format(day, currency, amount, count))
+
+        if not totals:
+            self.stdout.write(self.style.WARNING(
+                'No presentments settled on {}'.format(day)))
@@ -1,11 +1,29 @@
 from django.db.models.functions import Coalesce
 from django.db.models import (
-    Manager, QuerySet, Sum, F, OuterRef, Subquery, DecimalField)
+    Manager, QuerySet, Sum, F, Q, OuterRef, Subquery, Exists, Case, When,
+    Value, DecimalField)
 
 
 DECIMAL_OUTPUT = DecimalField(decimal_places=2)
 
 
+def sum_subquery(queryset, field):
+    """Returns a correlated Subquery summarizing a field for each Account.
+
+    :param queryset: The queryset already filtered by ``OuterRef('pk')``
+    :type queryset: QuerySet
+
+    :param field: The field name to be summarized.
+    :type field: str
+    """
+    total = (queryset
+             .order_by()
+             .values('account')
+             .annotate(total=Sum(field))
+             .values('total'))
+    return Coalesce(Subquery(total, output_field=DECIMAL_OUTPUT), 0)
+
+
 class AccountManager(Manager):
     """Manager for Account model. """
 
@@ -15,18 +33,74 @@ class AccountManager(Manager):
     def balance(self, *ar, **kw):
         return self.get_queryset().balance(*ar, **kw)
 
+    def unreconciled(self, *ar, **kw):
+        return self.get_queryset().unreconciled(*ar, **kw)
+
+    def checkpoints_until(self, *ar, **kw):
+        return self.get_queryset().checkpoints_until(*ar, **kw)
+
+    def move_funds_many(self, *ar, **kw):
+        return self.get_queryset().move_funds_many(*ar, **kw)
+
 
 class AccountManagerQuerySet(QuerySet):
     """ManagerQuerySet for Account model. """
 
     def balance(self):
-        """Summarizes the balance for the Account."""
+        """Recomputes the balance for the Account from the whole ledger, the
+        result is annotated as ``ledger_balance`` to not clash with the
+        maintained ``balance`` field."""
         balance = (F('journals_sum') -
                    F('authorisations_sum'))
         return (self
                 .journals_sum()
                 .authorisations_sum()
-                .annotate(balance=balance))
+                .annotate(ledger_balance=balance))
+
+    def unreconciled(self):
+        """Filters the Accounts which maintained ``balance`` or
+        ``held_amount`` doesn't match the ledger recomputation."""
+        return (self
+                .balance()
+                .filter(~Q(balance=F('ledger_balance')) |
+                        ~Q(held_amount=F('authorisations_sum'))))
+
+    def move_funds(self, amount=0, held_amount=0):
+        """Updates the maintained balance of the Accounts using a single
+        UPDATE statement, safe to be called concurrently.
+
+        :param amount: Amount added to the available balance.
+        :type amount: Decimal
+
+        :param held_amount: Amount added to the authorisations holds.
+        :type held_amount: Decimal
+
+        :returns: int -- The number of rows updated.
+        """
+        return self.update(balance=F('balance') + amount,
+                           held_amount=F('held_amount') + held_amount)
+
+    def move_funds_many(self, movements):
+        """Updates the maintained balance of many Accounts, each one by its
+        own amounts, using a single UPDATE statement.
+
+        :param movements: Tuples of (amount, held_amount) by Account id.
+        :type movements: dict
+
+        :returns: int -- The number of rows updated.
+        """
+        amounts = [When(pk=pk, then=Value(amount))
+                   for pk, (amount, held_amount) in movements.items()]
+        held_amounts = [When(pk=pk, then=Value(held_amount))
+                        for pk, (amount, held_amount) in movements.items()]
+        return (self
+                .filter(pk__in=movements)
+                .move_funds(Case(*amounts,
+                                 default=Value(0),
+                                 output_field=DECIMAL_OUTPUT),
+                            Case(*held_amounts,
+                                 default=Value(0),
+                                 output_field=DECIMAL_OUTPUT)))
 
     def authorisations_sum(self):
         """Summarizes the transactions authorisations for the Account."""
@@ -34,16 +108,78 @@ class AccountManagerQuerySet(QuerySet):
         authorisations = (Transaction.objects
                           .authorisations()
                           .filter(account=OuterRef('pk')))
-        subquery = Subquery(authorisations.values('billing_amount'),
-                            output_field=DECIMAL_OUTPUT)
-        authorisations_sum = Sum(subquery)
-        return self.annotate(authorisations_sum=Coalesce(authorisations_sum,
-                                                         0))
+        return self.annotate(
+            authorisations_sum=sum_subquery(authorisations, 'billing_amount'))
+
+    def checkpoint(self):
+        """Annotates the latest AccountCheckpoint balance and journal id for
+        the Account, zero when there is no checkpoint."""
+        from cards.accounting.models import AccountCheckpoint
+        latest = (AccountCheckpoint.objects
+                  .filter(account=OuterRef('pk'))
+                  .order_by('-journal_id'))
+        balance = Subquery(latest.values('balance')[:1],
+                           output_field=DECIMAL_OUTPUT)
+        journal_id = Subquery(latest.values('journal_id')[:1])
+        return self.annotate(checkpoint_balance=Coalesce(balance, 0),
+                             checkpoint_journal_id=Coalesce(journal_id, 0))
 
     def journals_sum(self):
-        """Summarizes the journals for the Account."""
-        journals_sum = Sum('journals__amount')
-        return self.annotate(journals_sum=Coalesce(journals_sum, 0))
+        """Summarizes the journals for the Account, only the journals after
+        the latest checkpoint are scanned."""
+        from cards.accounting.models import Journal
+        journals = Journal.objects.filter(
+            account=OuterRef('pk'),
+            pk__gt=OuterRef('checkpoint_journal_id'))
+        journals_sum = (F('checkpoint_balance') +
+                        sum_subquery(journals, 'amount'))
+        return (self
+                .checkpoint()
+                .annotate(journals_sum=journals_sum))
+
+    def checkpoints_until(self, journal_id):
+        """Summarizes the journals balance up to a journal id for the Accounts
+        which have journals since their latest checkpoint.
+
+        :param journal_id: The last journal id included.
+        :type journal_id: int
+        """
+        from cards.accounting.models import Journal
+        journals = Journal.objects.filter(
+            account=OuterRef('pk'),
+            pk__gt=OuterRef('checkpoint_journal_id'),
+            pk__lte=journal_id)
+        balance = F('checkpoint_balance') + sum_subquery(journals, 'amount')
+        return (self
+                .checkpoint()
+                .annotate(has_journals=Exists(journals))
+                .filter(has_journals=True)
+                .annotate(checkpoint_until=balance))
+
+
+class AccountCheckpointManager(Manager):
+    """Manager for AccountCheckpoint model. """
+
+    def create_until(self, journal_id):
+        """Writes a checkpoint for every Account with journals since its
+        latest checkpoint.
+
+        :param journal_id: The last journal id included by the checkpoints.
+        :type journal_id: int
+
+        :returns: int -- The number of checkpoints created.
+        """
+        from cards.accounting.models import Account
+        accounts = (Account.objects
+                    .using(self.db)
+                    .checkpoints_until(journal_id)
+                    .values_list('pk', 'checkpoint_until'))
+        checkpoints = [self.model(account_id=pk,
+                                  journal_id=journal_id,
+                                  balance=balance)
+                       for pk, balance in accounts.iterator()]
+        self.bulk_create(checkpoints, batch_size=500)
+        return len(checkpoints)
 
 
 class TransactionManager(Manager):
@@ -0,0 +1,76 @@
+# Generated by Django 2.0.4 on 2026-10-18 00:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Account',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('card_id', models.CharField(db_index=True, max_length=10)),
+                ('currency', models.CharField(db_index=True, max_length=3)),
+            ],
+            options={
+                'unique_together': {('card_id', 'currency')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Batch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creation_date', models.DateTimeField(auto_now_add=True)),
+                ('modification_date', models.DateTimeField(auto_now=True)),
+                ('description', models.TextField()),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Transaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creation_date', models.DateTimeField(auto_now_add=True)),
+                ('modification_date', models.DateTimeField(auto_now=True)),
+                ('account', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='accounting.Account')),
+                ('presentment_batch', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='accounting.Batch')),
+                ('transaction_id', models.CharField(db_index=True, max_length=10)),
+                ('transaction_type', models.CharField(choices=[('a', 'authorisation'), ('p', 'presentment')], db_index=True, default='a', max_length=1)),
+                ('merchant_name', models.CharField(max_length=100)),
+                ('merchant_country', models.CharField(max_length=5)),
+                ('merchant_mcc', models.PositiveIntegerField()),
+                ('billing_amount', models.DecimalField(decimal_places=2, max_digits=9)),
+                ('billing_currency', models.CharField(max_length=3)),
+                ('transaction_amount', models.DecimalField(decimal_places=2, max_digits=9)),
+                ('transaction_currency', models.CharField(max_length=3)),
+                ('settlement_amount', models.DecimalField(decimal_places=2, max_digits=9, null=True)),
+                ('settlement_currency', models.CharField(max_length=3, null=True)),
+            ],
+            options={
+                'ordering': ('creation_date',),
+            },
+        ),
+        migrations.CreateModel(
+            name='Journal',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creation_date', models.DateTimeField(auto_now_add=True)),
+                ('modification_date', models.DateTimeField(auto_now=True)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='journals', to='accounting.Batch')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='journals', to='accounting.Account')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=9)),
+            ],
+            options={
+                'ordering': ('creation_date',),
+            },
+        ),
+    ]
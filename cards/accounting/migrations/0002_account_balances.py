@@ -0,0 +1,80 @@
+# Generated by Django 2.0.4 on 2026-10-18 00:42
+
+from django.db import migrations, models
+from django.db.models import DecimalField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+AUTHORISATION = 'a'
+
+DECIMAL_OUTPUT = DecimalField(decimal_places=2)
+
+
+def sum_by_account(queryset, field):
+    """Returns a correlated Subquery summarizing a field for each Account,
+    zero when there is nothing to summarize."""
+    total = (queryset
+             .filter(account=OuterRef('pk'))
+             .order_by()
+             .values('account')
+             .annotate(total=Sum(field))
+             .values('total'))
+    return Coalesce(Subquery(total, output_field=DECIMAL_OUTPUT), 0)
+
+
+def backfill_balances(apps, schema_editor):
+    """Computes the maintained balances of the Accounts created before they
+    existed: the held amount is the open authorisations sum and the balance
+    the journals sum minus them, as the ledger recomputation does."""
+    Account = apps.get_model('accounting', 'Account')
+    Journal = apps.get_model('accounting', 'Journal')
+    Transaction = apps.get_model('accounting', 'Transaction')
+    using = schema_editor.connection.alias
+
+    journals = sum_by_account(Journal.objects.using(using), 'amount')
+    authorisations = sum_by_account(
+        Transaction.objects
+        .using(using)
+        .filter(transaction_type=AUTHORISATION),
+        'billing_amount')
+
+    (Account.objects
+     .using(using)
+     .update(balance=journals - authorisations,
+             held_amount=authorisations))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=11),
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='held_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=11),
+        ),
+        migrations.RunPython(backfill_balances, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='AccountCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creation_date', models.DateTimeField(auto_now_add=True)),
+                ('modification_date', models.DateTimeField(auto_now=True)),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=11)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='accounting.Account')),
+                ('journal', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='accounting.Journal')),
+            ],
+            options={
+                'unique_together': {('account', 'journal')},
+            },
+        ),
+    ]
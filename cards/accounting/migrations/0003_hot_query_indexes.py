@@ -0,0 +1,52 @@
+# Generated by Django 2.0.4 on 2026-10-18 00:42
+
+from django.db import migrations, models
+
+
+# Only the open authorisations are summarized as held funds, the partial
+# index skips the presentments which are the bulk of the table.
+OPEN_AUTHORISATIONS_INDEX = (
+    "CREATE INDEX accounting_tr_open_auth_idx "
+    "ON accounting_transaction (account_id, billing_amount) "
+    "WHERE transaction_type = 'a'")
+
+# SQLite drops it when a later migration rebuilds the table, the covering
+# composite index is used instead.
+DROP_OPEN_AUTHORISATIONS_INDEX = (
+    'DROP INDEX IF EXISTS accounting_tr_open_auth_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0002_account_balances'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='transaction_id',
+            field=models.CharField(max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='transaction_type',
+            field=models.CharField(choices=[('a', 'authorisation'), ('p', 'presentment')], default='a', max_length=1),
+        ),
+        migrations.AddIndex(
+            model_name='journal',
+            index=models.Index(fields=['account', 'id', 'amount'], name='accounting_jr_account_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['transaction_id', 'transaction_type'], name='accounting_tr_id_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'transaction_type', 'billing_amount'], name='accounting_tr_account_idx'),
+        ),
+        migrations.RunSQL(
+            OPEN_AUTHORISATIONS_INDEX,
+            DROP_OPEN_AUTHORISATIONS_INDEX,
+        ),
+    ]
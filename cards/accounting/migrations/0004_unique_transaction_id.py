@@ -0,0 +1,92 @@
+# Generated by Django 2.0.4 on 2026-10-18 00:44
+
+from django.db import IntegrityError, migrations, models
+from django.db.models import Count, F
+
+
+AUTHORISATION = 'a'
+
+# Fields of a Scheme retry which must match the original authorisation.
+PAYLOAD = ('account_id', 'merchant_name', 'merchant_country', 'merchant_mcc',
+           'billing_amount', 'billing_currency', 'transaction_amount',
+           'transaction_currency')
+
+# Transaction ids listed by the report of the unresolved duplicates.
+REPORT_SIZE = 20
+
+
+def resolve_duplicate_transaction_ids(apps, schema_editor):
+    """Removes the Scheme retries recorded before transaction_id was unique.
+
+    For every duplicated transaction id, the first transaction is kept. The
+    others are removed and their held funds are released. This only
+    happens when they are open authorisations with the same payload. Any
+    other duplicate needs a manual decision, so the migration fails and
+    reports the duplicates. Nothing is changed in that case.
+    """
+    Account = apps.get_model('accounting', 'Account')
+    Transaction = apps.get_model('accounting', 'Transaction')
+    using = schema_editor.connection.alias
+
+    duplicated = (Transaction.objects
+                  .using(using)
+                  .order_by()
+                  .values('transaction_id')
+                  .annotate(count=Count('pk'))
+                  .filter(count__gt=1)
+                  .values_list('transaction_id', flat=True))
+
+    retries = []
+    unresolved = []
+    for transaction_id in duplicated:
+        original, *others = (Transaction.objects
+                             .using(using)
+                             .filter(transaction_id=transaction_id)
+                             .order_by('pk')
+                             .values('pk', 'transaction_type', *PAYLOAD))
+        payload = [original[i] for i in PAYLOAD]
+        if all(other['transaction_type'] == AUTHORISATION and
+               [other[i] for i in PAYLOAD] == payload for other in others):
+            retries.extend(others)
+        else:
+            unresolved.append(transaction_id)
+
+    if unresolved:
+        raise IntegrityError(
+            '{} transaction ids are used by different transactions or '
+            'presented more than once, resolve them before making '
+            'transaction_id unique: {}'.format(
+                len(unresolved), ', '.join(unresolved[:REPORT_SIZE])))
+
+    for retry in retries:
+        (Account.objects
+         .using(using)
+         .filter(pk=retry['account_id'])
+         .update(balance=F('balance') + retry['billing_amount'],
+                 held_amount=F('held_amount') - retry['billing_amount']))
+
+    (Transaction.objects
+     .using(using)
+     .filter(pk__in=[retry['pk'] for retry in retries])
+     .delete())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0003_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(resolve_duplicate_transaction_ids,
+                             migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='accounting_tr_id_type_idx',
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='transaction_id',
+            field=models.CharField(max_length=10, unique=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.0.4 on 2026-10-18 01:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0005_ledger_log_position'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionRoute',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creation_date', models.DateTimeField(auto_now_add=True)),
+                ('modification_date', models.DateTimeField(auto_now=True)),
+                ('transaction_id', models.CharField(max_length=10, unique=True)),
+                ('shard', models.CharField(max_length=100)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.0.4 on 2026-10-18 01:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0006_transaction_route'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='transaction_type',
+            field=models.CharField(choices=[('a', 'authorisation'), ('p', 'presentment'), ('e', 'expired')], default='a', max_length=1),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['transaction_type', 'creation_date'], name='accounting_tr_type_date_idx'),
+        ),
+    ]
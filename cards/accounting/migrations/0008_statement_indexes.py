@@ -0,0 +1,29 @@
+# Generated by Django 2.0.4 on 2026-10-18 01:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0007_authorisation_expiry'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='journal',
+            options={},
+        ),
+        migrations.AlterModelOptions(
+            name='transaction',
+            options={},
+        ),
+        migrations.AddIndex(
+            model_name='journal',
+            index=models.Index(fields=['account', 'creation_date', 'id'], name='accounting_jr_statement_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'transaction_type', 'creation_date', 'id'], name='accounting_tr_statement_idx'),
+        ),
+    ]
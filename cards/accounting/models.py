@@ -1,6 +1,8 @@
 from django.db import models
 
-from cards.accounting.managers import AccountManager, TransactionManager
+from cards.accounting.managers import (AccountManager,
+                                       AccountCheckpointManager,
+                                       TransactionManager, )
 
 
 class TrackerModel(models.Model):
@@ -24,8 +26,11 @@ class Account(models.Model):
     :param currency: The account currency code, 3 characters lengh
     :type currency: str
 
-    :param balance: The consolided balance
+    :param balance: The consolided balance, journals minus authorisations.
     :type balance: Decimal
+
+    :param held_amount: The sum of the authorisations holds.
+    :type held_amount: Decimal
     """
     objects = AccountManager()
 
@@ -33,6 +38,14 @@ class Account(models.Model):
 
     currency = models.CharField(max_length=3, db_index=True)
 
+    balance = models.DecimalField(max_digits=11,
+                                  decimal_places=2,
+                                  default=0)
+
+    held_amount = models.DecimalField(max_digits=11,
+                                      decimal_places=2,
+                                      default=0)
+
     class Meta:
         unique_together = ('card_id', 'currency')
 
@@ -68,7 +81,59 @@ class Journal(TrackerModel):
     amount = models.DecimalField(max_digits=9, decimal_places=2)
 
     class Meta:
-        ordering = ('creation_date', )
+        indexes = [
+            # Covers the journals sum after the latest checkpoint.
+            models.Index(fields=['account', 'id', 'amount'],
+                         name='accounting_jr_account_idx'),
+            # Covers the statement keyset pagination.
+            models.Index(fields=['account', 'creation_date', 'id'],
+                         name='accounting_jr_statement_idx'),
+        ]
+
+
+class AccountCheckpoint(TrackerModel):
+    """Holds the Account journals balance up to a journal, so the balance is
+    recomputed only from the journals after the latest checkpoint.
+
+    :params account: The checkpoint Account
+    :type account: Account
+
+    :params journal: The last journal included on the balance.
+    :type journal: Journal
+
+    :param balance: The journals sum up to the journal.
+    :type balance: Decimal
+    """
+    objects = AccountCheckpointManager()
+
+    account = models.ForeignKey('Account',
+                                related_name='checkpoints',
+                                on_delete=models.CASCADE)
+
+    journal = models.ForeignKey('Journal',
+                                related_name='+',
+                                on_delete=models.PROTECT)
+
+    balance = models.DecimalField(max_digits=11, decimal_places=2)
+
+    class Meta:
+        unique_together = ('account', 'journal')
+
+
+class LedgerLogPosition(TrackerModel):
+    """Holds the last entry of a ledger log written to the database, it's
+    updated in the same database transaction of the entries, see
+    cards.ledger.LedgerWriter.
+
+    :param name: The ledger log name.
+    :type name: str
+
+    :param seq: Sequence of the last entry written.
+    :type seq: int
+    """
+    name = models.CharField(max_length=255, unique=True)
+
+    seq = models.BigIntegerField(default=0)
 
 
 class Transaction(TrackerModel):
@@ -117,9 +182,11 @@ class Transaction(TrackerModel):
     """
     AUTHORISATION = 'a'
     PRESENTMENT = 'p'
+    EXPIRED = 'e'
     TRANSACTION_TYPE_CHOICES = (
         (AUTHORISATION, 'authorisation'),
         (PRESENTMENT, 'presentment'),
+        (EXPIRED, 'expired'),
     )
 
     objects = TransactionManager()
@@ -133,11 +200,9 @@ class Transaction(TrackerModel):
                                           on_delete=models.SET_NULL,
                                           null=True)
 
-    transaction_id = models.CharField(db_index=True,
-                                      max_length=10)
+    transaction_id = models.CharField(max_length=10, unique=True)
 
-    transaction_type = models.CharField(db_index=True,
-                                        default=AUTHORISATION,
+    transaction_type = models.CharField(default=AUTHORISATION,
                                         max_length=1,
                                         choices=TRANSACTION_TYPE_CHOICES)
 
@@ -165,9 +230,38 @@ class Transaction(TrackerModel):
                                            null=True)
 
     class Meta:
-        ordering = ('creation_date', )
+        indexes = [
+            # Covers the authorisations sum of an Account.
+            models.Index(fields=['account', 'transaction_type',
+                                 'billing_amount'],
+                         name='accounting_tr_account_idx'),
+            # Covers the lookup of the authorisations to expire.
+            models.Index(fields=['transaction_type', 'creation_date'],
+                         name='accounting_tr_type_date_idx'),
+            # Covers the statement keyset pagination.
+            models.Index(fields=['account', 'transaction_type',
+                                 'creation_date', 'id'],
+                         name='accounting_tr_statement_idx'),
+        ]
 
     def __str__(self):
         return '{} => {}'.format(
             self.transaction_id,
             self.get_transaction_type_display())
+
+
+class TransactionRoute(TrackerModel):
+    """Holds the shard of each authorisation, the presentments look up the
+    authorisation shard by its transaction id. Lives on the default
+    database, only written when there are many shards, see
+    cards.sharding.
+
+    :param transaction_id: Transaction unique ID.
+    :type transaction_id: str
+
+    :param shard: The shard database alias.
+    :type shard: str
+    """
+    transaction_id = models.CharField(max_length=10, unique=True)
+
+    shard = models.CharField(max_length=100)
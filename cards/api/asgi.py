@@ -0,0 +1,198 @@
+"""ASGI handlers of the Scheme webhooks. The payload is validated as by
+the fast path handlers and the async service is awaited, so a single worker
+keeps accepting webhooks while the database works."""
+import json
+from urllib.parse import parse_qs
+
+from django.conf import settings
+
+from cards import issuer
+from cards.api import fast, idempotency
+from issuer.db import (AccountNotFound, AuthorisationNotFound,
+                       DuplicateTransaction, )
+
+
+JSON_HEADERS = [(b'content-type', b'application/json')]
+
+
+class RequestTooLarge(Exception):
+    """The request body is over the size limit."""
+
+
+async def read_body(receive, max_size=None):
+    """Reads the whole request body.
+
+    :param receive: The ASGI receive channel.
+    :type receive: callable
+
+    :param max_size: The body size limit in bytes, None for no limit.
+    :type max_size: int
+
+    :rtype: bytes
+
+    :raises: RequestTooLarge
+    """
+    chunks = []
+    size = 0
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if max_size is not None and size > max_size:
+            raise RequestTooLarge()
+        chunks.append(chunk)
+        more_body = message.get('more_body', False)
+    return b''.join(chunks)
+
+
+def read_payload(headers, body):
+    """Reads a JSON or form encoded payload.
+
+    >>> read_payload({}, b'a=1&b=')
+    {'a': '1', 'b': ''}
+
+    :param headers: The request headers, by lower case name.
+    :type headers: dict
+
+    :param body: The request body.
+    :type body: bytes
+
+    :returns: dict -- None when the payload is malformed.
+    """
+    content_type = headers.get(b'content-type', b'').split(b';')[0]
+    try:
+        if content_type == b'application/json':
+            data = json.loads(body.decode('utf-8'))
+            return data if isinstance(data, dict) else None
+
+        return {name: values[-1] for name, values in
+                parse_qs(body.decode('utf-8'),
+                         keep_blank_values=True).items()}
+
+    except ValueError:
+        return None
+
+
+async def authorisation(payload):
+    """Makes an authorisation, answers as AuthorisationView does.
+
+    :returns: tuple -- (status code, errors)
+    """
+    values, errors = fast.validate_authorisation(payload)
+    if errors:
+        return 400, errors
+
+    try:
+        success = await issuer.async_service.make_authorisation(**values)
+
+    except AccountNotFound:
+        return 404, None
+
+    except DuplicateTransaction:
+        return 409, None
+
+    else:
+        return (201 if success else 403), None
+
+
+async def presentment(payload):
+    """Sets a presentment, answers as PresentmentView does.
+
+    :returns: tuple -- (status code, errors)
+    """
+    values, errors = fast.validate_presentment(payload)
+    if errors:
+        return 400, errors
+
+    try:
+        await issuer.async_service.set_presentment(**values)
+
+    except AuthorisationNotFound:
+        return 404, None
+
+    else:
+        return 200, None
+
+
+# Handlers by path, the name of the responses cache and its final statuses.
+ROUTES = {
+    '/api/authorisation/': (authorisation, 'authorisation', (201, 409)),
+    '/api/presentment/': (presentment, 'presentment', (200, )),
+}
+
+
+async def call_cache(cache, method, *args):
+    """Calls a responses cache method. With a shared backend it's called on
+    the async database pool, the event loop doesn't wait on the network.
+
+    :param cache: The responses cache.
+    :type cache: cards.api.idempotency.IdempotencyCache
+
+    :param method: The method name, get or set.
+    :type method: str
+
+    :returns: The method result.
+    """
+    fn = getattr(cache, method)
+    if cache.shared:
+        return await issuer.async_service.run(fn, *args)
+    return fn(*args)
+
+
+async def send_response(send, status_code, data=None):
+    body = json.dumps(data).encode('utf-8') if data is not None else b''
+    await send({'type': 'http.response.start',
+                'status': status_code,
+                'headers': JSON_HEADERS if body else []})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """The ASGI 3 application of the Scheme webhooks."""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    try:
+        handler, name, final_statuses = ROUTES[scope['path']]
+    except KeyError:
+        return await send_response(send, 404)
+
+    if scope['method'] != 'POST':
+        return await send_response(send, 405)
+
+    headers = dict(scope.get('headers', ()))
+    try:
+        body = await read_body(receive, settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+    except RequestTooLarge:
+        return await send_response(send, 413,
+                                   {'detail': 'Request body too large.'})
+
+    payload = read_payload(headers, body)
+    if payload is None:
+        return await send_response(send, 400, {'detail': 'Malformed request.'})
+
+    cache = idempotency.get_cache(name)
+    key = idempotency.payload_key(
+        payload, headers.get(b'idempotency-key', b'').decode('latin-1'))
+    if key is not None:
+        status_code = await call_cache(cache, 'get', *key)
+        if status_code is not None:
+            return await send_response(send, status_code)
+
+    status_code, errors = await handler(payload)
+
+    if key is not None and status_code in final_statuses:
+        await call_cache(cache, 'set', *key, status_code)
+
+    await send_response(send, status_code, errors)
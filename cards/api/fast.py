@@ -0,0 +1,238 @@
+"""Plain Django handlers for the latency critical Scheme webhooks. They
+answer as the DRF views do, but the fixed schema payload is checked by a
+validator compiled once instead of a serializer built by request."""
+from decimal import Decimal, InvalidOperation
+import json
+import re
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from cards import issuer
+from cards.api import idempotency
+from issuer.db import AccountNotFound, DuplicateTransaction
+
+
+REQUIRED = 'This field is required.'
+
+# Same guard and trailing zero decimals of DRF IntegerField
+MAX_STRING_LENGTH = 1000
+RE_DECIMAL = re.compile(r'\.0*\s*$')
+
+
+def char_field(value):
+    """Parses a required non blank string, as DRF CharField.
+
+    >>> char_field(' Game Store ')
+    'Game Store'
+    """
+    if not isinstance(value, (str, int, float, Decimal)) or \
+            isinstance(value, bool):
+        raise ValueError('Not a valid string.')
+    value = str(value).strip()
+    if not value:
+        raise ValueError('This field may not be blank.')
+    return value
+
+
+def integer_field(value):
+    """Parses an integer, as DRF IntegerField: the strings may have zero
+    decimal places, the booleans are invalid.
+
+    >>> integer_field('1234.0')
+    1234
+    """
+    if isinstance(value, str) and len(value) > MAX_STRING_LENGTH:
+        raise ValueError('String value too large.')
+    if isinstance(value, bool):
+        raise ValueError('A valid integer is required.')
+
+    try:
+        return int(RE_DECIMAL.sub('', str(value)))
+    except ValueError:
+        raise ValueError('A valid integer is required.')
+
+
+def decimal_field(max_digits, decimal_places, min_value):
+    """Returns a parser of a Decimal, as DRF DecimalField.
+
+    >>> decimal_field(11, 2, 1)('10.5')
+    Decimal('10.5')
+
+    :param max_digits: Maximum digits of the number.
+    :type max_digits: int
+
+    :param decimal_places: Maximum decimal places.
+    :type decimal_places: int
+
+    :param min_value: The minimum value allowed.
+    :type min_value: int
+    """
+    min_value = Decimal(min_value)
+    whole_digits = max_digits - decimal_places
+
+    def parse(value):
+        try:
+            value = Decimal(str(value).strip())
+        except InvalidOperation:
+            raise ValueError('A valid number is required.')
+
+        if not value.is_finite():
+            raise ValueError('A valid number is required.')
+
+        sign, digits, exponent = value.as_tuple()
+        places = max(-exponent, 0)
+        if places > decimal_places:
+            raise ValueError('Ensure that there are no more than {} decimal '
+                             'places.'.format(decimal_places))
+        if len(digits) - places > whole_digits:
+            raise ValueError('Ensure that there are no more than {} digits '
+                             'before the decimal point.'.format(whole_digits))
+        if value < min_value:
+            raise ValueError('Ensure this value is greater than or equal to '
+                             '{}.'.format(min_value))
+        return value
+
+    return parse
+
+
+def choice_field(choices):
+    """Returns a parser of a value from a fixed set, as DRF ChoiceField:
+    the value is matched by its string, so lists and objects are invalid
+    choices too.
+
+    >>> choice_field(['BRL'])('BRL')
+    'BRL'
+
+    :param choices: The allowed values.
+    :type choices: list
+    """
+    choices = {str(choice): choice for choice in choices}
+
+    def parse(value):
+        try:
+            return choices[str(value)]
+        except KeyError:
+            raise ValueError('"{}" is not a valid choice.'.format(value))
+
+    return parse
+
+
+def compile_validator(fields):
+    """Compiles a fixed schema into a validator function.
+
+    >>> validate = compile_validator((('mcc', integer_field), ))
+    >>> validate({'mcc': '1234'})
+    ({'mcc': 1234}, {})
+    >>> validate({})
+    ({}, {'mcc': ['This field is required.']})
+
+    :param fields: Tuples of (field name, parser), a parser raises
+                   ValueError with the error message.
+    :type fields: tuple
+
+    :returns: callable -- Validates a payload dict returning the parsed
+              values and the errors by field.
+    """
+    fields = tuple(fields)
+
+    def validate(data):
+        values = {}
+        errors = {}
+        for name, parse in fields:
+            try:
+                value = data[name]
+            except KeyError:
+                errors[name] = [REQUIRED]
+                continue
+
+            try:
+                values[name] = parse(value)
+            except ValueError as exc:
+                errors[name] = [str(exc)]
+
+        return values, errors
+
+    return validate
+
+
+AMOUNT = decimal_field(max_digits=11, decimal_places=2, min_value=1)
+
+CURRENCY = choice_field(settings.CURRENCIES)
+
+# Same rules of AuthorisationSerializer
+validate_authorisation = compile_validator((
+    ('card_id', char_field),
+    ('transaction_id', char_field),
+    ('merchant_name', char_field),
+    ('merchant_country', char_field),
+    ('merchant_mcc', integer_field),
+    ('billing_amount', AMOUNT),
+    ('billing_currency', CURRENCY),
+    ('transaction_amount', AMOUNT),
+    ('transaction_currency', CURRENCY),
+))
+
+# Same rules of PresentmentSerializer
+validate_presentment = compile_validator((
+    ('transaction_id', char_field),
+    ('settlement_amount', AMOUNT),
+    ('settlement_currency', CURRENCY),
+))
+
+
+def read_payload(request):
+    """Reads a JSON or form encoded payload.
+
+    :returns: dict -- None when the payload is malformed.
+    """
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body.decode('utf-8'))
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+    return request.POST.dict()
+
+
+@csrf_exempt
+@require_POST
+def authorisation(request):
+    """Makes an authorisation, answers as AuthorisationView does and shares
+    its responses cache."""
+    cache = idempotency.get_cache('authorisation')
+    key = idempotency.request_key(request)
+    if key is not None:
+        status_code = cache.get(*key)
+        if status_code is not None:
+            return HttpResponse(status=status_code)
+
+    data = read_payload(request)
+    if data is None:
+        return JsonResponse({'detail': 'Malformed request.'}, status=400)
+
+    values, errors = validate_authorisation(data)
+    if errors:
+        return JsonResponse(errors, status=400)
+
+    try:
+        success = issuer.service.make_authorisation(**values)
+
+    except AccountNotFound:
+        return HttpResponse(status=404)
+
+    except DuplicateTransaction:
+        status_code = 409
+
+    else:
+        if not success:
+            return HttpResponse(status=403)
+        status_code = 201
+
+    if key is not None:
+        cache.set(*key, status_code)
+
+    return HttpResponse(status=status_code)
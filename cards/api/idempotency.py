@@ -0,0 +1,202 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+from cards.cache import LRUCache
+
+
+IDEMPOTENCY_KEY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+
+# Idempotency caches by endpoint name, created on the first use.
+CACHES = {}
+
+
+def get_cache(name):
+    """Returns the responses cache of an endpoint.
+
+    :param name: The endpoint name.
+    :type name: str
+
+    :rtype: IdempotencyCache
+    """
+    try:
+        return CACHES[name]
+    except KeyError:
+        return CACHES.setdefault(name, IdempotencyCache(name))
+
+
+def clear():
+    """Clears the in process responses caches of every endpoint."""
+    for cache in CACHES.values():
+        cache.clear()
+
+
+def request_key(request):
+    """Reads the idempotency key and the payload digest from a Django
+    request, without going through the DRF parsers. The key is the
+    Idempotency-Key header, defaulting to the payload transaction_id.
+
+    :param request: The Django request.
+    :type request: django.http.HttpRequest
+
+    :returns: tuple -- (key, digest), None when the payload can't be read.
+    """
+    if request.content_type == 'application/json':
+        try:
+            payload = json.loads(request.body.decode('utf-8'))
+        except ValueError:
+            return None
+    else:
+        payload = request.POST
+
+    return payload_key(payload, request.META.get(IDEMPOTENCY_KEY_HEADER))
+
+
+def payload_key(payload, key=None):
+    """Returns the idempotency key and the digest of a request payload.
+
+    :param payload: The JSON object or the form data.
+    :type payload: dict or QueryDict
+
+    :param key: The Idempotency-Key header, defaults to the payload
+                transaction_id.
+    :type key: str
+
+    :returns: tuple -- (key, digest), None when there is no key.
+    """
+    if hasattr(payload, 'lists'):
+        # A form field is read by its last value, as the ASGI handlers do,
+        # so a retry has the same digest whichever handler answers it.
+        payload = payload.dict()
+    if not isinstance(payload, dict):
+        return None
+
+    items = sorted((k, str(v)) for k, v in payload.items())
+
+    key = key or payload.get('transaction_id')
+    if not key:
+        return None
+
+    digest = hashlib.sha256(repr(items).encode('utf-8')).hexdigest()
+    return str(key), digest
+
+
+class IdempotencyCache:
+    """Final responses status codes of an endpoint by idempotency key. Looked
+    up on the in process LRU first and then on the shared backend, the
+    IDEMPOTENCY_CACHE setting BACKEND cache alias, if configured."""
+
+    def __init__(self, name):
+        """Instances the responses cache of an endpoint.
+
+        :param name: The endpoint name, prefixes the shared backend keys.
+        :type name: str
+        """
+        options = settings.IDEMPOTENCY_CACHE
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._ttl = options['TTL']
+        self._local = LRUCache(options['MAX_SIZE'], options['TTL'])
+        self._shared = (caches[options['BACKEND']] if options['BACKEND']
+                        else None)
+
+    @property
+    def shared(self):
+        """If the entries are shared by the processes, looking them up goes
+        through the backend, usually the network.
+
+        :rtype: bool
+        """
+        return self._shared is not None
+
+    def _shared_key(self, key):
+        return 'idempotency:{}:{}'.format(self.name, key)
+
+    def get(self, key, digest):
+        """Returns the cached status code of a request.
+
+        :param key: The idempotency key.
+        :type key: str
+
+        :param digest: The request payload digest, a request reusing the key
+                       with a different payload isn't answered from the
+                       cache.
+        :type digest: str
+
+        :returns: int -- The status code, None on a miss.
+        """
+        entry = self._local.get(key)
+        if entry is None and self._shared is not None:
+            entry = self._shared.get(self._shared_key(key))
+            if entry is not None:
+                self._local.set(key, entry)
+
+        if entry is None or entry[0] != digest:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, digest, status_code):
+        """Caches the status code of a request.
+
+        :param key: The idempotency key.
+        :type key: str
+
+        :param digest: The request payload digest.
+        :type digest: str
+
+        :param status_code: The response status code.
+        :type status_code: int
+        """
+        entry = (digest, status_code)
+        self._local.set(key, entry)
+        if self._shared is not None:
+            self._shared.set(self._shared_key(key), entry, self._ttl)
+
+    def clear(self):
+        """Clears the in process entries and the counters, the shared backend
+        entries are kept."""
+        self._local.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """Returns the hits and misses counters and the in process size.
+
+        :returns: dict
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._local)}
+
+
+class IdempotentMixin:
+    """Answers the Scheme retries of an APIView from the responses cache,
+    before the request is parsed and validated. Only the final status codes,
+    ``idempotent_statuses``, are cached."""
+
+    idempotency_name = None
+    idempotent_statuses = ()
+
+    def dispatch(self, request, *args, **kwargs):
+        cache = get_cache(self.idempotency_name)
+        key = request_key(request) if request.method == 'POST' else None
+
+        if key is not None:
+            status_code = cache.get(*key)
+            if status_code is not None:
+                return HttpResponse(status=status_code)
+
+        response = super().dispatch(request, *args, **kwargs)
+
+        if key is not None and response.status_code in \
+                self.idempotent_statuses:
+            cache.set(*key, response.status_code)
+
+        return response
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from cards.api import views
+from cards.api import fast, views
 
 
 urlpatterns = [
@@ -9,8 +9,28 @@ urlpatterns = [
          views.AuthorisationView.as_view(),
          name='authorisation'),
 
+    path('fast/authorisation/',
+         fast.authorisation,
+         name='authorisation-fast'),
+
     path('presentment/',
          views.PresentmentView.as_view(),
          name='presentment'),
 
+    path('presentments/',
+         views.PresentmentsView.as_view(),
+         name='presentments'),
+
+    path('balance/',
+         views.BalanceView.as_view(),
+         name='balance'),
+
+    path('accounts/<str:card_id>/<str:currency>/statement/',
+         views.StatementView.as_view(),
+         name='statement'),
+
+    path('idempotency/',
+         views.IdempotencyStatsView.as_view(),
+         name='idempotency'),
+
 ]
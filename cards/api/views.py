@@ -1,14 +1,25 @@
+import base64
+import binascii
+
+from django.utils.dateparse import parse_datetime
+
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import status
 
+from cards.api.idempotency import IdempotentMixin, CACHES
 from cards.api.serializers import (AuthorisationSerializer,
                                    PresentmentSerializer)
 from cards import issuer
-from issuer.db import AccountNotFound, AuthorisationNotFound
+from issuer.db import (AccountNotFound, AuthorisationNotFound,
+                       DuplicateTransaction, )
 
 
-class AuthorisationView(APIView):
+class AuthorisationView(IdempotentMixin, APIView):
+    idempotency_name = 'authorisation'
+    # Declined authorisations are evaluated again, see make_authorisation
+    idempotent_statuses = (status.HTTP_201_CREATED,
+                           status.HTTP_409_CONFLICT)
 
     def post(self, request, format=None):
         serializer = AuthorisationSerializer(data=request.data)
@@ -29,6 +40,9 @@ class AuthorisationView(APIView):
             except AccountNotFound:
                 return Response(status=status.HTTP_404_NOT_FOUND)
 
+            except DuplicateTransaction:
+                return Response(status=status.HTTP_409_CONFLICT)
+
             else:
                 if success:
                     return Response(status=status.HTTP_201_CREATED)
@@ -40,7 +54,9 @@ class AuthorisationView(APIView):
                             status=status.HTTP_400_BAD_REQUEST)
 
 
-class PresentmentView(APIView):
+class PresentmentView(IdempotentMixin, APIView):
+    idempotency_name = 'presentment'
+    idempotent_statuses = (status.HTTP_200_OK, )
 
     def post(self, request, format=None):
         serializer = PresentmentSerializer(data=request.data)
@@ -60,3 +76,141 @@ class PresentmentView(APIView):
         else:
             return Response(serializer.errors,
                             status=status.HTTP_400_BAD_REQUEST)
+
+
+class PresentmentsView(APIView):
+    """Sets a list of presentments at once, such as a clearing run. Answers
+    the status of each presentment in the request order."""
+
+    def post(self, request, format=None):
+        serializer = PresentmentSerializer(data=request.data, many=True)
+        if serializer.is_valid():
+            data = serializer.data
+            results = issuer.service.set_presentments(
+                (item['transaction_id'],
+                 item['settlement_amount'],
+                 item['settlement_currency'])
+                for item in data)
+
+            return Response([
+                {'transaction_id': item['transaction_id'],
+                 'status': (status.HTTP_200_OK if result
+                            else status.HTTP_404_NOT_FOUND)}
+                for item, result in zip(data, results)],
+                status=status.HTTP_200_OK)
+        else:
+            return Response(serializer.errors,
+                            status=status.HTTP_400_BAD_REQUEST)
+
+
+class IdempotencyStatsView(APIView):
+    """Answers the Scheme retries responses caches counters by endpoint."""
+
+    def get(self, request, format=None):
+        return Response({name: cache.stats()
+                         for name, cache in CACHES.items()})
+
+
+class BalanceView(APIView):
+    """Answers a card available balance in a currency, polled by the
+    customer apps. Cached by process for a couple of seconds, the writes
+    of the process invalidate it."""
+
+    def get(self, request, format=None):
+        card_id = request.query_params.get('card_id')
+        currency = request.query_params.get('currency')
+        if not card_id or not currency:
+            return Response({'detail': 'card_id and currency are required'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            balance = issuer.service.get_balance(card_id, currency)
+
+        except ValueError as exc:
+            return Response({'detail': str(exc)},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        except AccountNotFound:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        return Response({'card_id': card_id,
+                         'currency': currency,
+                         'balance': balance})
+
+
+def encode_cursor(position):
+    """Encodes a statement position into an opaque cursor.
+
+    :param position: A (creation_date, kind, id) tuple.
+    :type position: tuple
+
+    :rtype: str
+    """
+    date, kind, pk = position
+    value = '{}|{}|{}'.format(date.isoformat(), kind, pk)
+    return base64.urlsafe_b64encode(value.encode('ascii')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor made by encode_cursor.
+
+    :param cursor: The cursor.
+    :type cursor: str
+
+    :returns: tuple -- A (creation_date, kind, id) tuple.
+
+    :raises: ValueError
+    """
+    try:
+        value = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        date, kind, pk = value.decode('ascii').split('|')
+        date = parse_datetime(date)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+    if date is None:
+        raise ValueError('Invalid cursor')
+    return date, int(kind), int(pk)
+
+
+class StatementView(APIView):
+    """Answers a page of an Account statement, its journals and open
+    authorisations newest first, read from the replicas. The ``next`` URL
+    answers the next page, any page costs as the first one does."""
+    DEFAULT_LIMIT = 50
+    MAX_LIMIT = 200
+
+    def get(self, request, card_id, currency, format=None):
+        try:
+            limit = int(request.query_params.get('limit',
+                                                 self.DEFAULT_LIMIT))
+            cursor = request.query_params.get('cursor')
+            before = decode_cursor(cursor) if cursor else None
+        except ValueError as exc:
+            return Response({'detail': str(exc)},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if not 0 < limit <= self.MAX_LIMIT:
+            return Response({'detail': 'Invalid limit'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            (balance, held_amount), entries, position = (
+                issuer.read_database.get_statement(card_id, currency,
+                                                   before, limit))
+        except AccountNotFound:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        next_url = None
+        if position is not None:
+            query = request.query_params.copy()
+            query['cursor'] = encode_cursor(position)
+            next_url = request.build_absolute_uri(
+                '{}?{}'.format(request.path, query.urlencode()))
+
+        return Response({'card_id': card_id,
+                         'currency': currency,
+                         'balance': balance,
+                         'held_amount': held_amount,
+                         'results': entries,
+                         'next': next_url})
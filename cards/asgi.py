@@ -0,0 +1,16 @@
+"""
+ASGI config for cards project, serves the Scheme webhooks only.
+
+It exposes the ASGI callable as a module-level variable named
+``application``, e.g. ``uvicorn cards.asgi:application``.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "cards.settings")
+
+django.setup()
+
+from cards.api.asgi import application  # noqa: E402
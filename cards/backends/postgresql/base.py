@@ -0,0 +1,116 @@
+"""PostgreSQL backend with a per process connection pool and health checks
+of the persistent connections.
+
+Extra ``OPTIONS``, removed before connecting:
+
+- ``POOL_MIN_SIZE`` / ``POOL_MAX_SIZE`` -- The pool size, connections are
+  taken from the pool instead of being opened and given back to it instead
+  of being closed. The pool is disabled when ``POOL_MAX_SIZE`` is 0.
+- ``HEALTH_CHECKS`` -- Checks a reused connection is still usable before the
+  first query of each request, or when it's taken from the pool, broken
+  connections are replaced.
+
+With the pool, ``CONN_MAX_AGE`` should be 0: the connection is given back
+at the end of each request, a persistent one stays checked out by its
+thread. An exhausted pool raises OperationalError.
+"""
+import threading
+
+from django.db import OperationalError
+from django.db.backends.postgresql import base
+from psycopg2 import Error, pool
+
+
+POOLS = {}
+
+POOLS_LOCK = threading.Lock()
+
+POOL_OPTIONS = ('POOL_MIN_SIZE', 'POOL_MAX_SIZE', 'HEALTH_CHECKS')
+
+
+def is_usable(connection):
+    """Checks a psycopg2 connection is still usable, no transaction is left
+    open by the check."""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        if not connection.autocommit:
+            connection.rollback()
+    except Error:
+        return False
+    return True
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        options = self.settings_dict['OPTIONS']
+        self.pool_min_size = options.get('POOL_MIN_SIZE', 1)
+        self.pool_max_size = options.get('POOL_MAX_SIZE', 0)
+        self.health_checks = options.get('HEALTH_CHECKS', False)
+        self.health_check_done = False
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        for option in POOL_OPTIONS:
+            params.pop(option, None)
+        return params
+
+    def _get_pool(self, conn_params):
+        """Returns the process connection pool of this database alias."""
+        with POOLS_LOCK:
+            if self.alias not in POOLS:
+                POOLS[self.alias] = pool.ThreadedConnectionPool(
+                    self.pool_min_size,
+                    self.pool_max_size,
+                    **conn_params)
+            return POOLS[self.alias]
+
+    def get_new_connection(self, conn_params):
+        if not self.pool_max_size:
+            return super().get_new_connection(conn_params)
+
+        connection_pool = self._get_pool(conn_params)
+        try:
+            connection = connection_pool.getconn()
+            if self.health_checks and not is_usable(connection):
+                connection_pool.putconn(connection, close=True)
+                connection = connection_pool.getconn()
+        except pool.PoolError as exc:
+            # Not a psycopg2 DatabaseError, the callers wouldn't handle it.
+            raise OperationalError('No connection available from the {} '
+                                   'pool: {}'.format(self.alias, exc)) from exc
+
+        # Mimics the parent isolation level handling.
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = options.get('isolation_level',
+                                           connection.isolation_level)
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if not self.pool_max_size or self.connection is None:
+            return super()._close()
+
+        with self.wrap_database_errors:
+            # Open transactions are rolled back by the pool.
+            POOLS[self.alias].putconn(self.connection,
+                                      close=bool(self.connection.closed))
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        # A new request starts, the connection is checked again.
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if (self.health_checks and
+                not self.health_check_done and
+                self.connection is not None and
+                not self.in_atomic_block):
+            if not self.is_usable():
+                self.close()
+            self.health_check_done = True
+
+        super().ensure_connection()
@@ -0,0 +1,34 @@
+"""SQLite backend which tunes every new connection with PRAGMA statements,
+for single node deployments with concurrent requests.
+
+Extra ``OPTIONS``, removed before connecting:
+
+- ``PRAGMAS`` -- Ordered (name, value) pairs executed on each new
+  connection, e.g. ``journal_mode=WAL`` lets readers run while a
+  transaction is writing.
+- ``IMMEDIATE_TRANSACTIONS`` -- Transactions take the write lock on BEGIN.
+  A deferred transaction upgrading its read lock to a write lock fails
+  right away with "database is locked" instead of waiting the busy timeout.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('PRAGMAS', None)
+        params.pop('IMMEDIATE_TRANSACTIONS', None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict['OPTIONS'].get('PRAGMAS', ()):
+            connection.execute('PRAGMA {} = {}'.format(name, value))
+        return connection
+
+    def _start_transaction_under_autocommit(self):
+        if self.settings_dict['OPTIONS'].get('IMMEDIATE_TRANSACTIONS'):
+            self.cursor().execute('BEGIN IMMEDIATE')
+        else:
+            super()._start_transaction_under_autocommit()
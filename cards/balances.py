@@ -0,0 +1,104 @@
+"""Per process cache of the Accounts available balances, for the balance
+inquiries polled by the customer apps, see cards.issuer.CardsReadDatabase.
+Entries expire after BALANCE_CACHE TTL seconds and are invalidated when the
+database transaction changing the balance commits, by the writes of this
+process; the other processes see them once expired.
+
+The balances are read from a replica up to REPLICA_MAX_LAG seconds behind
+the primary, then cached for up to TTL seconds: an inquiry can be
+REPLICA_MAX_LAG + TTL seconds behind the primary, 7 with the defaults. The
+invalidations don't shorten it, a replica read right after a write of this
+process may miss it and is cached again. With a ledger log, the batches not
+written to the database yet aren't seen either, see cards.ledger."""
+from functools import partial
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from cards.cache import LRUCache
+
+
+# Account identity by (card_id, currency): (shard, account_id).
+ACCOUNTS = LRUCache(settings.BALANCE_CACHE['MAX_SIZE'], 24 * 60 * 60)
+
+# Available balances by (shard, account_id).
+BALANCES = LRUCache(settings.BALANCE_CACHE['MAX_SIZE'],
+                    settings.BALANCE_CACHE['TTL'])
+
+# Time of the last invalidation by (shard, account_id), a balance read
+# before it isn't cached.
+INVALIDATED = LRUCache(settings.BALANCE_CACHE['MAX_SIZE'],
+                       settings.BALANCE_CACHE['TTL'])
+
+
+def get_cached(card_id, currency):
+    """Returns a cached balance.
+
+    :param card_id: The card unique identification
+    :type card_id: str
+
+    :param currency: Currency code, 3 char long.
+    :type currency: str
+
+    :returns: Decimal -- The balance, None when not cached.
+    """
+    account = ACCOUNTS.get((card_id, currency))
+    if account is None:
+        return None
+    return BALANCES.get(account)
+
+
+def cache_balance(card_id, currency, account, balance, read_at):
+    """Caches a balance, unless the Account was invalidated after it was
+    read.
+
+    :param account: The Account (shard, account_id).
+    :type account: tuple
+
+    :param balance: The Account available balance.
+    :type balance: Decimal
+
+    :param read_at: time.monotonic() before the balance was read.
+    :type read_at: float
+    """
+    ACCOUNTS.set((card_id, currency), account)
+    invalidated = INVALIDATED.get(account)
+    if invalidated is None or invalidated < read_at:
+        BALANCES.set(account, balance)
+
+
+def invalidate(account_ids, using):
+    """Drops the cached balances of Accounts.
+
+    :param account_ids: The Accounts ids.
+    :type account_ids: list
+
+    :param using: The Accounts shard database alias.
+    :type using: str
+    """
+    now = time.monotonic()
+    for account_id in account_ids:
+        INVALIDATED.set((using, account_id), now)
+        BALANCES.delete((using, account_id))
+
+
+def invalidate_on_commit(account_ids, using):
+    """Drops the cached balances of Accounts once the database transaction
+    changing them commits, right away out of a transaction.
+
+    :param account_ids: The Accounts ids.
+    :type account_ids: list
+
+    :param using: The Accounts shard database alias.
+    :type using: str
+    """
+    transaction.on_commit(partial(invalidate, list(account_ids), using),
+                          using=using)
+
+
+def clear():
+    """Drops every cached balance."""
+    BALANCES.clear()
+    INVALIDATED.clear()
+    ACCOUNTS.clear()
@@ -0,0 +1,110 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache:
+    """Bounded in process cache. When full the least recently used entry is
+    evicted, entries expire after a time to live. Safe to be shared by
+    threads.
+
+    >>> cache = LRUCache(2, ttl=60)
+    >>> cache.set('a', 1)
+    >>> cache.set('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.set('c', 3)
+    >>> cache.get('b') is None
+    True
+    >>> cache.stats()
+    {'hits': 1, 'misses': 1, 'size': 2, 'maxsize': 2}
+    """
+
+    def __init__(self, maxsize, ttl, clock=time.monotonic):
+        """Instances a new cache.
+
+        :param maxsize: Maximum number of entries, zero disables the cache.
+        :type maxsize: int
+
+        :param ttl: Seconds an entry is kept.
+        :type ttl: float
+
+        :param clock: Returns the current time in seconds.
+        :type clock: callable
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Returns the entry value, the default when missing or expired.
+
+        :param key: The entry key.
+        :type key: hashable
+        """
+        with self._lock:
+            try:
+                expires, value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires <= self._clock():
+                del self._entries[key]
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Stores an entry, evicting the least recently used one when full.
+
+        :param key: The entry key.
+        :type key: hashable
+
+        :param value: The entry value.
+        :type value: object
+        """
+        if self.maxsize <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Removes an entry, if present.
+
+        :param key: The entry key.
+        :type key: hashable
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes all entries and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Returns the hits and misses counters and the cache size.
+
+        :returns: dict
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize}
@@ -1,11 +1,84 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+from decimal import Decimal
+from functools import partial
+from operator import itemgetter
+import random
+import threading
+import time
+
 from django.conf import settings
-from django.db import transaction
+from django.db import (transaction, connection, connections,
+                       close_old_connections, IntegrityError,
+                       OperationalError, DEFAULT_DB_ALIAS, )
+from django.db.models import Count, Q, Sum
+from django.utils.module_loading import import_string
+
+from cards.accounting.models import (Account, Journal, Transaction,
+                                     TransactionRoute, )
+from cards import balances
+from cards.cache import LRUCache
+from cards.replicas import get_read_db
+from cards.ledger import LedgerWriter, chunks, present, write_batch
+from cards.sharding import get_shard
+
+from issuer.aio import AsyncIssuerService, ThreadedIssuerDatabase
+from issuer.db import (IssuerDatabase, IssuerReadDatabase, InsufficientFunds,
+                       AccountNotFound, AuthorisationNotFound,
+                       DuplicateTransaction, )
+from issuer.fx import load_rates
+from issuer.service import IssuerService
+from issuer.velocity import VelocityLimits, load_rules
 
-from cards.accounting.models import Account, Transaction, Batch
 
-from issuer.db import (IssuerDatabase, InsufficientFunds, AccountNotFound,
-                       AuthorisationNotFound, )
-from issuer.service import IssuerService
+# Database errors messages of conflicts which transactions can be retried,
+# SQLite locks and PostgreSQL serialization failures and deadlocks.
+CONFLICT_MESSAGES = ('locked', 'could not serialize', 'deadlock')
+
+CONFLICT_RETRIES = 10
+
+# Maximum seconds to wait before the first retry, grows on each attempt.
+CONFLICT_BACKOFF = 0.01
+
+
+def is_conflict(exc):
+    """Checks if a database error is a lock or serialization conflict, the
+    transaction can be retried.
+
+    :param exc: The database error
+    :type exc: OperationalError
+    """
+    message = str(exc).lower()
+    return any(i in message for i in CONFLICT_MESSAGES)
+
+
+def retry_on_conflict(fn):
+    """Decorates a function running its own database transaction, when a lock
+    or serialization conflict is raised the function is called again after a
+    random backoff, up to CONFLICT_RETRIES attempts.
+
+    It isn't retried when called inside an outer transaction, the outer
+    transaction is already broken.
+
+    :raises: OperationalError
+    """
+    def decorated(*args, **kwargs):
+        nested = connection.in_atomic_block or any(
+            connections[alias].in_atomic_block
+            for alias in settings.SHARDS if alias != DEFAULT_DB_ALIAS)
+        attempt = 1
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except OperationalError as exc:
+                if (nested or attempt >= CONFLICT_RETRIES or
+                        not is_conflict(exc)):
+                    raise
+
+            time.sleep(random.uniform(0, CONFLICT_BACKOFF * attempt))
+            attempt += 1
+
+    return decorated
 
 
 def account_not_found(fn):
@@ -27,66 +100,322 @@ class CardsIssuerDatabase(IssuerDatabase):
     ISSUER_CARD_ID = '__ISSUER_CARD_ID__'
     SCHEME_CARD_ID = '__SCHEME_CARD_ID__'
 
-    def _get_issuer_account(self, currency):
-        """Returns the Issuer account for a specific currency..
+    # Authorisations locking strategies, see _hold_funds.
+    SELECT_FOR_UPDATE = 'select_for_update'
+    CONDITIONAL_UPDATE = 'conditional_update'
+    LOCKING_STRATEGIES = (SELECT_FOR_UPDATE, CONDITIONAL_UPDATE)
+
+    # Maximum of rows looked up or updated by a single statement on batch
+    # operations, SQLite limits the number of query parameters.
+    CHUNK_SIZE = 400
+
+    # Transactions shards cached by process, they never change.
+    ROUTES_CACHE_SIZE = 100000
+    ROUTES_CACHE_TTL = 24 * 60 * 60
+
+    # Per process cache of the system accounts (Issuer and Scheme), keyed by
+    # (shard, card_id, currency). Only the Account identity is meaningful,
+    # the cached balance fields are stale.
+    _system_accounts = {}
+    _system_accounts_lock = threading.Lock()
+
+    def __init__(self, currencies=(), locking=SELECT_FOR_UPDATE,
+                 ledger=None, shards=None, system_buckets=None):
+        """Instances the Cards issuer database.
+
+        :param currencies: Currencies which system accounts are loaded at
+                           once on the first system account lookup.
+        :type currencies: list
+
+        :param locking: The authorisations locking strategy, one of
+                        LOCKING_STRATEGIES.
+        :type locking: str
+
+        :param ledger: Write-ahead log the batches are posted to, they're
+                       written to the database by it. Without it they're
+                       written in the operation database transaction.
+        :type ledger: cards.ledger.LedgerWriter
+
+        :param shards: The databases aliases the Accounts are sharded
+                       across, the SHARDS setting by default.
+        :type shards: list
+
+        :param system_buckets: Sub-accounts each system account (Issuer and
+                               Scheme) is split into, the
+                               SYSTEM_ACCOUNTS_BUCKETS setting by default.
+        :type system_buckets: int
+
+        :raises: ValueError
+        """
+        if locking not in self.LOCKING_STRATEGIES:
+            raise ValueError('Locking strategy "{}" not available.'
+                             .format(locking))
+
+        self._currencies = list(currencies)
+        self._warmed = set()
+        self._locking = locking
+        self._shards = list(shards or settings.SHARDS)
+        self._buckets = system_buckets or settings.SYSTEM_ACCOUNTS_BUCKETS
+        self._routes = LRUCache(self.ROUTES_CACHE_SIZE, self.ROUTES_CACHE_TTL)
+        self.ledger = ledger
+
+    def invalidate(self):
+        """Drops the cached state, when the database is changed behind the
+        issuer database (e.g. flushed or restored)."""
+        self.invalidate_system_accounts()
+        self._routes.clear()
+
+    @classmethod
+    def invalidate_system_accounts(cls):
+        """Clears the system accounts cache."""
+        with cls._system_accounts_lock:
+            cls._system_accounts.clear()
+
+    @classmethod
+    def _cache_system_account(cls, account):
+        """Caches a system account. When called inside a database transaction
+        the account is only cached after the commit, so a rolled back
+        account is never cached.
+
+        :param account: The system account
+        :type account: Account
+        """
+        using = account._state.db
+
+        def cache():
+            with cls._system_accounts_lock:
+                cls._system_accounts.setdefault(
+                    (using, account.card_id, account.currency), account)
+
+        transaction.on_commit(cache, using=using)
+
+    def _get_shard(self, card_id):
+        """Returns the database alias of the shard holding a card.
 
         :param card_id: The card unique identification
         :type card_id: str
+        """
+        return get_shard(card_id, self._shards)
+
+    def _get_bucket(self, account_id):
+        """Returns the system sub-account bucket journaled against by an
+        Account, concurrent operations on different Accounts update
+        different system rows.
+
+        :param account_id: The Account id
+        :type account_id: int
+
+        :rtype: int
+        """
+        return account_id % self._buckets
+
+    def _get_system_card_ids(self, card_id):
+        """Returns the card ids of a system account sub-accounts, the first
+        one is the system account itself.
+
+        :param card_id: The system card identification
+        :type card_id: str
+
+        :rtype: list
+        """
+        return [card_id] + ['{}:{}'.format(card_id, bucket)
+                            for bucket in range(1, self._buckets)]
+
+    def _get_system_account(self, card_id, currency,
+                            using=DEFAULT_DB_ALIAS):
+        """Returns a system account from the cache, creating it on the
+        database if it doesn't exists.
+
+        :param card_id: The system card identification
+        :type card_id: str
 
         :param currency: Currency code, 3 char long.
         :type currency: str
-        """
 
-        # Tries to create the Account if it doesn't exists.
+        :param using: The shard database alias.
+        :type using: str
+        """
+        try:
+            return self._system_accounts[(using, card_id, currency)]
+        except KeyError:
+            pass
+
+        if currency in self._currencies and using not in self._warmed:
+            # Cold cache, loads every system account in a single query.
+            self._warmed.add(using)
+            accounts = self.warm_system_accounts(self._currencies, using)
+            return accounts[(card_id, currency)]
+
+        # Tries to create the Account if it doesn't exists, concurrent
+        # creations are resolved by the (card_id, currency) unique constraint.
         account, created = (Account.objects
-                            .get_or_create(card_id=self.ISSUER_CARD_ID,
+                            .using(using)
+                            .get_or_create(card_id=card_id,
                                            currency=currency))
+        self._cache_system_account(account)
         return account
 
-    def _get_scheme_account(self, currency):
-        """Returns the Scheme account for a specific currency..
+    def warm_system_accounts(self, currencies, using=DEFAULT_DB_ALIAS):
+        """Loads the system accounts for the currencies into the cache, the
+        missing ones are created.
 
-        :param card_id: The card unique identification
-        :type card_id: str
+        :param currencies: List of currencies codes, 3 char long.
+        :type currencies: list
+
+        :param using: The shard database alias.
+        :type using: str
+
+        :returns: dict -- The system accounts by (card_id, currency).
+        """
+        card_ids = (self._get_system_card_ids(self.ISSUER_CARD_ID) +
+                    self._get_system_card_ids(self.SCHEME_CARD_ID))
+        accounts = {}
+        for account in (Account.objects
+                        .using(using)
+                        .filter(card_id__in=card_ids,
+                                currency__in=currencies)):
+            self._cache_system_account(account)
+            accounts[(account.card_id, account.currency)] = account
+
+        for card_id in card_ids:
+            for currency in currencies:
+                if (card_id, currency) not in accounts:
+                    accounts[(card_id, currency)] = (
+                        self._get_system_account(card_id, currency, using))
+
+        return accounts
+
+    def _get_issuer_account(self, currency, using=DEFAULT_DB_ALIAS,
+                            bucket=0):
+        """Returns the Issuer account for a specific currency..
 
         :param currency: Currency code, 3 char long.
         :type currency: str
+
+        :param using: The shard database alias.
+        :type using: str
+
+        :param bucket: The sub-account bucket, see _get_bucket.
+        :type bucket: int
         """
+        card_id = self._get_system_card_ids(self.ISSUER_CARD_ID)[bucket]
+        return self._get_system_account(card_id, currency, using)
 
-        # Tries to create the Account if it doesn't exists.
-        account, created = (Account.objects
-                            .get_or_create(card_id=self.SCHEME_CARD_ID,
-                                           currency=currency))
-        return account
+    def _get_scheme_account(self, currency, using=DEFAULT_DB_ALIAS,
+                            bucket=0):
+        """Returns the Scheme account for a specific currency..
+
+        :param currency: Currency code, 3 char long.
+        :type currency: str
+
+        :param using: The shard database alias.
+        :type using: str
+
+        :param bucket: The sub-account bucket, see _get_bucket.
+        :type bucket: int
+        """
+        card_id = self._get_system_card_ids(self.SCHEME_CARD_ID)[bucket]
+        return self._get_system_account(card_id, currency, using)
+
+    def get_system_balances(self):
+        """Consolidates the system accounts sub-accounts of every shard.
+        Every sub-account is summed, also the ones of a larger number of
+        buckets configured before.
+
+        :returns: dict -- Tuples of (balance, held_amount) summed by
+                  (card_id, currency).
+        """
+        card_ids = (self.ISSUER_CARD_ID, self.SCHEME_CARD_ID)
+        balances = defaultdict(lambda: (0, 0))
+        for using in self._shards:
+            queryset = (Account.objects
+                        .using(using)
+                        .filter(Q(card_id__startswith=card_ids[0]) |
+                                Q(card_id__startswith=card_ids[1]))
+                        .values_list('card_id',
+                                     'currency',
+                                     'balance',
+                                     'held_amount'))
+            for card_id, currency, balance, held_amount in queryset:
+                card_id = card_id.split(':')[0]
+                total, held = balances[(card_id, currency)]
+                balances[(card_id, currency)] = (total + balance,
+                                                 held + held_amount)
+        return dict(balances)
+
+    def _post_batch(self, journals, held_amounts=None, presentments=(),
+                    using=DEFAULT_DB_ALIAS):
+        """Posts a Batch of journals, see cards.ledger.write_batch. It's
+        written at once, or appended to the ledger log when there is one.
+
+        :param journals: Tuples of (account_id, amount).
+        :type journals: list
+
+        :param held_amounts: Held amount change by account id. Released
+                             holds are negative and are given back to the
+                             available balance.
+        :type held_amounts: dict
+
+        :param presentments: Tuples of (transaction pk, settlement_amount,
+                             settlement_currency) presented by the Batch.
+        :type presentments: list
+
+        :param using: The shard database alias.
+        :type using: str
+        """
+        if self.ledger is None:
+            write_batch(journals, held_amounts, presentments, using)
+            return
+
+        if not presentments:
+            # Nothing is written to the database, the transaction isn't held
+            # while the entry is made durable.
+            transaction.on_commit(
+                partial(self.ledger.post, journals, held_amounts,
+                        using=using),
+                using=using)
+            return
+
+        # The authorisations are presented at once and linked to the Batch
+        # when it's written. The post is the last statement, its entry is
+        # durable before the commit.
+        present(presentments, using=using)
+        self.ledger.post(journals, held_amounts, presentments, using)
 
     def _make_presentment_batch(self, transaction):
-        """Creates funds movement for a presentment.
+        """Creates funds movement for a presentment and sets the
+        transaction to presentment.
 
         :param transaction: The transaction instance
         :type transaction: Transaction
-
-        :returns: The batch created.
-        :rtype: Batch
         """
-        batch = Batch.objects.create()
+        using = transaction._state.db
+        currency = transaction.settlement_currency
+        bucket = self._get_bucket(transaction.account_id)
+        scheme_acc = self._get_scheme_account(currency, using, bucket)
+        issuer_acc = self._get_issuer_account(currency, using, bucket)
 
-        # Debits billing from cardholder account
-        batch.journals.create(account=transaction.account,
-                              amount=transaction.billing_amount * -1)
+        profits = transaction.billing_amount - transaction.settlement_amount
 
-        # Credits the settlement into Schemer account
-        acc = self._get_scheme_account(transaction.settlement_currency)
-        batch.journals.create(account=acc,
-                              amount=transaction.settlement_amount)
+        journals = [
+            # Debits billing from cardholder account
+            (transaction.account_id, transaction.billing_amount * -1),
+            # Credits the settlement into Schemer account
+            (scheme_acc.pk, transaction.settlement_amount),
+            # Credits profits into Issuer account
+            (issuer_acc.pk, profits),
+        ]
 
-        # Credits profits into Issuer account
-        profits = transaction.billing_amount - transaction.settlement_amount
+        # The authorisation hold becomes the cardholder debit, so its
+        # available balance doesn't change, only the held amount is released.
+        held_amounts = {
+            transaction.account_id: transaction.billing_amount * -1}
 
-        acc = self._get_issuer_account(transaction.settlement_currency)
-        batch.journals.create(account=acc,
-                              amount=profits)
+        presentments = [(transaction.pk,
+                         transaction.settlement_amount,
+                         transaction.settlement_currency)]
 
-        return batch
+        self._post_batch(journals, held_amounts, presentments, using)
 
     def _make_transfer(self, debit_account, credit_account, amount):
         """Creates a Batch instance with Tranfer instances connected to
@@ -102,26 +431,73 @@ class CardsIssuerDatabase(IssuerDatabase):
         :type amount: Decimal
 
         """
-        batch = Batch.objects.create()
-
         # Double entry
-        batch.journals.create(account=debit_account,
-                              amount=amount * -1)
-
-        batch.journals.create(account=credit_account,
-                              amount=amount)
+        self._post_batch([(debit_account.pk, amount * -1),
+                          (credit_account.pk, amount)],
+                         using=credit_account._state.db)
 
-        return batch
+    def _hold_funds(self, card_id, currency, amount, using=DEFAULT_DB_ALIAS):
+        """Holds an amount from the Account available balance. The configured
+        locking strategy makes sure concurrent holds never overdraw it:
 
-    def _create_transaction(self, card_id, transaction_id, transaction_type,
-                            merchant_name, merchant_country, merchant_mcc,
-                            billing_amount, billing_currency,
-                            transaction_amount, transaction_currency):
-        """Create transaction for a specific Account.
+        - ``select_for_update`` locks the Account row before the balance
+          check, concurrent authorisations for the card wait for the commit.
+        - ``conditional_update`` holds the funds with a single UPDATE
+          filtered by the available balance, no row is locked before it.
 
         :param card_id: The card unique identification
         :type card_id: str
 
+        :param currency: Currency code, 3 char long.
+        :type currency: str
+
+        :param amount: Amount to be held
+        :type amount: Decimal
+
+        :param using: The shard database alias.
+        :type using: str
+
+        :returns: int -- The Account id.
+
+        :raises: InsufficientFunds, Account.DoesNotExist
+        """
+        accounts = Account.objects.using(using).filter(card_id=card_id,
+                                                       currency=currency)
+
+        if self._locking == self.CONDITIONAL_UPDATE:
+            account_id = accounts.values_list('pk', flat=True).get()
+            held = (Account.objects
+                    .using(using)
+                    .filter(pk=account_id, balance__gte=amount)
+                    .move_funds(amount * -1, amount))
+
+        else:
+            account_id, balance = (accounts
+                                   .select_for_update()
+                                   .values_list('pk', 'balance')
+                                   .get())
+            held = (balance >= amount and
+                    (Account.objects
+                     .using(using)
+                     .filter(pk=account_id)
+                     .move_funds(amount * -1, amount)))
+
+        if not held:
+            raise InsufficientFunds
+
+        balances.invalidate_on_commit([account_id], using)
+        return account_id
+
+    def _create_transaction(self, account_id, transaction_id,
+                            transaction_type, merchant_name, merchant_country,
+                            merchant_mcc, billing_amount, billing_currency,
+                            transaction_amount, transaction_currency,
+                            using=DEFAULT_DB_ALIAS):
+        """Create transaction for a specific Account.
+
+        :param account_id: The Account id
+        :type account_id: int
+
         :param transaction_id:  Unique transaction id
         :type transaction_id: str
 
@@ -148,12 +524,12 @@ class CardsIssuerDatabase(IssuerDatabase):
 
         :param transaction_currency: Transaction currency code, 3 char long.
         :type transaction_currency: str
-        """
-        acc = (Account.objects
-               .balance()
-               .get(card_id=card_id, currency=billing_currency))
 
-        acc.transactions.create(
+        :param using: The Account shard database alias.
+        :type using: str
+        """
+        Transaction.objects.using(using).create(
+            account_id=account_id,
             transaction_id=transaction_id,
             transaction_type=transaction_type,
             merchant_name=merchant_name,
@@ -177,14 +553,158 @@ class CardsIssuerDatabase(IssuerDatabase):
         :param currency: Currency code, 3 char long.
         :type currency: str
 
-        :returns: bool -- If the Account is present at the database.
+        :returns: Decimal -- The maintained Account balance.
         """
+        if card_id in (self.ISSUER_CARD_ID, self.SCHEME_CARD_ID):
+            # Summed from the sub-accounts of every shard
+            try:
+                return self.get_system_balances()[(card_id, currency)][0]
+            except KeyError:
+                raise Account.DoesNotExist
+
         balance = (Account.objects
-                   .balance()
-                   .get(card_id=card_id, currency=currency)
-                   .balance)
+                   .using(self._get_shard(card_id))
+                   .values_list('balance', flat=True)
+                   .get(card_id=card_id, currency=currency))
         return balance
 
+    def get_unreconciled_accounts(self):
+        """Recomputes every Account balance from the whole ledger and
+        returns the ones which maintained balance diverges from it.
+
+        :returns: list -- Tuples of (card_id, currency, balance,
+                  ledger_balance, held_amount, authorisations_sum).
+        """
+        unreconciled = []
+        for using in self._shards:
+            unreconciled.extend(Account.objects
+                                .using(using)
+                                .unreconciled()
+                                .values_list('card_id',
+                                             'currency',
+                                             'balance',
+                                             'ledger_balance',
+                                             'held_amount',
+                                             'authorisations_sum'))
+        return unreconciled
+
+    def reconcile_balances(self):
+        """Overwrites the maintained balances of the unreconciled Accounts
+        with the ledger recomputation.
+
+        :returns: int -- The number of Accounts fixed.
+        """
+        fixed = 0
+        for using in self._shards:
+            with transaction.atomic(using=using):
+                accounts = list(Account.objects
+                                .using(using)
+                                .select_for_update()
+                                .unreconciled()
+                                .values_list('pk',
+                                             'ledger_balance',
+                                             'authorisations_sum'))
+                balances.invalidate_on_commit([i[0] for i in accounts], using)
+                for pk, ledger_balance, authorisations_sum in accounts:
+                    fixed += (Account.objects
+                              .using(using)
+                              .filter(pk=pk)
+                              .update(balance=ledger_balance,
+                                      held_amount=authorisations_sum))
+        return fixed
+
+    def expire_authorisations(self, until, chunk_size=CHUNK_SIZE):
+        """Expires the authorisations created before a date, releasing their
+        holds back to the available balance. Each chunk is expired by its
+        own short database transaction with two UPDATEs, the authorisations
+        made meanwhile aren't stalled.
+
+        :param until: The authorisations created before it are expired.
+        :type until: datetime
+
+        :param chunk_size: Authorisations expired by database transaction.
+        :type chunk_size: int
+
+        :returns: int -- The number of authorisations expired.
+        """
+        expired = 0
+        for using in self._shards:
+            while True:
+                count = self._expire_chunk(until, chunk_size, using)
+                expired += count
+                if count < chunk_size:
+                    break
+        return expired
+
+    @retry_on_conflict
+    def _expire_chunk(self, until, chunk_size, using):
+        """Expires a chunk of authorisations of a shard, see
+        expire_authorisations.
+
+        :returns: int -- The number of authorisations expired.
+        """
+        with transaction.atomic(using=using):
+            # Authorisations being presented are skipped, they're locked.
+            authorisations = (Transaction.objects
+                              .using(using)
+                              .authorisations()
+                              .filter(creation_date__lt=until)
+                              .select_for_update(skip_locked=True)
+                              .order_by('pk')
+                              .values_list('pk',
+                                           'account_id',
+                                           'billing_amount')[:chunk_size])
+            authorisations = list(authorisations)
+            if not authorisations:
+                return 0
+
+            (Transaction.objects
+             .using(using)
+             .filter(pk__in=[i[0] for i in authorisations])
+             .update(transaction_type=Transaction.EXPIRED))
+
+            released = defaultdict(int)
+            for pk, account_id, billing_amount in authorisations:
+                released[account_id] += billing_amount
+            balances.invalidate_on_commit(released, using)
+
+            (Account.objects
+             .using(using)
+             .move_funds_many({pk: (amount, amount * -1)
+                               for pk, amount in released.items()}))
+
+        return len(authorisations)
+
+    def get_settlement_totals(self, start, end):
+        """Sums the presentments settled with the Scheme by currency, using
+        a single aggregate query by shard. A presentment is settled when its
+        Batch is written.
+
+        :param start: The first Batches creation date included.
+        :type start: datetime
+
+        :param end: The Batches created from it are not included.
+        :type end: datetime
+
+        :returns: dict -- Tuples of (settlement_amount sum, presentments
+                  count) by settlement currency.
+        """
+        totals = defaultdict(lambda: (0, 0))
+        for using in self._shards:
+            queryset = (Transaction.objects
+                        .using(using)
+                        .filter(transaction_type=Transaction.PRESENTMENT,
+                                presentment_batch__creation_date__gte=start,
+                                presentment_batch__creation_date__lt=end)
+                        .order_by()
+                        .values_list('settlement_currency')
+                        .annotate(total=Sum('settlement_amount'),
+                                  count=Count('pk')))
+            for currency, total, count in queryset:
+                amount, presentments = totals[currency]
+                totals[currency] = (amount + total, presentments + count)
+        return dict(totals)
+
     def account_exists(self, card_id, currency):
         """Check if an Account model instance exists on the database.
 
@@ -199,9 +719,73 @@ class CardsIssuerDatabase(IssuerDatabase):
 
         :returns: bool -- If the Account is present at the database.
         """
-        return Account.objects.filter(card_id=card_id,
-                                      currency=currency).exists()
+        return (Account.objects
+                .using(self._get_shard(card_id))
+                .filter(card_id=card_id, currency=currency)
+                .exists())
+
+    def get_balances(self, card_id):
+        """Returns the available balances of every Account of a card, they
+        live on the same shard.
+
+        :param card_id: The card unique identification
+        :type card_id: str
+
+        :returns: dict -- The available balance by currency.
+        """
+        return dict(Account.objects
+                    .using(self._get_shard(card_id))
+                    .filter(card_id=card_id)
+                    .values_list('currency', 'balance'))
+
+    def get_authorisations(self, since):
+        """Returns the authorisations approved since a time from every
+        shard, oldest first. The presented and expired ones are included,
+        they were approved.
+
+        :param since: Seconds since the epoch.
+        :type since: float
+
+        :returns: list -- Tuples of (card_id, transaction_id, time,
+                  billing_amount, billing_currency, merchant_mcc,
+                  merchant_country).
+        """
+        since = datetime.fromtimestamp(since, timezone.utc)
+        approved = (Transaction.AUTHORISATION, Transaction.PRESENTMENT,
+                    Transaction.EXPIRED)
+        authorisations = []
+        for using in self._shards:
+            queryset = (Transaction.objects
+                        .using(using)
+                        .filter(transaction_type__in=approved,
+                                creation_date__gte=since)
+                        .values_list('account__card_id', 'transaction_id',
+                                     'creation_date', 'billing_amount',
+                                     'billing_currency', 'merchant_mcc',
+                                     'merchant_country'))
+            authorisations.extend(
+                (card_id, transaction_id, date.timestamp(), amount, currency,
+                 mcc, country)
+                for (card_id, transaction_id, date, amount, currency, mcc,
+                     country) in queryset.iterator())
+
+        authorisations.sort(key=itemgetter(2))
+        return authorisations
+
+    def create_account(self, card_id, currency):
+        """Creates an empty Account model instance.
+
+        :param card_id: The card unique identification
+        :type card_id: str
+
+        :param currency: Currency code, 3 char long.
+        :type currency: str
+        """
+        (Account.objects
+         .using(self._get_shard(card_id))
+         .create(card_id=card_id, currency=currency))
 
+    @retry_on_conflict
     @account_not_found
     def load_money(self, card_id, amount, currency):
         """Increases the balance attribute of a specific Account instance.
@@ -215,14 +799,120 @@ class CardsIssuerDatabase(IssuerDatabase):
         :param currency: Currency code, 3 char long.
         :type currency: str
         """
-        acc = Account.objects.get(card_id=card_id, currency=currency)
-        issuer_acc = self._get_issuer_account(currency)
+        using = self._get_shard(card_id)
+        with transaction.atomic(using=using):
+            acc = (Account.objects
+                   .using(using)
+                   .get(card_id=card_id, currency=currency))
+            issuer_acc = self._get_issuer_account(currency, using,
+                                                  self._get_bucket(acc.pk))
+
+            # Make funds transfer between accounts
+            self._make_transfer(issuer_acc, acc, amount)
+
+    # Authorisation fields compared to detect a replay, the Account card_id
+    # and the billing currency identify the Account.
+    AUTHORISATION_PAYLOAD = ('account__card_id', 'billing_currency',
+                             'merchant_name', 'merchant_country',
+                             'merchant_mcc', 'billing_amount',
+                             'transaction_amount', 'transaction_currency')
+
+    def _is_replay(self, transaction_id, payload, using=DEFAULT_DB_ALIAS):
+        """Looks up a transaction by its unique id, using only the unique
+        index. The balance isn't checked and nothing is written.
 
-        # Make funds transfer between accounts
-        self._make_transfer(issuer_acc, acc, amount)
+        :param transaction_id:  Unique transaction id
+        :type transaction_id: str
 
-    @transaction.atomic
-    @account_not_found
+        :param payload: The authorisation values, in the
+                        AUTHORISATION_PAYLOAD order.
+        :type payload: tuple
+
+        :param using: The card shard database alias.
+        :type using: str
+
+        :returns: bool -- If the transaction already exists with the same
+                  payload.
+
+        :raises: DuplicateTransaction
+        """
+        stored = (Transaction.objects
+                  .using(using)
+                  .filter(transaction_id=transaction_id)
+                  .values_list(*self.AUTHORISATION_PAYLOAD)
+                  .first())
+
+        if stored is None:
+            return False
+
+        if stored != payload:
+            raise DuplicateTransaction
+
+        return True
+
+    def _route_transaction(self, transaction_id, using):
+        """Records the shard of a new transaction id on the default
+        database, when there are many shards. The transaction ids stay
+        unique across the shards.
+
+        :param transaction_id:  Unique transaction id
+        :type transaction_id: str
+
+        :param using: The card shard database alias.
+        :type using: str
+
+        :raises: DuplicateTransaction
+        """
+        if len(self._shards) == 1:
+            return
+
+        try:
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                (TransactionRoute.objects
+                 .using(DEFAULT_DB_ALIAS)
+                 .create(transaction_id=transaction_id, shard=using))
+
+        except IntegrityError:
+            # Routed before, by a replay or a declined authorisation.
+            if self._get_transaction_shards([transaction_id]) != {
+                    transaction_id: using}:
+                raise DuplicateTransaction
+
+        self._routes.set(transaction_id, using)
+
+    def _get_transaction_shards(self, transaction_ids):
+        """Returns the shards of the routed transaction ids, from the process
+        cache or the default database.
+
+        :param transaction_ids: Unique transaction ids
+        :type transaction_ids: list
+
+        :returns: dict -- The database alias by transaction id.
+        """
+        if len(self._shards) == 1:
+            return {i: self._shards[0] for i in transaction_ids}
+
+        shards = {}
+        missing = []
+        for transaction_id in transaction_ids:
+            shard = self._routes.get(transaction_id)
+            if shard is None:
+                missing.append(transaction_id)
+            else:
+                shards[transaction_id] = shard
+
+        for chunk in chunks(missing, self.CHUNK_SIZE):
+            queryset = (TransactionRoute.objects
+                        .using(DEFAULT_DB_ALIAS)
+                        .filter(transaction_id__in=chunk)
+                        .values_list('transaction_id', 'shard'))
+            for transaction_id, shard in queryset:
+                self._routes.set(transaction_id, shard)
+                shards[transaction_id] = shard
+
+        return shards
+
+    @retry_on_conflict
     def make_authorisation(self, card_id, transaction_id, merchant_name,
                            merchant_country, merchant_mcc, billing_amount,
                            billing_currency, transaction_amount,
@@ -231,6 +921,11 @@ class CardsIssuerDatabase(IssuerDatabase):
         authorisation record into database. All operations in the same
         transaction.
 
+        Scheme retries are idempotent, when the transaction id is already
+        recorded with the same payload the original outcome is returned from
+        a single lookup, otherwise DuplicateTransaction is raised. Declined
+        authorisations aren't recorded, their replays are evaluated again.
+
         :param card_id: The card unique identification
         :type card_id: str
 
@@ -260,15 +955,49 @@ class CardsIssuerDatabase(IssuerDatabase):
 
         :returns: bool -- If the authorisation was created successfully.
 
-        :raises: InsufficientFunds
+        :raises: InsufficientFunds, DuplicateTransaction
         """
+        using = self._get_shard(card_id)
+        payload = (card_id, billing_currency, merchant_name,
+                   merchant_country, int(merchant_mcc),
+                   Decimal(str(billing_amount)),
+                   Decimal(str(transaction_amount)),
+                   transaction_currency)
 
-        if self._get_balance(card_id, billing_currency) < billing_amount:
-            raise InsufficientFunds
+        if self._is_replay(transaction_id, payload, using):
+            return
+
+        self._route_transaction(transaction_id, using)
+
+        try:
+            self._authorise(card_id, transaction_id, merchant_name,
+                            merchant_country, merchant_mcc, billing_amount,
+                            billing_currency, transaction_amount,
+                            transaction_currency, using)
+
+        except IntegrityError:
+            # A concurrent replay recorded the transaction first, the hold
+            # was rolled back with the savepoint.
+            if not self._is_replay(transaction_id, payload, using):
+                raise
+
+    @account_not_found
+    def _authorise(self, card_id, transaction_id, merchant_name,
+                   merchant_country, merchant_mcc, billing_amount,
+                   billing_currency, transaction_amount,
+                   transaction_currency, using):
+        """Holds the funds and records the authorisation on the card shard,
+        see make_authorisation."""
+        with transaction.atomic(using=using):
+            # Authorisations hold the billing amount from the available
+            # balance
+            account_id = self._hold_funds(card_id,
+                                          billing_currency,
+                                          billing_amount,
+                                          using)
 
-        else:
             self._create_transaction(
-                card_id=card_id,
+                account_id=account_id,
                 transaction_id=transaction_id,
                 transaction_type=Transaction.AUTHORISATION,
                 merchant_name=merchant_name,
@@ -277,9 +1006,10 @@ class CardsIssuerDatabase(IssuerDatabase):
                 billing_amount=billing_amount,
                 billing_currency=billing_currency,
                 transaction_amount=transaction_amount,
-                transaction_currency=transaction_currency)
+                transaction_currency=transaction_currency,
+                using=using)
 
-    @transaction.atomic
+    @retry_on_conflict
     def set_presentment(self, transaction_id, settlement_amount,
                         settlement_currency):
         """Tries to retrieve Authorisation Transaction  from the database,
@@ -296,27 +1026,445 @@ class CardsIssuerDatabase(IssuerDatabase):
 
         :raises: AuthorisationNotFound
         """
-        try:
-            tr = Transaction.objects.get(
-                transaction_id=transaction_id,
-                transaction_type=Transaction.AUTHORISATION)
-
-        except Transaction.DoesNotExist:
+        using = self._get_transaction_shards([transaction_id]).get(
+            transaction_id)
+        if using is None:
             raise AuthorisationNotFound
 
-        tr.transaction_type = Transaction.PRESENTMENT
-        tr.settlement_amount = settlement_amount
-        tr.settlement_currency = settlement_currency
+        with transaction.atomic(using=using):
+            try:
+                tr = (Transaction.objects
+                      .using(using)
+                      .only('account_id', 'billing_amount')
+                      .get(transaction_id=transaction_id,
+                           transaction_type=Transaction.AUTHORISATION))
+
+            except Transaction.DoesNotExist:
+                raise AuthorisationNotFound
+
+            tr.settlement_amount = settlement_amount
+            tr.settlement_currency = settlement_currency
+
+            # Creates transaction presentment batch in the same database
+            # transaction
+            self._make_presentment_batch(tr)
+
+    def set_presentments(self, presentments):
+        """Sets many authorisation transactions to presentment in a single
+        database transaction by shard. The authorisations are fetched in
+        chunks of CHUNK_SIZE and all the funds movement of a shard is
+        written in a single Batch.
+
+        :param presentments: Tuples of (transaction_id, settlement_amount,
+                             settlement_currency).
+        :type presentments: list
+
+        :returns: list -- For each presentment, if its authorisation was
+                  found and set to presentment.
+        """
+        presentments = list(presentments)
+        shards = self._get_transaction_shards(list({p[0] for p in
+                                                    presentments}))
+
+        by_shard = defaultdict(list)
+        for index, presentment in enumerate(presentments):
+            using = shards.get(presentment[0])
+            if using is not None:
+                by_shard[using].append(index)
+
+        results = [False] * len(presentments)
+        for using, indexes in by_shard.items():
+            shard_results = self._set_presentments(
+                [presentments[i] for i in indexes], using)
+            for index, result in zip(indexes, shard_results):
+                results[index] = result
+
+        return results
+
+    def get_presented(self, transaction_ids):
+        """Returns which transactions are already set to presentment, so a
+        clearing file load resumed after a crash skips them.
 
-        # Sets transaction to presentment
-        tr.save(update_fields=['transaction_type',
-                               'settlement_currency',
-                               'settlement_amount'])
+        :param transaction_ids: Unique transaction ids
+        :type transaction_ids: list
 
-        # Creates transaction presentment batch in the same database
-        # transaction
-        tr.presentment_batch = self._make_presentment_batch(tr)
-        tr.save(update_fields=['presentment_batch'])
+        :returns: set -- The presented transaction ids.
+        """
+        by_shard = defaultdict(list)
+        for transaction_id, using in self._get_transaction_shards(
+                transaction_ids).items():
+            by_shard[using].append(transaction_id)
+
+        presented = set()
+        for using, shard_ids in by_shard.items():
+            for chunk in chunks(shard_ids, self.CHUNK_SIZE):
+                presented.update(Transaction.objects
+                                 .using(using)
+                                 .filter(transaction_id__in=chunk,
+                                         transaction_type=(
+                                             Transaction.PRESENTMENT))
+                                 .values_list('transaction_id', flat=True))
+
+        return presented
+
+    @retry_on_conflict
+    def _set_presentments(self, presentments, using):
+        """Sets the presentments of a shard, see set_presentments."""
+        with transaction.atomic(using=using):
+            return self._set_shard_presentments(presentments, using)
+
+    def _set_shard_presentments(self, presentments, using):
+        authorisations = {}
+        transaction_ids = list({p[0] for p in presentments})
+        for chunk in chunks(transaction_ids, self.CHUNK_SIZE):
+            queryset = (Transaction.objects
+                        .using(using)
+                        .authorisations()
+                        .filter(transaction_id__in=chunk)
+                        .order_by()
+                        .values_list('transaction_id',
+                                     'pk',
+                                     'account_id',
+                                     'billing_amount'))
+            for transaction_id, pk, account_id, billing_amount in queryset:
+                authorisations[transaction_id] = (pk,
+                                                  account_id,
+                                                  billing_amount)
+
+        results = []
+        presented = []
+        journals = []
+        held_amounts = defaultdict(int)
+        settlements = defaultdict(int)
+        profits = defaultdict(int)
+
+        for transaction_id, amount, currency in presentments:
+            # Repeated transaction ids are presented only once
+            authorisation = authorisations.pop(transaction_id, None)
+            results.append(authorisation is not None)
+            if authorisation is None:
+                continue
+
+            pk, account_id, billing_amount = authorisation
+            presented.append((pk, amount, currency))
+
+            # Debits billing from cardholder account, releasing the hold.
+            journals.append((account_id, billing_amount * -1))
+            held_amounts[account_id] -= billing_amount
+
+            key = (currency, self._get_bucket(account_id))
+            settlements[key] += amount
+            profits[key] += billing_amount - amount
+
+        if not presented:
+            return results
+
+        # Credits the Scheme and Issuer sub-accounts once per currency and
+        # bucket
+        for (currency, bucket), amount in settlements.items():
+            scheme_acc = self._get_scheme_account(currency, using, bucket)
+            issuer_acc = self._get_issuer_account(currency, using, bucket)
+            journals.append((scheme_acc.pk, amount))
+            journals.append((issuer_acc.pk, profits[(currency, bucket)]))
+
+        self._post_batch(journals, held_amounts, presented, using)
+
+        return results
+
+    def load_money_bulk(self, loads):
+        """Load money into many Accounts in a single database transaction by
+        shard, the missing Accounts are created with a bulk INSERT. All the
+        funds movement of a shard is written in a single Batch, the Issuer
+        sub-accounts are debited once per currency and bucket.
+
+        :param loads: Tuples of (card_id, amount, currency).
+        :type loads: list
+
+        :returns: int -- The number of loads.
+        """
+        by_shard = defaultdict(list)
+        for load in loads:
+            by_shard[self._get_shard(load[0])].append(load)
+
+        for using, shard_loads in by_shard.items():
+            self._load_money_bulk(shard_loads, using)
+
+        return sum(len(i) for i in by_shard.values())
+
+    @retry_on_conflict
+    def _load_money_bulk(self, loads, using):
+        """Loads the money of a shard, see load_money_bulk."""
+        with transaction.atomic(using=using):
+            keys = {(card_id, currency) for card_id, amount, currency in loads}
+
+            accounts = self._get_accounts_ids(keys, using)
+
+            missing = keys.difference(accounts)
+            if missing:
+                Account.objects.using(using).bulk_create(
+                    [Account(card_id=card_id, currency=currency)
+                     for card_id, currency in missing],
+                    batch_size=self.CHUNK_SIZE)
+                accounts.update(self._get_accounts_ids(missing, using))
 
+            journals = []
+            debits = defaultdict(int)
+            for card_id, amount, currency in loads:
+                account_id = accounts[(card_id, currency)]
+                journals.append((account_id, amount))
+                debits[(currency, self._get_bucket(account_id))] += amount
 
-service = IssuerService(CardsIssuerDatabase(), settings.CURRENCIES)
+            for (currency, bucket), amount in debits.items():
+                issuer_acc = self._get_issuer_account(currency, using, bucket)
+                journals.append((issuer_acc.pk, amount * -1))
+
+            self._post_batch(journals, using=using)
+
+    def _get_accounts_ids(self, keys, using=DEFAULT_DB_ALIAS):
+        """Returns the ids of the existing Accounts.
+
+        :param keys: Tuples of (card_id, currency).
+        :type keys: set
+
+        :param using: The shard database alias.
+        :type using: str
+
+        :returns: dict -- Account id by (card_id, currency).
+        """
+        ids = {}
+        for chunk in chunks(list(keys), self.CHUNK_SIZE):
+            queryset = (Account.objects
+                        .using(using)
+                        .filter(card_id__in={i[0] for i in chunk},
+                                currency__in={i[1] for i in chunk})
+                        .values_list('card_id', 'currency', 'pk'))
+            for card_id, currency, pk in queryset:
+                if (card_id, currency) in keys:
+                    ids[(card_id, currency)] = pk
+
+        return ids
+
+
+class CardsReadDatabase(IssuerReadDatabase):
+    """Answers the balance inquiries and statements from a replica of the
+    Account shard behind it by at most max_lag seconds, see cards.replicas.
+    The authorisations balance checks stay on the primary, made by
+    CardsIssuerDatabase inside their database transaction."""
+
+    # Statement entries kinds, a journal and an authorisation created at the
+    # same time are listed in this order.
+    STATEMENT_AUTHORISATION = 1
+    STATEMENT_JOURNAL = 0
+
+    def __init__(self, shards=None, max_lag=None):
+        """Instances the Cards read database.
+
+        :param shards: The databases aliases the Accounts are sharded
+                       across, the SHARDS setting by default.
+        :type shards: list
+
+        :param max_lag: The staleness bound in seconds, the REPLICA_MAX_LAG
+                        setting by default.
+        :type max_lag: float
+        """
+        self._shards = list(shards or settings.SHARDS)
+        self._max_lag = max_lag
+
+    def _get_read_db(self, card_id):
+        """Returns the database alias the card is read from.
+
+        :param card_id: The card unique identification
+        :type card_id: str
+        """
+        return get_read_db(get_shard(card_id, self._shards), self._max_lag)
+
+    def account_exists(self, card_id, currency):
+        return (Account.objects
+                .using(self._get_read_db(card_id))
+                .filter(card_id=card_id, currency=currency)
+                .exists())
+
+    @account_not_found
+    def get_balance(self, card_id, currency):
+        """Returns an Account available balance, cached by process: it can
+        be max_lag plus the BALANCE_CACHE TTL seconds behind the primary,
+        see cards.balances."""
+        balance = balances.get_cached(card_id, currency)
+        if balance is not None:
+            return balance
+
+        shard = get_shard(card_id, self._shards)
+        read_at = time.monotonic()
+        account_id, balance = (Account.objects
+                               .using(get_read_db(shard, self._max_lag))
+                               .values_list('pk', 'balance')
+                               .get(card_id=card_id, currency=currency))
+        balances.cache_balance(card_id, currency, (shard, account_id),
+                               balance, read_at)
+        return balance
+
+    @account_not_found
+    def get_statement(self, card_id, currency, before=None, limit=50):
+        """Returns a page of the Account statement: its journals merged with
+        its open authorisations, newest first. The pages are keyset
+        paginated on (creation_date, kind, id), a deep page costs two index
+        range scans as the first one does.
+
+        :param card_id: The card unique identification
+        :type card_id: str
+
+        :param currency: Currency code, 3 char long.
+        :type currency: str
+
+        :param before: Position of the last entry of the previous page, a
+                       (creation_date, kind, id) tuple. None for the first
+                       page.
+        :type before: tuple
+
+        :param limit: Maximum number of entries.
+        :type limit: int
+
+        :returns: tuple -- The Account (balance, held_amount), the entries
+                  dicts and the position of the last entry, None when it's
+                  the last page.
+        """
+        using = self._get_read_db(card_id)
+        account_id, balance, held_amount = (Account.objects
+                                            .using(using)
+                                            .values_list('pk',
+                                                         'balance',
+                                                         'held_amount')
+                                            .get(card_id=card_id,
+                                                 currency=currency))
+
+        journals = (Journal.objects
+                    .using(using)
+                    .filter(account_id=account_id)
+                    .order_by('-creation_date', '-id')
+                    .values_list('creation_date', 'id', 'amount',
+                                 'batch_id'))
+        authorisations = (Transaction.objects
+                          .using(using)
+                          .authorisations()
+                          .filter(account_id=account_id)
+                          .order_by('-creation_date', '-id')
+                          .values_list('creation_date', 'id',
+                                       'billing_amount', 'transaction_id',
+                                       'merchant_name', 'merchant_country'))
+        if before is not None:
+            journals = journals.filter(
+                self._statement_before(self.STATEMENT_JOURNAL, before))
+            authorisations = authorisations.filter(
+                self._statement_before(self.STATEMENT_AUTHORISATION, before))
+
+        # One more entry of each kind tells if there is a next page.
+        entries = [((date, self.STATEMENT_JOURNAL, pk),
+                    {'type': 'journal',
+                     'id': pk,
+                     'date': date,
+                     'amount': amount,
+                     'batch_id': batch_id})
+                   for date, pk, amount, batch_id in journals[:limit + 1]]
+        entries.extend(
+            ((date, self.STATEMENT_AUTHORISATION, pk),
+             {'type': 'authorisation',
+              'id': pk,
+              'date': date,
+              'amount': amount * -1,
+              'transaction_id': transaction_id,
+              'merchant_name': merchant_name,
+              'merchant_country': merchant_country})
+            for (date, pk, amount, transaction_id, merchant_name,
+                 merchant_country) in authorisations[:limit + 1])
+        entries.sort(key=lambda entry: entry[0], reverse=True)
+
+        position = entries[limit - 1][0] if len(entries) > limit else None
+        return ((balance, held_amount),
+                [entry for key, entry in entries[:limit]],
+                position)
+
+    @staticmethod
+    def _statement_before(kind, before):
+        """Filters the statement entries of a kind listed after a position,
+        see get_statement.
+
+        :rtype: Q
+        """
+        date, before_kind, pk = before
+        if kind < before_kind:
+            return Q(creation_date__lte=date)
+        if kind > before_kind:
+            return Q(creation_date__lt=date)
+        # The creation date upper bound is an index range, the OR only
+        # filters the entries created at the same time.
+        return (Q(creation_date__lte=date) &
+                (Q(creation_date__lt=date) | Q(id__lt=pk)))
+
+
+class CardsAsyncIssuerDatabase(ThreadedIssuerDatabase):
+    """Runs the CardsIssuerDatabase on the async database pool threads. Each
+    call is handled as a request by the pool thread database connection."""
+
+    def _call(self, fn, *args):
+        close_old_connections()
+        try:
+            return fn(*args)
+        finally:
+            close_old_connections()
+
+
+def get_issuer_database():
+    """Instances the issuer database engine selected by the ISSUER_DATABASE
+    setting."""
+    engine = import_string(settings.ISSUER_DATABASE)
+
+    ledger = None
+    if settings.LEDGER_LOG['PATH']:
+        ledger = LedgerWriter(
+            settings.LEDGER_LOG['PATH'],
+            group_commit_entries=settings.LEDGER_LOG['GROUP_COMMIT_ENTRIES'],
+            group_commit_ms=settings.LEDGER_LOG['GROUP_COMMIT_MS'],
+            apply_interval_ms=settings.LEDGER_LOG['APPLY_INTERVAL_MS'])
+        # The entries left by the last run are recovered in background.
+        ledger.start()
+
+    return engine(settings.CURRENCIES, settings.AUTHORISATION_LOCKING, ledger)
+
+
+# Shared by both services, the in memory engine state is per instance.
+database = get_issuer_database()
+
+# Balance inquiries and statements, read from the replicas.
+read_database = CardsReadDatabase()
+
+# Loaded once, the authorisations never look rates up on the database.
+rates = None
+if settings.FX_RATES_FILE:
+    rates = load_rates(settings.FX_RATES_FILE, settings.CURRENCIES)
+
+
+def get_velocity_history(since):
+    """Returns the authorisations rebuilding the velocity limits, see
+    CardsIssuerDatabase.get_authorisations. Runs on its own thread."""
+    try:
+        return database.get_authorisations(since)
+    finally:
+        connections.close_all()
+
+
+velocity = None
+if settings.VELOCITY_RULES_FILE:
+    velocity = VelocityLimits(load_rules(settings.VELOCITY_RULES_FILE),
+                              settings.VELOCITY_HISTORY_SIZE,
+                              get_velocity_history)
+    # The cards histories are rebuilt in background.
+    velocity.start()
+
+service = IssuerService(database, settings.CURRENCIES, read_database, rates,
+                        velocity)
+
+# Runs the service on the async database pool, the ASGI webhooks share its
+# conversion rates and velocity limits.
+async_service = AsyncIssuerService(
+    CardsAsyncIssuerDatabase(database, settings.ASYNC_DATABASE_THREADS),
+    service)
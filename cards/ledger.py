@@ -0,0 +1,695 @@
+"""Write-ahead log of the ledger batches. The batches are appended to a
+local log file made durable by a group commit, then written to the database
+in bulk by a background thread, so the webhooks answer as soon as their
+journals are durable instead of waiting for the database commit."""
+from collections import defaultdict, deque
+from decimal import Decimal
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+from django.db import transaction, close_old_connections, DEFAULT_DB_ALIAS
+from django.db.models import Case, When, Value, CharField, DecimalField
+
+from cards import balances
+from cards.accounting.models import (Account, Transaction, Batch, Journal,
+                                     LedgerLogPosition, )
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Maximum of rows looked up or updated by a single statement, SQLite limits
+# the number of query parameters.
+CHUNK_SIZE = 400
+
+# Log record header: the payload length and its CRC32.
+HEADER = struct.Struct('>II')
+
+# Values of the authorisations posted to the log, see Transaction.
+AUTHORISATION_FIELDS = ('account_id', 'transaction_id', 'merchant_name',
+                        'merchant_country', 'merchant_mcc', 'billing_amount',
+                        'billing_currency', 'transaction_amount',
+                        'transaction_currency')
+
+
+def chunks(items, size):
+    """Splits a list into lists of a maximum size.
+
+    >>> list(chunks([1, 2, 3], 2))
+    [[1, 2], [3]]
+
+    :param items: The list to be split.
+    :type items: list
+
+    :param size: The maximum chunk size.
+    :type size: int
+    """
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def present(presentments, batch=None, using=DEFAULT_DB_ALIAS):
+    """Sets authorisations to presentment, using a single UPDATE by chunk.
+
+    :param presentments: Tuples of (transaction pk, settlement_amount,
+                         settlement_currency).
+    :type presentments: list
+
+    :param batch: The presentment Batch, linked when it's written when None.
+    :type batch: Batch
+
+    :param using: The authorisations database alias.
+    :type using: str
+    """
+    for chunk in chunks(list(presentments), CHUNK_SIZE):
+        amounts = [When(pk=pk, then=Value(amount))
+                   for pk, amount, currency in chunk]
+        currencies = [When(pk=pk, then=Value(currency))
+                      for pk, amount, currency in chunk]
+        (Transaction.objects
+         .using(using)
+         .filter(pk__in=[pk for pk, amount, currency in chunk])
+         .update(transaction_type=Transaction.PRESENTMENT,
+                 settlement_amount=Case(*amounts,
+                                        output_field=DecimalField()),
+                 settlement_currency=Case(*currencies,
+                                          output_field=CharField()),
+                 presentment_batch=batch))
+
+
+def write_batch(journals, held_amounts=None, presentments=(),
+                using=DEFAULT_DB_ALIAS):
+    """Creates a Batch with its journals using a single INSERT and updates
+    the Accounts maintained balances using a single UPDATE. Without journals
+    only the held amounts are changed, no Batch is created.
+
+    :param journals: Tuples of (account_id, amount).
+    :type journals: list
+
+    :param held_amounts: Held amount change by account id. Released holds
+                         are negative and are given back to the available
+                         balance.
+    :type held_amounts: dict
+
+    :param presentments: Tuples of (transaction pk, settlement_amount,
+                         settlement_currency) presented by the Batch.
+    :type presentments: list
+
+    :param using: The Accounts database alias.
+    :type using: str
+
+    :returns: The batch created, None without journals.
+    :rtype: Batch
+    """
+    with transaction.atomic(using=using, savepoint=False):
+        batch = None
+        if journals:
+            batch = Batch.objects.using(using).create()
+
+            Journal.objects.using(using).bulk_create(
+                [Journal(batch=batch, account_id=account_id, amount=amount)
+                 for account_id, amount in journals])
+
+        movements = defaultdict(lambda: [0, 0])
+        for account_id, amount in journals:
+            movements[account_id][0] += amount
+
+        for account_id, held_amount in (held_amounts or {}).items():
+            movements[account_id][0] -= held_amount
+            movements[account_id][1] += held_amount
+
+        for chunk in chunks(list(movements.items()), CHUNK_SIZE):
+            Account.objects.using(using).move_funds_many(dict(chunk))
+        balances.invalidate_on_commit(movements, using)
+
+        present(presentments, batch, using)
+
+    return batch
+
+
+def encode_record(entry):
+    """Encodes a log entry as a length prefixed and checksummed record.
+
+    :param entry: The JSON serializable entry, Decimals are written as
+                  strings.
+    :type entry: dict
+
+    :rtype: bytes
+    """
+    payload = json.dumps(entry, separators=(',', ':'),
+                         default=str).encode('utf-8')
+    return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(stream):
+    """Reads the log records up to the first torn or corrupted one, the
+    record of an interrupted write was never acknowledged.
+
+    >>> import io
+    >>> read_records(io.BytesIO(encode_record({'seq': 1}) + b'\\x00'))
+    ([{'seq': 1}], 17)
+
+    :param stream: The log file, opened in binary mode.
+    :type stream: file
+
+    :returns: tuple -- (entries, the length of the valid records).
+    """
+    entries = []
+    length = 0
+    while True:
+        header = stream.read(HEADER.size)
+        if len(header) < HEADER.size:
+            break
+
+        size, checksum = HEADER.unpack(header)
+        payload = stream.read(size)
+        if len(payload) < size or zlib.crc32(payload) != checksum:
+            break
+
+        entries.append(json.loads(payload.decode('utf-8')))
+        length += HEADER.size + size
+
+    return entries, length
+
+
+class LedgerLog:
+    """Append only file of entries with group commit: the appended entries
+    are written and fsynced together by a single thread, as soon as
+    group_entries are waiting or group_interval after the first one. The
+    entries appended while a group is written always join the next one.
+    """
+
+    def __init__(self, path, group_entries=64, group_interval=0,
+                 on_durable=None):
+        """Instances the ledger log.
+
+        :param path: The log file path.
+        :type path: str
+
+        :param group_entries: Entries which are written at once without
+                              waiting for the interval.
+        :type group_entries: int
+
+        :param group_interval: Seconds the first entry of a group waits for
+                               the others, 0 writes it as soon as the
+                               previous group is durable.
+        :type group_interval: float
+
+        :param on_durable: Called with each group of entries written, in the
+                           log order, before their appends return.
+        :type on_durable: callable
+        """
+        self.path = path
+        self.size = 0
+        self._group_entries = group_entries
+        self._group_interval = group_interval
+        self._on_durable = on_durable
+        self._cond = threading.Condition()
+        self._file = None
+        self._closed = True
+        self._thread = None
+        self._error = None
+        # Entries and records waiting for the group commit
+        self._waiting = []
+        self._seq = 0
+        self._durable_seq = 0
+
+    def open(self):
+        """Opens the log and starts its writer thread, the torn tail of an
+        interrupted write is truncated.
+
+        :returns: list -- The entries on the log.
+        """
+        with self._cond:
+            try:
+                with open(self.path, 'rb') as stream:
+                    entries, length = read_records(stream)
+            except FileNotFoundError:
+                entries, length = [], 0
+
+            self._file = open(self.path, 'ab')
+            if os.path.getsize(self.path) > length:
+                LOGGER.warning('Truncating the ledger log {} at {} bytes, its '
+                               'last record is torn.'.format(self.path,
+                                                             length))
+                self._file.truncate(length)
+                os.fsync(self._file.fileno())
+
+            self.size = length
+            self._seq = self._durable_seq = (entries[-1]['seq'] if entries
+                                             else 0)
+            self._error = None
+            self._closed = False
+            self._thread = threading.Thread(target=self._run,
+                                            name='ledger-log',
+                                            daemon=True)
+            self._thread.start()
+
+        return entries
+
+    def append(self, entry):
+        """Appends an entry to the log and waits until it's durable.
+
+        :param entry: The JSON serializable entry, its ``seq`` is set.
+        :type entry: dict
+
+        :returns: int -- The entry sequence.
+
+        :raises: OSError
+        """
+        with self._cond:
+            if self._closed or self._error is not None:
+                raise OSError('Ledger log {} is closed.'.format(self.path))
+
+            self._seq += 1
+            seq = entry['seq'] = self._seq
+            self._waiting.append((entry, encode_record(entry)))
+            self._cond.notify_all()
+
+            while self._durable_seq < seq and self._error is None:
+                self._cond.wait()
+
+            if self._durable_seq < seq:
+                raise self._error
+
+        return seq
+
+    @property
+    def durable_seq(self):
+        """The sequence of the last durable entry."""
+        return self._durable_seq
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._waiting and not self._closed:
+                    self._cond.wait()
+
+                if not self._waiting:
+                    return
+
+                deadline = time.monotonic() + self._group_interval
+                while (len(self._waiting) < self._group_entries and
+                       not self._closed):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                group, self._waiting = self._waiting, []
+                stream = self._file
+
+            try:
+                data = b''.join(record for entry, record in group)
+                stream.write(data)
+                stream.flush()
+                os.fsync(stream.fileno())
+
+            except OSError as exc:
+                LOGGER.exception('Writing the ledger log {} failed.'
+                                 .format(self.path))
+                with self._cond:
+                    self._error = exc
+                    self._cond.notify_all()
+                return
+
+            entries = [entry for entry, record in group]
+            if self._on_durable is not None:
+                self._on_durable(entries)
+
+            with self._cond:
+                self.size += len(data)
+                self._durable_seq = entries[-1]['seq']
+                self._cond.notify_all()
+
+    def rotate(self, seq):
+        """Replaces the log by a new one holding only a checkpoint entry with
+        the last sequence, when every entry up to seq was written to the
+        database. The new log is atomically renamed over the old one.
+
+        :param seq: The last entry written to the database.
+        :type seq: int
+
+        :returns: bool -- If the log was rotated.
+        """
+        with self._cond:
+            if (self._closed or self._waiting or
+                    self._seq != seq or self._durable_seq != seq):
+                return False
+
+            record = encode_record({'seq': seq, 'checkpoint': True})
+            path = self.path + '.tmp'
+            with open(path, 'wb') as stream:
+                stream.write(record)
+                stream.flush()
+                os.fsync(stream.fileno())
+            os.replace(path, self.path)
+
+            directory = os.open(os.path.dirname(os.path.abspath(self.path)),
+                                os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+
+            self._file.close()
+            self._file = open(self.path, 'ab')
+            self.size = len(record)
+            return True
+
+    def close(self):
+        """Writes the waiting entries and closes the log."""
+        with self._cond:
+            self._closed = True
+            thread, self._thread = self._thread, None
+            self._cond.notify_all()
+
+        if thread is not None:
+            thread.join()
+
+        with self._cond:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class LedgerWriter:
+    """Posts the ledger batches to a LedgerLog and writes them to the
+    database in bulk: the durable entries of a shard are written together as
+    a single Batch, in the same database transaction of the shard log
+    position, so each entry is written exactly once. On start the entries
+    after the positions are recovered from the log.
+
+    The presentments of an entry are set by the posting database transaction
+    and linked to the Batch when it's written. Entries which presentments
+    aren't committed wait for them up to COMMIT_TIMEOUT, and are dropped
+    after it or on recovery, their transaction was rolled back.
+
+    Each process needs its own log, the entries are written by the process
+    which posted them.
+    """
+
+    # Seconds an entry waits for its presentments commit.
+    COMMIT_TIMEOUT = 10
+
+    def __init__(self, path, name=None, group_commit_entries=64,
+                 group_commit_ms=0, apply_interval_ms=50,
+                 rotate_size=64 * 1024 * 1024):
+        """Instances the ledger writer.
+
+        :param path: The log file path.
+        :type path: str
+
+        :param name: The log position name, the absolute path by default.
+        :type name: str
+
+        :param group_commit_entries: See LedgerLog.group_entries.
+        :type group_commit_entries: int
+
+        :param group_commit_ms: See LedgerLog.group_interval.
+        :type group_commit_ms: int
+
+        :param apply_interval_ms: Interval of the background thread writing
+                                  the entries to the database. Without it
+                                  they're only written by flush.
+        :type apply_interval_ms: int
+
+        :param rotate_size: Log size in bytes which is rotated once every
+                            entry is written.
+        :type rotate_size: int
+        """
+        self.name = name or os.path.abspath(path)
+        self._log = LedgerLog(path,
+                              group_commit_entries,
+                              group_commit_ms / 1000,
+                              self._queue_entries)
+        self._apply_interval = (apply_interval_ms / 1000
+                                if apply_interval_ms else None)
+        self._rotate_size = rotate_size
+        # Durable entries not yet written to the database
+        self._queue = deque()
+        self._queue_lock = threading.Lock()
+        self._recovered_seq = 0
+        self._written_seq = 0
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _queue_entries(self, entries):
+        with self._queue_lock:
+            self._queue.extend(entries)
+
+    def start(self):
+        """Opens the log and starts the background thread, the log entries
+        are queued to be recovered. No database access is made."""
+        with self._start_lock:
+            if self._started:
+                return
+
+            entries = self._log.open()
+            self._queue.extend(entries)
+            self._recovered_seq = entries[-1]['seq'] if entries else 0
+            self._started = True
+
+            if self._apply_interval is not None:
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run,
+                                                name='ledger-writer',
+                                                daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Closes the log and stops the background thread. The durable
+        entries not written are recovered on the next start."""
+        with self._start_lock:
+            if not self._started:
+                return
+
+            self._log.close()
+            self._stopped.set()
+            if self._thread is not None:
+                self._thread.join()
+                self._thread = None
+            self._started = False
+
+    def post(self, journals, held_amounts=None, presentments=(),
+             using=DEFAULT_DB_ALIAS, authorisations=()):
+        """Appends a Batch to the log, returns once it's durable.
+
+        :param journals: Tuples of (account_id, amount).
+        :type journals: list
+
+        :param held_amounts: Held amount change by account id.
+        :type held_amounts: dict
+
+        :param presentments: Tuples of (transaction pk, settlement_amount,
+                             settlement_currency) presented by the Batch.
+        :type presentments: list
+
+        :param using: The Accounts database alias.
+        :type using: str
+
+        :param authorisations: Tuples of the AUTHORISATION_FIELDS values,
+                               created with the Batch. Their holds are
+                               given as held amounts.
+        :type authorisations: list
+
+        :returns: int -- The entry sequence.
+        """
+        self.start()
+        return self._log.append({
+            'time': time.time(),
+            'db': using,
+            'journals': [[account_id, amount]
+                         for account_id, amount in journals],
+            'held': [[account_id, amount]
+                     for account_id, amount in (held_amounts or {}).items()],
+            'presentments': [list(i) for i in presentments],
+            'authorisations': [list(i) for i in authorisations],
+        })
+
+    def pending(self):
+        """Returns the number of durable entries not yet written."""
+        return len(self._queue)
+
+    def written_seq(self):
+        """Returns the sequence every durable entry up to was written to
+        the database."""
+        # Read first, the entries are queued before they're durable
+        durable_seq = self._log.durable_seq
+        with self._queue_lock:
+            if self._queue:
+                return self._queue[0]['seq'] - 1
+        return durable_seq
+
+    def pending_debits(self, using=DEFAULT_DB_ALIAS):
+        """Returns the available balance the Accounts lose by the durable
+        entries not yet written, such as their holds. The credits are left
+        out: read before the Accounts, an entry written meanwhile is counted
+        twice and the balances are only underestimated.
+
+        :param using: The Accounts database alias.
+        :type using: str
+
+        :returns: dict -- The amount lost by account id, not negative.
+        """
+        with self._queue_lock:
+            entries = list(self._queue)
+
+        debits = defaultdict(Decimal)
+        for entry in entries:
+            if entry.get('db', DEFAULT_DB_ALIAS) != using:
+                continue
+
+            movements = defaultdict(Decimal)
+            for account_id, amount in entry.get('journals', ()):
+                movements[account_id] += Decimal(str(amount))
+            for account_id, amount in entry.get('held', ()):
+                movements[account_id] -= Decimal(str(amount))
+
+            for account_id, movement in movements.items():
+                if movement < 0:
+                    debits[account_id] -= movement
+
+        return dict(debits)
+
+    def flush(self):
+        """Writes the durable entries to the database, the ones which
+        presentments aren't committed yet are left queued.
+
+        :returns: int -- The number of entries written or dropped.
+        """
+        self.start()
+        count = 0
+        with self._flush_lock:
+            while self._queue:
+                by_shard = defaultdict(list)
+                for entry in list(self._queue):
+                    by_shard[entry.get('db', DEFAULT_DB_ALIAS)].append(entry)
+
+                written = set()
+                for using, entries in by_shard.items():
+                    prefix = self._write(entries, using)
+                    written.update(entry['seq'] for entry in entries[:prefix])
+
+                if not written:
+                    break
+
+                with self._queue_lock:
+                    self._queue = deque(entry for entry in self._queue
+                                        if entry['seq'] not in written)
+                self._written_seq = max(self._written_seq, *written)
+                count += len(written)
+
+            if (not self._queue and self._written_seq and
+                    self._log.size > self._rotate_size):
+                self._log.rotate(self._written_seq)
+
+        return count
+
+    def _run(self):
+        while not self._stopped.wait(self._apply_interval):
+            if not self._queue:
+                continue
+
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                LOGGER.exception('Writing the ledger log {} to the database '
+                                 'failed, it will be retried.'
+                                 .format(self.name))
+            finally:
+                close_old_connections()
+
+    def _write(self, entries, using):
+        """Writes a prefix of the entries of a shard and its log position in
+        a single database transaction.
+
+        :param entries: The queued entries of the shard, in the log order.
+        :type entries: list
+
+        :param using: The shard database alias.
+        :type using: str
+
+        :returns: int -- The number of entries written or dropped.
+        """
+        with transaction.atomic(using=using):
+            return self._write_entries(entries, using)
+
+    def _write_entries(self, entries, using):
+        position, created = (LedgerLogPosition.objects
+                             .using(using)
+                             .select_for_update()
+                             .get_or_create(name=self.name))
+
+        seq = position.seq
+        # Transaction type of the authorisations not linked to a Batch yet
+        states = {}
+        pks = list({i[0] for entry in entries
+                    for i in entry.get('presentments', ())})
+        for chunk in chunks(pks, CHUNK_SIZE):
+            queryset = (Transaction.objects
+                        .using(using)
+                        .filter(pk__in=chunk)
+                        .values_list('pk',
+                                     'transaction_type',
+                                     'presentment_batch'))
+            for pk, transaction_type, batch_id in queryset:
+                if batch_id is None:
+                    states[pk] = transaction_type
+
+        journals = []
+        held_amounts = defaultdict(Decimal)
+        presentments = []
+        authorisations = []
+        count = 0
+        for entry in entries:
+            if entry['seq'] <= seq or entry.get('checkpoint'):
+                count += 1
+                continue
+
+            entry_states = {states.get(i[0]) for i in entry['presentments']}
+            if (Transaction.AUTHORISATION in entry_states and
+                    entry['seq'] > self._recovered_seq and
+                    time.time() - entry['time'] < self.COMMIT_TIMEOUT):
+                # The posting database transaction isn't committed yet
+                break
+
+            if entry_states - {Transaction.PRESENTMENT}:
+                LOGGER.warning('Dropping the ledger log {} entry {}, its '
+                               'presentments were rolled back or written '
+                               'before.'.format(self.name, entry['seq']))
+
+            else:
+                # Presented once, even if posted twice.
+                states.update((i[0], None) for i in entry['presentments'])
+                journals.extend((account_id, Decimal(amount))
+                                for account_id, amount in entry['journals'])
+                for account_id, amount in entry['held']:
+                    held_amounts[account_id] += Decimal(amount)
+                presentments.extend(entry['presentments'])
+                authorisations.extend(entry.get('authorisations', ()))
+
+            position.seq = entry['seq']
+            count += 1
+
+        if authorisations:
+            Transaction.objects.using(using).bulk_create(
+                [Transaction(transaction_type=Transaction.AUTHORISATION,
+                             **dict(zip(AUTHORISATION_FIELDS, values)))
+                 for values in authorisations])
+
+        if journals or held_amounts:
+            write_batch(journals, held_amounts, presentments, using)
+
+        if position.seq != seq:
+            position.save(update_fields=('seq', 'modification_date'))
+
+        return count
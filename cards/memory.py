@@ -0,0 +1,408 @@
+from collections import OrderedDict
+from decimal import Decimal
+import threading
+
+from django.db import transaction, IntegrityError, DEFAULT_DB_ALIAS
+
+from cards import balances
+from cards.accounting.models import Account, Transaction
+from cards.issuer import CardsIssuerDatabase, retry_on_conflict
+from issuer.db import InsufficientFunds, AccountNotFound, DuplicateTransaction
+
+
+class AccountRecord:
+    """In memory available balance of an Account."""
+    __slots__ = ('pk', 'balance', 'db', 'lock')
+
+    def __init__(self, pk, balance, db=DEFAULT_DB_ALIAS):
+        self.pk = pk
+        self.balance = balance
+        self.db = db
+        self.lock = threading.Lock()
+
+
+class HoldRecord:
+    """In memory open authorisation made by the engine."""
+    __slots__ = ('account', 'amount', 'payload', 'seq')
+
+    def __init__(self, account, amount, payload, seq=0):
+        self.account = account
+        self.amount = amount
+        self.payload = payload
+        # The ledger log entry of the hold, None while it's posted
+        self.seq = seq
+
+
+class MemoryIssuerDatabase(CardsIssuerDatabase):
+    """Decides the authorisations from the Accounts available balances kept
+    in memory: no row is locked or read to take the decision, the declines
+    only check the transaction id unique index.
+
+    Without a ledger log every operation writes through to the database
+    (Batch, Journal and Transaction rows) before its result is returned,
+    the approved holds by a conditional UPDATE: an Account spent by another
+    writer is declined and reloaded rather than overdrawn.
+
+    With a ledger log the approved holds and their authorisations are
+    appended to it and written to the database in bulk by its background
+    thread, an approval only looks the transaction id up (and routes it,
+    with many shards). Nothing guards the Accounts against other writers
+    then. The Accounts reloaded from the database still deduct the holds
+    durable on the log and not written yet, and the presentments of such
+    holds write them first.
+
+    The balances are loaded from the database on the first use of each
+    Account, so the engine must be the only writer of the Accounts it
+    serves. The last MAX_HOLDS approved holds answer their replays from
+    memory, the older ones are looked up on the database once written.
+    """
+
+    # Maximum of approved holds kept in memory.
+    MAX_HOLDS = 100000
+
+    def __init__(self, currencies=(), locking=None, ledger=None,
+                 shards=None):
+        """Instances the in memory issuer database.
+
+        :param currencies: Currencies which system accounts are loaded at
+                           once on the first system account lookup.
+        :type currencies: list
+
+        :param locking: Ignored, the holds are written by a conditional
+                        UPDATE or posted to the ledger log.
+        :type locking: str
+
+        :param ledger: See CardsIssuerDatabase, the approved holds are
+                       posted to it too.
+        :type ledger: cards.ledger.LedgerWriter
+
+        :param shards: See CardsIssuerDatabase.
+        :type shards: list
+        """
+        super().__init__(currencies, self.CONDITIONAL_UPDATE, ledger, shards)
+        self._accounts = {}
+        # Records dropped while their holds may be posted to the ledger log
+        self._retired = {}
+        self._holds = OrderedDict()
+        self._holds_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Drops the in memory state, it's reloaded from the database."""
+        super().invalidate()
+        self._drop_records()
+
+        # The holds not written yet aren't found on the database
+        written = self.ledger.written_seq() if self.ledger is not None else 0
+        with self._holds_lock:
+            self._holds = OrderedDict(
+                (transaction_id, hold)
+                for transaction_id, hold in self._holds.items()
+                if hold.seq is None or hold.seq > written)
+
+    def _drop_records(self, keys=None):
+        """Drops Accounts records, they're reloaded on their next use.
+
+        :param keys: The (card_id, currency) of the records, all of them when
+                     None.
+        :type keys: iterable
+        """
+        with self._lock:
+            if keys is None:
+                dropped, self._accounts = self._accounts, {}
+            else:
+                dropped = {key: self._accounts.pop(key) for key in set(keys)
+                           if key in self._accounts}
+
+            if self.ledger is not None:
+                self._retired.update(dropped)
+
+    def _get_record(self, card_id, currency):
+        """Returns the in memory record of an Account, loading it from the
+        database on the first use.
+
+        :raises: AccountNotFound
+        """
+        key = (card_id, currency)
+        try:
+            return self._accounts[key]
+        except KeyError:
+            pass
+
+        with self._lock:
+            if key not in self._accounts:
+                using = self._get_shard(card_id)
+
+                retired = self._retired.pop(key, None)
+                if retired is not None:
+                    # Its holds in flight are durable once it's released
+                    with retired.lock:
+                        pass
+
+                # Read before the balance, see LedgerWriter.pending_debits
+                pending = (self.ledger.pending_debits(using)
+                           if self.ledger is not None else {})
+
+                try:
+                    pk, balance = (Account.objects
+                                   .using(using)
+                                   .values_list('pk', 'balance')
+                                   .get(card_id=card_id, currency=currency))
+                except Account.DoesNotExist:
+                    raise AccountNotFound
+
+                self._accounts[key] = AccountRecord(
+                    pk, balance - pending.get(pk, 0), using)
+            return self._accounts[key]
+
+    def _reload(self, card_id, currency):
+        self._drop_records([(card_id, currency)])
+        return self._get_record(card_id, currency)
+
+    def _get_balance(self, card_id, currency):
+        return self._get_record(card_id, currency).balance
+
+    def account_exists(self, card_id, currency):
+        if (card_id, currency) in self._accounts:
+            return True
+        return super().account_exists(card_id, currency)
+
+    def load_money(self, card_id, amount, currency):
+        record = self._get_record(card_id, currency)
+        with record.lock:
+            super().load_money(card_id, amount, currency)
+            record.balance += Decimal(amount)
+
+    def load_money_bulk(self, loads):
+        loads = list(loads)
+        count = super().load_money_bulk(loads)
+
+        # Loaded records are reloaded, the bulk isn't serialized with the
+        # in flight authorisations.
+        self._drop_records((card_id, currency)
+                           for card_id, amount, currency in loads)
+
+        return count
+
+    @retry_on_conflict
+    def make_authorisation(self, card_id, transaction_id, merchant_name,
+                           merchant_country, merchant_mcc, billing_amount,
+                           billing_currency, transaction_amount,
+                           transaction_currency):
+        """Decides the authorisation from the in memory balance and writes
+        the approved hold through to the database, or posts it to the
+        ledger log, see CardsIssuerDatabase.make_authorisation.
+
+        :raises: InsufficientFunds, AccountNotFound, DuplicateTransaction
+        """
+        amount = Decimal(str(billing_amount))
+        payload = (card_id, billing_currency, merchant_name,
+                   merchant_country, int(merchant_mcc), amount,
+                   Decimal(str(transaction_amount)), transaction_currency)
+
+        hold = self._holds.get(transaction_id)
+        if hold is not None:
+            if hold.payload != payload:
+                raise DuplicateTransaction
+            # Otherwise it's being posted, settled under the record lock
+            if hold.seq is not None:
+                return
+
+        key = (card_id, billing_currency)
+        while True:
+            record = self._get_record(card_id, billing_currency)
+            with record.lock:
+                if (self.ledger is not None and
+                        self._accounts.get(key) is not record):
+                    # Dropped meanwhile, its reload waits for this lock
+                    continue
+
+                if record.balance < amount:
+                    # A replay of an authorisation already presented
+                    if self._is_replay(transaction_id, payload, record.db):
+                        return
+                    raise InsufficientFunds
+
+                if self.ledger is not None:
+                    self._post_authorisation(record, transaction_id,
+                                             payload)
+                    return
+
+                self._route_transaction(transaction_id, record.db)
+
+                try:
+                    self._write_authorisation(record, transaction_id,
+                                              merchant_name,
+                                              merchant_country,
+                                              merchant_mcc, amount,
+                                              billing_currency,
+                                              transaction_amount,
+                                              transaction_currency)
+
+                except InsufficientFunds:
+                    # Spent by another writer
+                    self._reload(card_id, billing_currency)
+                    raise
+
+                except IntegrityError:
+                    # Recorded before, by another process or before the load
+                    if not self._is_replay(transaction_id, payload,
+                                           record.db):
+                        raise
+                    return
+
+                record.balance -= amount
+                self._add_hold(transaction_id,
+                               HoldRecord(record, amount, payload))
+                return
+
+    def _post_authorisation(self, record, transaction_id, payload):
+        """Posts an approved hold and its authorisation to the ledger log,
+        the record lock held. The transaction id is reserved first, so a
+        concurrent authorisation of another card can't post it too.
+
+        :param record: The Account record.
+        :type record: AccountRecord
+
+        :param transaction_id:  Unique transaction id
+        :type transaction_id: str
+
+        :param payload: The authorisation values, in the
+                        AUTHORISATION_PAYLOAD order.
+        :type payload: tuple
+
+        :raises: DuplicateTransaction
+        """
+        (card_id, billing_currency, merchant_name, merchant_country,
+         merchant_mcc, amount, transaction_amount,
+         transaction_currency) = payload
+
+        hold = HoldRecord(record, amount, payload, None)
+        with self._holds_lock:
+            reserved = self._holds.setdefault(transaction_id, hold)
+        if reserved is not hold:
+            if reserved.payload != payload:
+                raise DuplicateTransaction
+            # Approved while this one waited for the lock
+            return
+
+        try:
+            # Recorded before, by another process or before the load
+            if self._is_replay(transaction_id, payload, record.db):
+                self._drop_hold(transaction_id, hold)
+                return
+
+            self._route_transaction(transaction_id, record.db)
+
+            hold.seq = self.ledger.post(
+                [], {record.pk: amount},
+                using=record.db,
+                authorisations=[(record.pk, transaction_id, merchant_name,
+                                 merchant_country, merchant_mcc, amount,
+                                 billing_currency, transaction_amount,
+                                 transaction_currency)])
+
+        except BaseException:
+            self._drop_hold(transaction_id, hold)
+            raise
+
+        record.balance -= amount
+        self._add_hold(transaction_id, hold)
+
+    def _add_hold(self, transaction_id, hold):
+        """Keeps an approved hold in memory, the oldest ones over MAX_HOLDS
+        are dropped once written to the database."""
+        written = self.ledger.written_seq() if self.ledger is not None else 0
+        with self._holds_lock:
+            self._holds[transaction_id] = hold
+            while len(self._holds) > self.MAX_HOLDS:
+                oldest = next(iter(self._holds.values()))
+                if oldest.seq is None or oldest.seq > written:
+                    break
+                self._holds.popitem(last=False)
+
+    def _drop_hold(self, transaction_id, hold=None):
+        """Forgets a hold, only that one when given."""
+        with self._holds_lock:
+            if hold is None or self._holds.get(transaction_id) is hold:
+                self._holds.pop(transaction_id, None)
+
+    def _write_holds(self, transaction_ids):
+        """Writes the ledger log entries of the holds not written yet, so
+        their authorisations are found on the database."""
+        if self.ledger is None:
+            return
+
+        written = self.ledger.written_seq()
+        for transaction_id in transaction_ids:
+            hold = self._holds.get(transaction_id)
+            if hold is not None and (hold.seq or 0) > written:
+                self.ledger.flush()
+                return
+
+    @retry_on_conflict
+    def _write_authorisation(self, record, transaction_id, merchant_name,
+                             merchant_country, merchant_mcc, amount,
+                             billing_currency, transaction_amount,
+                             transaction_currency):
+        """Writes an approved hold and its authorisation on the Account
+        shard.
+
+        :raises: InsufficientFunds, IntegrityError
+        """
+        with transaction.atomic(using=record.db):
+            held = (Account.objects
+                    .using(record.db)
+                    .filter(pk=record.pk, balance__gte=amount)
+                    .move_funds(amount * -1, amount))
+            if not held:
+                raise InsufficientFunds
+            balances.invalidate_on_commit([record.pk], record.db)
+
+            self._create_transaction(
+                account_id=record.pk,
+                transaction_id=transaction_id,
+                transaction_type=Transaction.AUTHORISATION,
+                merchant_name=merchant_name,
+                merchant_country=merchant_country,
+                merchant_mcc=merchant_mcc,
+                billing_amount=amount,
+                billing_currency=billing_currency,
+                transaction_amount=transaction_amount,
+                transaction_currency=transaction_currency,
+                using=record.db)
+
+    def set_presentment(self, transaction_id, settlement_amount,
+                        settlement_currency):
+        # The presentment debits the held amount, the available balance
+        # doesn't change.
+        self._write_holds([transaction_id])
+        super().set_presentment(transaction_id, settlement_amount,
+                                settlement_currency)
+        self._drop_hold(transaction_id)
+
+    def set_presentments(self, presentments):
+        presentments = list(presentments)
+        self._write_holds(transaction_id
+                          for transaction_id, amount, currency
+                          in presentments)
+        results = super().set_presentments(presentments)
+        for (transaction_id, amount, currency), result in zip(presentments,
+                                                              results):
+            if result:
+                self._drop_hold(transaction_id)
+        return results
+
+    def expire_authorisations(self, until, chunk_size=None):
+        # The released holds are available once reloaded.
+        expired = super().expire_authorisations(
+            until, chunk_size or self.CHUNK_SIZE)
+        if expired:
+            self.invalidate()
+        return expired
+
+    def reconcile_balances(self):
+        fixed = super().reconcile_balances()
+        if fixed:
+            self.invalidate()
+        return fixed
@@ -0,0 +1,151 @@
+"""Read replicas: the balance inquiries and statements are read from a
+replica of the Account shard which replication lag is under the REPLICA_MAX_LAG
+staleness bound, see cards.issuer.CardsReadDatabase. The primary answers
+them when every replica is behind or unavailable."""
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, DatabaseError, DEFAULT_DB_ALIAS
+
+
+LOGGER = logging.getLogger(__name__)
+
+# Seconds a replica lag is checked again after, by process.
+LAG_CHECK_INTERVAL = 1
+
+# Replication state by database vendor: in recovery, streaming from the
+# primary, replayed everything received and the seconds since the last
+# replayed transaction. The WAL receiver status is only seen by superusers
+# and members of pg_read_all_stats, otherwise the replicas are never read.
+# Vendors without a query are never behind.
+LAG_QUERIES = {
+    'postgresql': """
+        SELECT pg_is_in_recovery(),
+               EXISTS (SELECT 1 FROM pg_stat_wal_receiver
+                       WHERE status = 'streaming'),
+               pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn(),
+               EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    """,
+}
+
+# Lag of a replica which state is unknown, it's over any staleness bound.
+STALE = float('inf')
+
+
+def replication_lag(in_recovery, streaming, replayed, replay_age):
+    """Returns the replication lag of a database from its state. A replica
+    which replayed everything it received isn't behind, even when the
+    primary had no writes for a while, as long as it's still streaming: a
+    disconnected replica replayed everything too, and may be behind forever.
+
+    >>> replication_lag(True, True, True, 30)
+    0.0
+    >>> replication_lag(True, False, True, 30)
+    inf
+
+    :returns: float -- The lag in seconds, STALE when it's unknown.
+    """
+    if not in_recovery:
+        return 0.0
+    if not streaming:
+        return STALE
+    if replayed:
+        return 0.0
+    if replay_age is None:
+        return STALE
+    return float(replay_age)
+
+
+_lags = {}
+_lags_lock = threading.Lock()
+
+
+def get_replica_lag(alias, clock=time.monotonic):
+    """Returns the replication lag of a replica, checked once every
+    LAG_CHECK_INTERVAL.
+
+    :param alias: The replica database alias.
+    :type alias: str
+
+    :param clock: Returns the current time in seconds.
+    :type clock: callable
+
+    :returns: float -- The lag in seconds, STALE when it's unknown and None
+              when the replica is unavailable.
+    """
+    now = clock()
+    checked = _lags.get(alias)
+    if checked is not None and now - checked[0] < LAG_CHECK_INTERVAL:
+        return checked[1]
+
+    connection = connections[alias]
+    query = LAG_QUERIES.get(connection.vendor)
+    try:
+        if query is None:
+            lag = 0.0
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute(query)
+                lag = replication_lag(*cursor.fetchone())
+    except DatabaseError:
+        LOGGER.warning('Replica {} unavailable'.format(alias), exc_info=True)
+        lag = None
+
+    with _lags_lock:
+        _lags[alias] = (now, lag)
+    return lag
+
+
+def clear_replica_lags():
+    """Drops the checked lags, they're checked again on the next read."""
+    with _lags_lock:
+        _lags.clear()
+
+
+def get_read_db(shard, max_lag=None):
+    """Returns the alias of a replica of a shard behind it by at most a
+    number of seconds, the shard itself when there is none.
+
+    :param shard: The shard database alias.
+    :type shard: str
+
+    :param max_lag: The staleness bound in seconds, the REPLICA_MAX_LAG
+                    setting by default.
+    :type max_lag: float
+
+    :rtype: str
+    """
+    if max_lag is None:
+        max_lag = settings.REPLICA_MAX_LAG
+
+    fresh = []
+    for alias in settings.REPLICAS.get(shard, ()):
+        lag = get_replica_lag(alias)
+        if lag is not None and lag <= max_lag:
+            fresh.append(alias)
+
+    return random.choice(fresh) if fresh else shard
+
+
+class ReplicaRouter:
+    """Routes the accounting reads made without an explicit database, out
+    of a transaction and not related to an instance, to a fresh replica of
+    the default database. The replicas are copies of their primary, they're
+    never migrated."""
+
+    def db_for_read(self, model, **hints):
+        if (model._meta.app_label != 'accounting' or 'instance' in hints or
+                connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return None
+
+        alias = get_read_db(DEFAULT_DB_ALIAS)
+        return None if alias == DEFAULT_DB_ALIAS else alias
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        for replicas in settings.REPLICAS.values():
+            if db in replicas:
+                return False
+        return None
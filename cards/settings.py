@@ -78,13 +78,91 @@ WSGI_APPLICATION = 'cards.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
+# The database profile is chosen by the CARDS_DB_ENGINE environment variable,
+# sqlite (default), sqlite-wal or postgresql.
+
+DATABASE_PROFILES = {
+    'sqlite': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        'NAME': os.environ.get('CARDS_DB_NAME',
+                               os.path.join(BASE_DIR, 'db.sqlite3')),
+    },
+    # Opt-in with CARDS_DB_ENGINE=sqlite-wal, readers don't wait for writers.
+    'sqlite-wal': {
+        # Tuned connections, see cards/backends/sqlite3/base.py
+        'ENGINE': 'cards.backends.sqlite3',
+        'NAME': os.environ.get('CARDS_DB_NAME',
+                               os.path.join(BASE_DIR, 'db.sqlite3')),
+        'OPTIONS': {
+            # Seconds to wait for a lock, also sets busy_timeout
+            'timeout': 5,
+            'IMMEDIATE_TRANSACTIONS': True,
+            'PRAGMAS': (
+                ('journal_mode', 'WAL'),
+                ('synchronous', 'NORMAL'),
+                ('mmap_size', 256 * 1024 * 1024),
+                # Negative values are KiB
+                ('cache_size', -64 * 1024),
+            ),
+        },
+    },
+    'postgresql': {
+        # Pooled connections, see cards/backends/postgresql/base.py
+        'ENGINE': 'cards.backends.postgresql',
+        'NAME': os.environ.get('CARDS_DB_NAME', 'cards'),
+        'USER': os.environ.get('CARDS_DB_USER', 'cards'),
+        'PASSWORD': os.environ.get('CARDS_DB_PASSWORD', ''),
+        'HOST': os.environ.get('CARDS_DB_HOST', 'localhost'),
+        'PORT': os.environ.get('CARDS_DB_PORT', '5432'),
+        # Closed at the end of each request, so the pooled connection goes
+        # back to the pool. A persistent one (in seconds) stays checked out
+        # by its thread and the pool starves once the threads outnumber
+        # POOL_MAX_SIZE, only set it with the pool disabled.
+        'CONN_MAX_AGE': int(os.environ.get('CARDS_DB_CONN_MAX_AGE', 0)),
+        # Server side cursors don't work behind PgBouncer transaction pooling
+        'DISABLE_SERVER_SIDE_CURSORS': (
+            os.environ.get('CARDS_DB_PGBOUNCER', '0') == '1'),
+        'OPTIONS': {
+            'POOL_MIN_SIZE': int(os.environ.get('CARDS_DB_POOL_MIN_SIZE', 1)),
+            'POOL_MAX_SIZE': int(os.environ.get('CARDS_DB_POOL_MAX_SIZE', 20)),
+            'HEALTH_CHECKS': True,
+        },
+    },
 }
 
+DATABASES = {
+    'default': DATABASE_PROFILES[os.environ.get('CARDS_DB_ENGINE', 'sqlite')],
+}
+
+# Accounts shards, see cards.sharding. CARDS_DB_SHARDS > 1 adds the shard<n>
+# databases, named as the default one with a _<n> suffix.
+SHARDS = ['default']
+
+for i in range(1, int(os.environ.get('CARDS_DB_SHARDS', 1))):
+    SHARDS.append('shard{}'.format(i))
+    DATABASES[SHARDS[-1]] = dict(
+        DATABASES['default'],
+        NAME='{}_{}'.format(DATABASES['default']['NAME'], i))
+
+# Read replicas by shard, see cards.replicas. The balance inquiries and
+# statements are read from the ones behind their shard by at most
+# REPLICA_MAX_LAG seconds. CARDS_DB_REPLICA_HOSTS adds replica<n> databases
+# of the default one, comma separated hosts.
+REPLICAS = {}
+
+for i, host in enumerate(
+        filter(None, os.environ.get('CARDS_DB_REPLICA_HOSTS', '').split(',')),
+        1):
+    REPLICAS.setdefault('default', []).append('replica{}'.format(i))
+    DATABASES[REPLICAS['default'][-1]] = dict(DATABASES['default'],
+                                              HOST=host,
+                                              TEST={'MIRROR': 'default'})
+
+REPLICA_MAX_LAG = float(os.environ.get('CARDS_DB_REPLICA_MAX_LAG', 5))
+
+DATABASE_ROUTERS = ['cards.replicas.ReplicaRouter',
+                    'cards.sharding.ShardRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -123,3 +201,73 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Cards issuer
+
+# Authorisations locking strategy: select_for_update or conditional_update
+AUTHORISATION_LOCKING = os.environ.get('CARDS_AUTHORISATION_LOCKING',
+                                       'select_for_update')
+
+# Scheme retries responses cache, see cards.api.idempotency. BACKEND is a
+# CACHES alias shared by the processes (e.g. memcached), optional.
+IDEMPOTENCY_CACHE = {
+    'MAX_SIZE': int(os.environ.get('CARDS_IDEMPOTENCY_MAX_SIZE', 100000)),
+    'TTL': int(os.environ.get('CARDS_IDEMPOTENCY_TTL', 24 * 60 * 60)),
+    'BACKEND': os.environ.get('CARDS_IDEMPOTENCY_BACKEND'),
+}
+
+# Authorisations not presented after these many days are expired by the
+# settle command, releasing their holds.
+AUTHORISATION_EXPIRY_DAYS = int(os.environ.get(
+    'CARDS_AUTHORISATION_EXPIRY_DAYS', 7))
+
+# Sub-accounts each Issuer and Scheme account is split into, by Account id,
+# so concurrent loads and presentments don't update the same row. Their
+# balances are summed when read, only grow it.
+SYSTEM_ACCOUNTS_BUCKETS = int(os.environ.get('CARDS_SYSTEM_ACCOUNTS_BUCKETS',
+                                             1))
+
+# Balance inquiries cache by process, see cards.balances. The balances are
+# invalidated by the writes of the process, the ones made by other processes
+# are seen after TTL seconds. Read from the replicas, a balance inquiry can
+# be REPLICA_MAX_LAG + TTL seconds behind the primary.
+BALANCE_CACHE = {
+    'MAX_SIZE': int(os.environ.get('CARDS_BALANCE_CACHE_MAX_SIZE', 100000)),
+    'TTL': float(os.environ.get('CARDS_BALANCE_CACHE_TTL', 2)),
+}
+
+# CSV file of source currency, target currency and rate rows, see
+# issuer.fx.load_rates. Without it the authorisations are only held from the
+# billing currency Account.
+FX_RATES_FILE = os.environ.get('CARDS_FX_RATES_FILE')
+
+# JSON file of the velocity rules, see issuer.velocity.compile_rule. The last
+# VELOCITY_HISTORY_SIZE authorisations of each card are kept in memory, for
+# the longest rule window.
+VELOCITY_RULES_FILE = os.environ.get('CARDS_VELOCITY_RULES_FILE')
+VELOCITY_HISTORY_SIZE = int(os.environ.get('CARDS_VELOCITY_HISTORY_SIZE', 32))
+
+# Database threads of the ASGI deployment, each one holds a connection.
+ASYNC_DATABASE_THREADS = int(os.environ.get('CARDS_ASYNC_DATABASE_THREADS',
+                                            16))
+
+# Issuer database engine: cards.issuer.CardsIssuerDatabase or the in memory
+# balances cards.memory.MemoryIssuerDatabase, for single process
+# deployments.
+ISSUER_DATABASE = os.environ.get('CARDS_ISSUER_DATABASE',
+                                 'cards.issuer.CardsIssuerDatabase')
+
+# Write-ahead ledger log, see cards.ledger. When PATH is set the batches are
+# appended to it with group commit and written to the database in bulk by a
+# background thread. Each process needs its own PATH. A group is written
+# once GROUP_COMMIT_ENTRIES are waiting or GROUP_COMMIT_MS after its first
+# entry, 0 waits only for the previous group.
+LEDGER_LOG = {
+    'PATH': os.environ.get('CARDS_LEDGER_LOG'),
+    'GROUP_COMMIT_ENTRIES': int(os.environ.get(
+        'CARDS_LEDGER_GROUP_COMMIT_ENTRIES', 64)),
+    'GROUP_COMMIT_MS': int(os.environ.get('CARDS_LEDGER_GROUP_COMMIT_MS', 0)),
+    'APPLY_INTERVAL_MS': int(os.environ.get('CARDS_LEDGER_APPLY_INTERVAL_MS',
+                                            50)),
+}
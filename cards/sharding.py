@@ -0,0 +1,41 @@
+"""Accounts sharding: the Accounts, with their transactions and journals,
+are partitioned by hash of the card_id across the SHARDS databases. The
+queries are routed to a shard by CardsIssuerDatabase, the router only keeps
+the other apps out of the shards."""
+import zlib
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+def get_shard(card_id, shards):
+    """Returns the database alias of the shard holding a card, stable across
+    processes.
+
+    >>> get_shard('CARD123', ['default'])
+    'default'
+    >>> get_shard('CARD124', ['default', 'shard1'])
+    'shard1'
+
+    :param card_id: The card unique identification
+    :type card_id: str
+
+    :param shards: The shards databases aliases.
+    :type shards: list
+
+    :rtype: str
+    """
+    if len(shards) == 1:
+        return shards[0]
+    return shards[zlib.crc32(card_id.encode('utf-8')) % len(shards)]
+
+
+class ShardRouter:
+    """Migrates only the accounting app on the shards other than the default
+    database. The instances are saved on the database they were read from,
+    Django's default behaviour."""
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db != DEFAULT_DB_ALIAS and db in settings.SHARDS:
+            return app_label == 'accounting'
+        return None
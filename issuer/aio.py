@@ -0,0 +1,134 @@
+import abc
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncIssuerDatabase(metaclass=abc.ABCMeta):
+    """Async variant of the IssuerDatabase, for the latency critical Scheme
+    webhooks."""
+
+    @abc.abstractmethod
+    async def make_authorisation(self, card_id, transaction_id,
+                                 merchant_name, merchant_country,
+                                 merchant_mcc, billing_amount,
+                                 billing_currency, transaction_amount,
+                                 transaction_currency):
+        """See IssuerDatabase.make_authorisation.
+
+        :raises: InsufficientFunds, DuplicateTransaction
+        """
+
+    @abc.abstractmethod
+    async def set_presentment(self, transaction_id, settlement_amount,
+                              settlement_currency):
+        """See IssuerDatabase.set_presentment.
+
+        :raises: AuthorisationNotFound
+        """
+
+
+class ThreadedIssuerDatabase(AsyncIssuerDatabase):
+    """Runs a synchronous IssuerDatabase on a bounded thread pool. The event
+    loop never waits on the database, the concurrent database work is
+    bounded by the pool size instead of the in flight requests."""
+
+    def __init__(self, db, max_workers):
+        """Instances the async database bridge.
+
+        :param db: The synchronous database bridge.
+        :type db: issuer.db.IssuerDatabase
+
+        :param max_workers: Maximum of concurrent database calls, each one
+                            holds a database connection.
+        :type max_workers: int
+        """
+        self._db = db
+        self._executor = ThreadPoolExecutor(max_workers)
+
+    def _call(self, fn, *args):
+        """Calls a function of the synchronous bridge on a pool thread.
+
+        :returns: The function result.
+        """
+        return fn(*args)
+
+    async def run(self, fn, *args):
+        """Runs a function using the synchronous bridge on a pool thread,
+        such as the Issuer service operations.
+
+        :returns: The function result.
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, self._call, fn,
+                                          *args)
+
+    async def make_authorisation(self, *args):
+        return await self.run(self._db.make_authorisation, *args)
+
+    async def set_presentment(self, *args):
+        return await self.run(self._db.set_presentment, *args)
+
+    def shutdown(self):
+        """Waits for the running database calls and stops the pool."""
+        self._executor.shutdown()
+
+
+class AsyncIssuerService:
+    """Async variant of the IssuerService: the service itself runs on the
+    async database pool threads, so both share the authorisations logic,
+    the conversion rates and the velocity limits."""
+
+    def __init__(self, db, service):
+        """Instances a new async Issuer service.
+
+        :param db: The async database bridge, the service runs on its pool.
+        :type db: issuer.aio.ThreadedIssuerDatabase
+
+        :param service: The Issuer service of the synchronous database
+                        bridge.
+        :type service: issuer.service.IssuerService
+        """
+        self._db = db
+        self._service = service
+
+    async def run(self, fn, *args):
+        """Runs a blocking function on the async database pool, as the
+        service operations are, such as the shared cache calls.
+
+        :returns: The function result.
+        """
+        return await self._db.run(fn, *args)
+
+    async def make_authorisation(self, card_id, transaction_id,
+                                 merchant_name, merchant_country,
+                                 merchant_mcc, billing_amount,
+                                 billing_currency, transaction_amount,
+                                 transaction_currency):
+        """Makes an authorisation, see IssuerService.make_authorisation.
+
+        :returns: bool -- If the authorisation was created successfully.
+
+        :raises: AccountNotFound, DuplicateTransaction, ValueError
+        """
+        return await self._db.run(self._service.make_authorisation,
+                                  card_id,
+                                  transaction_id,
+                                  merchant_name,
+                                  merchant_country,
+                                  merchant_mcc,
+                                  billing_amount,
+                                  billing_currency,
+                                  transaction_amount,
+                                  transaction_currency)
+
+    async def set_presentment(self, transaction_id, settlement_amount,
+                              settlement_currency):
+        """Sets an authorisation to presentment, see
+        IssuerService.set_presentment.
+
+        :raises: AuthorisationNotFound, ValueError
+        """
+        await self._db.run(self._service.set_presentment,
+                           transaction_id,
+                           settlement_amount,
+                           settlement_currency)
@@ -14,6 +14,11 @@ class AccountNotFound(Exception):
     """Raised when an Account doesn't exists on the database."""
 
 
+class DuplicateTransaction(Exception):
+    """Raised when a transaction id is already used by a transaction with a
+    different payload."""
+
+
 class IssuerDatabase(metaclass=abc.ABCMeta):
 
     @abc.abstractmethod
@@ -32,6 +37,17 @@ class IssuerDatabase(metaclass=abc.ABCMeta):
         :returns: bool -- If the Account is present over the database.
         """
 
+    @abc.abstractmethod
+    def create_account(self, card_id, currency):
+        """Creates an empty Account on the database.
+
+        :param card_id: The card unique identification
+        :type card_id: str
+
+        :param currency: Currency code, 3 char long.
+        :type currency: str
+        """
+
     @abc.abstractmethod
     def load_money(self, card_id, amount, currency):
         """Load money into an existent Account at the database.
@@ -53,6 +69,8 @@ class IssuerDatabase(metaclass=abc.ABCMeta):
                            transaction_currency):
         """Register a new authorisation into database, it's important to make
         sure balance checking and insertion is made at the same transaction.
+        A replay of an authorisation with the same payload succeeds without
+        holding the funds again.
 
         :param card_id: The card unique identification
         :type card_id: str
@@ -83,7 +101,7 @@ class IssuerDatabase(metaclass=abc.ABCMeta):
 
         :returns: bool -- If the authorisation was created successfully.
 
-        :raises: InsufficientFunds
+        :raises: InsufficientFunds, DuplicateTransaction
         """
 
     def set_presentment(self, transaction_id, settlement_amount,
@@ -101,3 +119,128 @@ class IssuerDatabase(metaclass=abc.ABCMeta):
 
         :raises: AuthorisationNotFound
         """
+
+    def set_presentments(self, presentments):
+        """Sets many authorisation transactions to presentment, for
+        clearing files. The database bridges should override it to write the
+        whole list at once.
+
+        :param presentments: Tuples of (transaction_id, settlement_amount,
+                             settlement_currency).
+        :type presentments: list
+
+        :returns: list -- For each presentment, if its authorisation was
+                  found and set to presentment.
+        """
+        results = []
+        for presentment in presentments:
+            try:
+                self.set_presentment(*presentment)
+            except AuthorisationNotFound:
+                results.append(False)
+            else:
+                results.append(True)
+
+        return results
+
+    def load_money_bulk(self, loads):
+        """Load money into many Accounts, creating the missing ones. The
+        database bridges should override it to write the whole list at once.
+
+        :param loads: Tuples of (card_id, amount, currency).
+        :type loads: list
+
+        :returns: int -- The number of loads.
+        """
+        count = 0
+        for card_id, amount, currency in loads:
+            if not self.account_exists(card_id, currency):
+                self.create_account(card_id, currency)
+            self.load_money(card_id, amount, currency)
+            count += 1
+
+        return count
+
+    def get_balances(self, card_id):
+        """Returns the available balances of every Account of a card, for
+        the cross currency authorisations. The database bridges should
+        override it, none is returned by default.
+
+        :param card_id: The card unique identification
+        :type card_id: str
+
+        :returns: dict -- The available balance by currency.
+        """
+        return {}
+
+    def get_authorisations(self, since):
+        """Returns the authorisations approved since a time, oldest first,
+        to rebuild the velocity limits. The database bridges should override
+        it, none is returned by default.
+
+        :param since: Seconds since the epoch.
+        :type since: float
+
+        :returns: iterable -- Tuples of (card_id, transaction_id, time,
+                  billing_amount, billing_currency, merchant_mcc,
+                  merchant_country), the time in seconds since the epoch.
+        """
+        return []
+
+
+class IssuerReadDatabase(metaclass=abc.ABCMeta):
+    """Read-only queries, for balance inquiries and reporting. They may be
+    answered by a copy of the database a bounded time behind it, the
+    authorisations never rely on them."""
+
+    @abc.abstractmethod
+    def account_exists(self, card_id, currency):
+        """Check if an Account exists on the database.
+
+        :param card_id: The card unique identification
+        :type card_id: str
+
+        :param currency: Currency code, 3 char long.
+        :type currency: str
+
+        :returns: bool -- If the Account is present over the database.
+        """
+
+    @abc.abstractmethod
+    def get_balance(self, card_id, currency):
+        """Returns an Account available balance.
+
+        :param card_id: The card unique identification
+        :type card_id: str
+
+        :param currency: Currency code, 3 char long.
+        :type currency: str
+
+        :returns: Decimal -- The Account available balance.
+
+        :raises: AccountNotFound
+        """
+
+    @abc.abstractmethod
+    def get_statement(self, card_id, currency, before=None, limit=50):
+        """Returns a page of an Account statement, newest first.
+
+        :param card_id: The card unique identification
+        :type card_id: str
+
+        :param currency: Currency code, 3 char long.
+        :type currency: str
+
+        :param before: Position of the last entry of the previous page, None
+                       for the first page.
+        :type before: tuple
+
+        :param limit: Maximum number of entries.
+        :type limit: int
+
+        :returns: tuple -- The Account (balance, held_amount), the entries
+                  and the position of the last one, None when it's the last
+                  page.
+
+        :raises: AccountNotFound
+        """
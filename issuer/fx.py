@@ -0,0 +1,161 @@
+import csv
+from decimal import Context, Decimal, ROUND_UP
+
+
+# Currencies which minor unit isn't the cent, ISO 4217.
+MINOR_UNITS = {
+    'BHD': 3, 'CLP': 0, 'IQD': 3, 'ISK': 0, 'JOD': 3, 'JPY': 0, 'KRW': 0,
+    'KWD': 3, 'LYD': 3, 'OMR': 3, 'PYG': 0, 'TND': 3, 'VND': 0,
+}
+
+# Rates are multiplied and inverted once, when the table is built. The
+# precision is explicit, the thread's decimal context may be changed.
+CONTEXT = Context(prec=28)
+
+
+class CurrencyRegistry:
+    """The supported currencies, in the configured order, and their minor
+    units. Membership is a hash lookup."""
+
+    def __init__(self, currencies):
+        """Instances the currency registry.
+
+        :param currencies: Currency codes, 3 char long.
+        :type currencies: iterable
+        """
+        self._quanta = {
+            currency: Decimal(1).scaleb(-MINOR_UNITS.get(currency, 2))
+            for currency in currencies}
+
+    def __contains__(self, currency):
+        return currency in self._quanta
+
+    def __iter__(self):
+        return iter(self._quanta)
+
+    def __len__(self):
+        return len(self._quanta)
+
+    def quantize(self, amount, currency):
+        """Rounds an amount up to the currency minor unit.
+
+        :param amount: The amount
+        :type amount: Decimal
+
+        :param currency: Currency code, 3 char long.
+        :type currency: str
+
+        :returns: Decimal -- The rounded amount.
+        """
+        return amount.quantize(self._quanta[currency], rounding=ROUND_UP)
+
+
+class RateTable:
+    """Conversion rates between every pair of supported currencies,
+    computed once from the published ones. A table is never changed, a new
+    one replaces it, so the conversions of an operation all use the same
+    rates.
+
+    >>> rates = RateTable([('USD', 'EUR', '0.9'), ('USD', 'BRL', '5')],
+    ...                   ['USD', 'EUR', 'BRL'])
+    >>> rates.convert(Decimal('10'), 'USD', 'EUR')
+    Decimal('9.00')
+    >>> rates.convert(Decimal('10'), 'EUR', 'BRL')
+    Decimal('55.56')
+    """
+
+    def __init__(self, rates, currencies):
+        """Instances the rate table, the rates not published are derived
+        from the inverse rate or through a third currency.
+
+        :param rates: Tuples of (source currency, target currency, rate),
+                      the amount in the source currency times the rate is
+                      the target currency amount.
+        :type rates: iterable
+
+        :param currencies: The supported currencies, the others rates are
+                           ignored.
+        :type currencies: iterable
+
+        :raises: ValueError
+        """
+        self._currencies = CurrencyRegistry(currencies)
+
+        published = {}
+        for source, target, rate in rates:
+            if source in self._currencies and target in self._currencies:
+                rate = Decimal(rate)
+                if rate <= 0:
+                    raise ValueError('Invalid rate {} from "{}" to "{}".'
+                                     .format(rate, source, target))
+                published[(source, target)] = rate
+
+        direct = dict(published)
+        for (source, target), rate in published.items():
+            direct.setdefault((target, source), CONTEXT.divide(1, rate))
+
+        self._pairs = {}
+        for source in self._currencies:
+            for target in self._currencies:
+                if source == target:
+                    self._pairs[(source, target)] = Decimal(1)
+                elif (source, target) in direct:
+                    self._pairs[(source, target)] = direct[(source, target)]
+                else:
+                    for pivot in self._currencies:
+                        if ((source, pivot) in direct and
+                                (pivot, target) in direct):
+                            self._pairs[(source, target)] = CONTEXT.multiply(
+                                direct[(source, pivot)],
+                                direct[(pivot, target)])
+                            break
+
+    def convert(self, amount, source, target):
+        """Converts an amount, rounded up to the target currency minor unit:
+        the funds held never fall short of the billed amount.
+
+        :param amount: Amount in the source currency
+        :type amount: Decimal
+
+        :param source: Source currency code, 3 char long.
+        :type source: str
+
+        :param target: Target currency code, 3 char long.
+        :type target: str
+
+        :returns: Decimal -- The amount in the target currency.
+
+        :raises: ValueError
+        """
+        try:
+            rate = self._pairs[(source, target)]
+        except KeyError:
+            raise ValueError('No rate from "{}" to "{}".'.format(source,
+                                                                 target))
+
+        return self._currencies.quantize(
+            CONTEXT.multiply(Decimal(str(amount)), rate), target)
+
+
+def load_rates(path, currencies):
+    """Loads a rate table from a CSV file of source currency, target
+    currency and rate rows. Blank lines and lines starting with # are
+    skipped.
+
+    :param path: The rates file path.
+    :type path: str
+
+    :param currencies: The supported currencies.
+    :type currencies: iterable
+
+    :returns: RateTable -- The rate table.
+
+    :raises: ValueError, OSError
+    """
+    with open(path, newline='') as rates_file:
+        rows = [row for row in csv.reader(rates_file)
+                if row and not row[0].startswith('#')]
+
+    return RateTable(((source.strip(), target.strip(), rate.strip())
+                      for source, target, rate in rows),
+                     currencies)
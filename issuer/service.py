@@ -1,14 +1,19 @@
 from decimal import Decimal
+from functools import partial
 import logging
 
-from issuer.db import InsufficientFunds, AuthorisationNotFound
+from issuer.db import (InsufficientFunds, AccountNotFound,
+                       AuthorisationNotFound, DuplicateTransaction, )
+from issuer.fx import CurrencyRegistry
+from issuer.velocity import VelocityExceeded
 
 
 LOGGER = logging.getLogger(__name__)
 
 
 class IssuerService:
-    def __init__(self, db, currencies):
+    def __init__(self, db, currencies, read_db=None, rates=None,
+                 velocity=None):
         """Instances a new Issuer service.
 
         :param db: The database bridge.
@@ -16,9 +21,32 @@ class IssuerService:
 
         :param currencies: List of supported currencies.
         :type currencies: list
+
+        :param read_db: The read-only database bridge answering the balance
+                        inquiries.
+        :type read_db: issuer.db.IssuerReadDatabase
+
+        :param rates: The conversion rates, the authorisations are only
+                      held from the billing currency Account without them.
+        :type rates: issuer.fx.RateTable
+
+        :param velocity: The velocity limits of the cards authorisations.
+        :type velocity: issuer.velocity.VelocityLimits
         """
         self._db = db
-        self._currencies = currencies
+        self._currencies = CurrencyRegistry(currencies)
+        self._read_db = read_db
+        self._rates = rates
+        self._velocity = velocity
+
+    def set_rates(self, rates):
+        """Replaces the conversion rates, the authorisations in flight keep
+        the table they started with.
+
+        :param rates: The conversion rates.
+        :type rates: issuer.fx.RateTable
+        """
+        self._rates = rates
 
     def _validate_currency(self, currency):
         """Validates if a currency is valid and can be used in the operation.
@@ -63,6 +91,38 @@ class IssuerService:
                     card_id,
                     currency)
 
+    def load_money_bulk(self, loads, chunk_size=1000):
+        """Load money into many Accounts, such as payroll top-ups. The loads
+        are consumed lazily and posted in one database transaction per
+        chunk, the missing Accounts are created.
+
+        :param loads: Tuples of (card_id, amount, currency).
+        :type loads: iterable
+
+        :param chunk_size: Maximum of loads by database transaction.
+        :type chunk_size: int
+
+        :returns: int -- The number of loads.
+
+        :raises: ValueError
+        """
+        count = 0
+        chunk = []
+        for card_id, amount, currency in loads:
+            self._validate_currency(currency)
+            chunk.append((card_id, Decimal(amount), currency))
+
+            if len(chunk) >= chunk_size:
+                count += self._db.load_money_bulk(chunk)
+                LOGGER.info('{} loads posted.'.format(count))
+                chunk = []
+
+        if chunk:
+            count += self._db.load_money_bulk(chunk)
+            LOGGER.info('{} loads posted.'.format(count))
+
+        return count
+
     def make_authorisation(self, card_id, transaction_id, merchant_name,
                            merchant_country, merchant_mcc, billing_amount,
                            billing_currency, transaction_amount,
@@ -72,6 +132,15 @@ class IssuerService:
         funds. If have enough funds are available it's recorded a new
         authorisation at the database.
 
+        With conversion rates, when the billing currency Account is missing
+        or short of funds, the converted billing amount is held from the
+        first other Account of the card with enough funds, in the currencies
+        order. The authorisation is recorded in that Account currency.
+
+        With velocity limits, the authorisations exceeding a rule of the
+        card recent authorisations are declined before the database is
+        reached.
+
         :param card_id: The card unique identification
         :type card_id: str
 
@@ -100,6 +169,8 @@ class IssuerService:
         :type transaction_currency: str
 
         :returns: bool -- If the authorisation was created successfully.
+
+        :raises: AccountNotFound, DuplicateTransaction
         """
 
         # Validates the Billing currency
@@ -108,41 +179,176 @@ class IssuerService:
         # Validates the transaction currency
         self._validate_currency(transaction_currency)
 
-        LOGGER.debug('Trying authorisation transaction {} for account {}:{}',
-                     transaction_id,
-                     card_id,
-                     billing_currency)
+        recorded = False
+        if self._velocity is not None:
+            try:
+                recorded = self._velocity.authorise(card_id,
+                                                    transaction_id,
+                                                    billing_amount,
+                                                    billing_currency,
+                                                    merchant_mcc,
+                                                    merchant_country)
+            except VelocityExceeded as exc:
+                LOGGER.warning('Authorisation transaction {} to account {}:{} '
+                               'exceeds the velocity rule {}'
+                               .format(transaction_id, card_id,
+                                       billing_currency, exc))
+                return False
+
+        authorised = False
+        try:
+            authorised = self._authorise(card_id,
+                                         transaction_id,
+                                         merchant_name,
+                                         merchant_country,
+                                         merchant_mcc,
+                                         billing_amount,
+                                         billing_currency,
+                                         transaction_amount,
+                                         transaction_currency)
+        finally:
+            if recorded and not authorised:
+                # Declined by the database, it isn't counted
+                self._velocity.discard(card_id, transaction_id)
+
+        return authorised
+
+    def _authorise(self, card_id, transaction_id, merchant_name,
+                   merchant_country, merchant_mcc, billing_amount,
+                   billing_currency, transaction_amount,
+                   transaction_currency):
+        """Holds the funds of a validated authorisation, see
+        make_authorisation.
+
+        :returns: bool -- If the authorisation was created successfully.
+
+        :raises: AccountNotFound, DuplicateTransaction
+        """
+
+        # The same table converts every Account tried
+        rates = self._rates
+
+        LOGGER.debug('Trying authorisation transaction {} for account {}:{}'
+                     .format(transaction_id, card_id, billing_currency))
+
+        authorise = partial(self._db.make_authorisation,
+                            card_id,
+                            transaction_id,
+                            merchant_name,
+                            merchant_country,
+                            merchant_mcc)
 
         try:
-            self._db.make_authorisation(
-                card_id,
-                transaction_id,
-                merchant_name,
-                merchant_country,
-                merchant_mcc,
-                billing_amount,
-                billing_currency,
-                transaction_amount,
-                transaction_currency)
+            authorise(billing_amount,
+                      billing_currency,
+                      transaction_amount,
+                      transaction_currency)
 
             LOGGER.info(
-                'Created authorisation transaction {} for account {}:{}',
-                transaction_id,
-                card_id,
-                billing_currency)
+                'Created authorisation transaction {} for account {}:{}'
+                .format(transaction_id, card_id, billing_currency))
 
-        except InsufficientFunds:
+        except (InsufficientFunds, AccountNotFound) as exc:
+
+            if rates is not None:
+                balances = self._db.get_balances(card_id)
+                if balances:
+                    return self._authorise_converted(
+                        rates, balances, authorise, card_id, transaction_id,
+                        billing_amount, billing_currency, transaction_amount,
+                        transaction_currency)
+
+            if isinstance(exc, AccountNotFound):
+                raise
 
             LOGGER.warning('Insufficient funds for authorisation '
-                           'transaction {} to account {}:{}',
-                           transaction_id,
-                           card_id,
-                           billing_currency)
+                           'transaction {} to account {}:{}'
+                           .format(transaction_id, card_id, billing_currency))
             return False
 
+        except DuplicateTransaction:
+
+            # A replay of an authorisation held from another Account
+            if rates is not None and self._authorise_converted(
+                    rates, self._db.get_balances(card_id), authorise,
+                    card_id, transaction_id, billing_amount,
+                    billing_currency, transaction_amount,
+                    transaction_currency, replay=True):
+                return True
+
+            LOGGER.warning('Transaction id {} already used by a different '
+                           'transaction'.format(transaction_id))
+            raise
+
         else:
             return True
 
+    def _authorise_converted(self, rates, balances, authorise, card_id,
+                             transaction_id, billing_amount, billing_currency,
+                             transaction_amount, transaction_currency,
+                             replay=False):
+        """Holds the converted billing amount from another Account of the
+        card, see make_authorisation.
+
+        :param rates: The conversion rates.
+        :type rates: issuer.fx.RateTable
+
+        :param balances: The card Accounts available balances by currency.
+        :type balances: dict
+
+        :param authorise: The database make_authorisation, the card and
+                          merchant arguments given.
+        :type authorise: callable
+
+        :param replay: If the transaction id is already used, only an
+                       authorisation recorded with the same converted
+                       payload is looked up, the balances aren't checked.
+        :type replay: bool
+
+        :returns: bool -- If the authorisation was created successfully, or
+                  replayed.
+        """
+        for currency in self._currencies:
+            if currency == billing_currency or currency not in balances:
+                continue
+
+            try:
+                amount = rates.convert(billing_amount, billing_currency,
+                                       currency)
+            except ValueError:
+                continue
+
+            if not replay and balances[currency] < amount:
+                continue
+
+            try:
+                authorise(amount,
+                          currency,
+                          transaction_amount,
+                          transaction_currency)
+
+            except InsufficientFunds:
+                # Spent since the balances were read
+                continue
+
+            except DuplicateTransaction:
+                if replay:
+                    continue
+                raise
+
+            LOGGER.info('Created authorisation transaction {} for account '
+                        '{}:{}, {} {} converted to {} {}'
+                        .format(transaction_id, card_id, currency,
+                                billing_amount, billing_currency,
+                                amount, currency))
+            return True
+
+        if not replay:
+            LOGGER.warning('Insufficient funds for authorisation '
+                           'transaction {} to the accounts of card {}'
+                           .format(transaction_id, card_id))
+        return False
+
     def set_presentment(self, transaction_id, settlement_amount,
                         settlement_currency):
         try:
@@ -161,3 +367,50 @@ class IssuerService:
         else:
             LOGGER.info('Authorisation {} set to Presentment'
                         .format(transaction_id))
+
+    def set_presentments(self, presentments):
+        """Sets many authorisations to presentment at once.
+
+        :param presentments: Tuples of (transaction_id, settlement_amount,
+                             settlement_currency).
+        :type presentments: list
+
+        :returns: list -- For each presentment, if its authorisation was
+                  found and set to presentment.
+        """
+        presentments = list(presentments)
+
+        for transaction_id, amount, currency in presentments:
+            self._validate_currency(currency)
+
+        LOGGER.debug('Trying to set {} presentments'.format(len(presentments)))
+        results = self._db.set_presentments(presentments)
+
+        for (transaction_id, amount, currency), result in zip(presentments,
+                                                              results):
+            if not result:
+                LOGGER.error('Authorisation {} is not available.'
+                             .format(transaction_id))
+
+        LOGGER.info('{} of {} authorisations set to Presentment'
+                    .format(sum(results), len(presentments)))
+        return results
+
+    def get_balance(self, card_id, currency):
+        """Returns an Account available balance, it may be a bounded time
+        behind the database, see IssuerReadDatabase. With
+        cards.issuer.CardsReadDatabase the bound is the replica lag plus the
+        balances cache TTL, see cards.balances.
+
+        :param card_id: The card unique identification
+        :type card_id: str
+
+        :param currency: Currency code, 3 char long.
+        :type currency: str
+
+        :returns: Decimal -- The Account available balance.
+
+        :raises: AccountNotFound, ValueError
+        """
+        self._validate_currency(currency)
+        return self._read_db.get_balance(card_id, currency)
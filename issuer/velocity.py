@@ -0,0 +1,451 @@
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from decimal import Decimal
+from itertools import product
+import json
+from operator import attrgetter
+import threading
+import time
+
+
+# An entry of the card history: (time, transaction id, amount, currency,
+# merchant mcc, merchant country).
+DISCARDED = (float('-inf'), None, Decimal(0), None, None, None)
+
+GROUPS = ('mcc', 'country')
+
+
+class VelocityExceeded(Exception):
+    """Raised when an authorisation exceeds a velocity rule, its name is the
+    exception argument."""
+
+
+def compile_rule(rule):
+    """Compiles a velocity rule into a predicate of the card history. A rule
+    is a dict of:
+
+    - ``name``: Identifies the rule on the logs.
+    - ``window``: The sliding window, in seconds.
+    - ``max_count``: Maximum of authorisations in the window, this one
+      included.
+    - ``max_amount``: Maximum of amount in the window, in the rule
+      ``currency`` which is then required.
+    - ``mcc``, ``country``, ``currency``: Optional lists of merchant
+      categories and countries, and a currency, the rule only applies to
+      and counts the authorisations matching them.
+    - ``per``: Optional list of ``mcc`` and ``country``, the authorisations
+      are counted separately by merchant category or country.
+
+    >>> rule = compile_rule({'name': 'gambling', 'window': 3600,
+    ...                      'max_count': 2, 'mcc': [7995]})
+    >>> rule.allows([(0, 'T1', Decimal(5), 'BRL', 7995, 'BR')], 60,
+    ...             Decimal(5), 'BRL', 7995, 'BR')
+    True
+    >>> rule.allows([(0, 'T1', Decimal(5), 'BRL', 7995, 'BR')] * 2, 60,
+    ...             Decimal(5), 'BRL', 7995, 'BR')
+    False
+    >>> rule.allows([], 60, Decimal(5), 'BRL', 7995, 'BR',
+    ...             [[0, 2, Decimal(10), 'BRL', 7995, 'BR']])
+    False
+
+    :param rule: The rule definition.
+    :type rule: dict
+
+    :returns: Rule -- The compiled rule.
+
+    :raises: ValueError
+    """
+    try:
+        name = rule['name']
+        window = float(rule['window'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Invalid velocity rule {!r}.'.format(rule))
+
+    max_count = rule.get('max_count')
+    max_amount = rule.get('max_amount')
+    rule_currency = rule.get('currency')
+    mccs = frozenset(int(mcc) for mcc in rule.get('mcc', ()))
+    countries = frozenset(rule.get('country', ()))
+    per = frozenset(rule.get('per', ()))
+
+    if max_count is None and max_amount is None:
+        raise ValueError('Velocity rule "{}" has no limit.'.format(name))
+    if max_amount is not None and rule_currency is None:
+        raise ValueError('Velocity rule "{}" amount has no currency.'
+                         .format(name))
+    if not per <= frozenset(GROUPS):
+        raise ValueError('Velocity rule "{}" can only be per {}.'
+                         .format(name, ' or '.join(GROUPS)))
+
+    # Every condition is resolved once, the predicate only runs the ones
+    # the rule has.
+    conditions = []
+    if mccs:
+        conditions.append(lambda entry, mcc, country: entry[4] in mccs)
+    if countries:
+        conditions.append(lambda entry, mcc, country: entry[5] in countries)
+    if rule_currency is not None:
+        conditions.append(
+            lambda entry, mcc, country: entry[3] == rule_currency)
+    if 'mcc' in per:
+        conditions.append(lambda entry, mcc, country: entry[4] == mcc)
+    if 'country' in per:
+        conditions.append(lambda entry, mcc, country: entry[5] == country)
+
+    if max_count is not None:
+        max_count = int(max_count)
+    count_limit = float('inf') if max_count is None else max_count
+    amount_limit = (Decimal('Infinity') if max_amount is None
+                    else Decimal(str(max_amount)))
+
+    def allows(entries, now, amount, currency, mcc, country, folded=()):
+        start = now - window
+        count = 1
+        total = amount
+        for entry in entries:
+            if entry[0] <= start:
+                continue
+            for condition in conditions:
+                if not condition(entry, mcc, country):
+                    break
+            else:
+                count += 1
+                total += entry[2]
+
+        # Counted as if made at the last of them
+        for entry in folded:
+            if entry[0] > start and all(condition(entry, mcc, country)
+                                        for condition in conditions):
+                count += entry[1]
+                total += entry[2]
+
+        return count <= count_limit and total <= amount_limit
+
+    keys = list(product(mccs or [None], countries or [None],
+                        [rule_currency]))
+    return Rule(name, window, max_count, rule_currency, count_limit,
+                amount_limit, keys, allows)
+
+
+class Rule:
+    """A compiled velocity rule, see compile_rule."""
+    __slots__ = ('name', 'window', 'max_count', 'currency', 'count_limit',
+                 'amount_limit', 'keys', 'allows')
+
+    def __init__(self, name, window, max_count, currency, count_limit,
+                 amount_limit, keys, allows):
+        self.name = name
+        self.window = window
+
+        # None when only the amount is limited
+        self.max_count = max_count
+
+        # The limits, infinite when the rule has none
+        self.currency = currency
+        self.count_limit = count_limit
+        self.amount_limit = amount_limit
+
+        # The (mcc, country, currency) the rule applies to, None matches any
+        self.keys = keys
+
+        # The predicate of (entries, now, amount, currency, mcc, country,
+        # folded entries)
+        self.allows = allows
+
+
+class RuleChain:
+    """The rules of an index key, see Rule.keys, sorted by their limits: an
+    authorisation only evaluates the rules which limit the card history
+    could exceed, found by bisection.
+    """
+    __slots__ = ('rules', 'by_count', 'count_limits', 'by_amount',
+                 'amount_limits')
+
+    def __init__(self, rules):
+        self.rules = rules
+
+        self.by_count = sorted((rule for rule in rules
+                                if rule.max_count is not None),
+                               key=attrgetter('count_limit'))
+        self.count_limits = [rule.count_limit for rule in self.by_count]
+
+        self.by_amount = sorted((rule for rule in rules
+                                 if rule.amount_limit.is_finite()),
+                                key=attrgetter('amount_limit'))
+        self.amount_limits = [rule.amount_limit for rule in self.by_amount]
+
+    def check(self, entries, now, count, total, amount, currency, mcc,
+              country, folded=()):
+        """Returns the name of a rule the authorisation exceeds, None when
+        it exceeds none.
+
+        :param count: The card authorisations, this one included, an upper
+                      bound of any rule count.
+        :type count: int
+
+        :param total: The card authorisations amount in the authorisation
+                      currency, this one included, an upper bound of any
+                      rule amount.
+        :type total: Decimal
+        """
+        for rules, limits, bound in ((self.by_count, self.count_limits,
+                                      count),
+                                     (self.by_amount, self.amount_limits,
+                                      total)):
+            for rule in rules[:bisect_left(limits, bound)]:
+                if not rule.allows(entries, now, amount, currency, mcc,
+                                   country, folded):
+                    return rule.name
+
+        return None
+
+
+def load_rules(path):
+    """Loads the velocity rules from a JSON file of a list of rules, see
+    compile_rule.
+
+    :param path: The rules file path.
+    :type path: str
+
+    :returns: list -- The compiled rules.
+
+    :raises: ValueError, OSError
+    """
+    with open(path) as rules_file:
+        return [compile_rule(rule) for rule in json.load(rules_file)]
+
+
+class CardHistory:
+    """Ring buffer of the last authorisations of a card, the ones it
+    overwrites are folded into running totals."""
+    __slots__ = ('entries', 'position', 'last', 'folded')
+
+    def __init__(self):
+        self.entries = []
+        self.position = 0
+        self.last = float('-inf')
+        # Folded entries by (currency, mcc, country): [last time, count,
+        # amount, currency, merchant mcc, merchant country]
+        self.folded = {}
+
+    def append(self, entry, size):
+        if len(self.entries) < size:
+            self.entries.append(entry)
+        else:
+            self._fold(self.entries[self.position])
+            self.entries[self.position] = entry
+            self.position = (self.position + 1) % size
+        self.last = max(self.last, entry[0])
+
+    def _fold(self, entry):
+        if entry[1] is None:
+            # Discarded
+            return
+
+        key = entry[3:]
+        folded = self.folded.get(key)
+        if folded is None:
+            self.folded[key] = [entry[0], 1, entry[2], *key]
+        else:
+            folded[0] = max(folded[0], entry[0])
+            folded[1] += 1
+            folded[2] += entry[2]
+
+    def get_folded(self, start):
+        """Returns the folded entries, the ones which last time left every
+        window since start are dropped."""
+        if not self.folded:
+            return ()
+
+        for key, folded in list(self.folded.items()):
+            if folded[0] <= start:
+                del self.folded[key]
+        return list(self.folded.values())
+
+
+class VelocityLimits:
+    """Evaluates the velocity rules of the authorisations from the cards
+    recent authorisations kept in memory, no transaction is looked up. Each
+    card keeps its last authorisations of the longest rule window, they're
+    rebuilt from the database on startup and the cards without any are
+    dropped.
+
+    Past history_size, the oldest authorisations of a card are folded into
+    running totals by merchant category, country and currency. The rules
+    still count and sum them while the last of them is in the window, so a
+    card is never under counted: at worst the authorisations folded
+    together are counted a while after the first ones left the window.
+
+    The rules are indexed by merchant category, country and currency, an
+    authorisation only looks up the chains of its own, see RuleChain.
+    """
+
+    def __init__(self, rules, history_size=32, history=None,
+                 clock=time.time):
+        """Instances the velocity limits.
+
+        :param rules: The compiled rules.
+        :type rules: list
+
+        :param history_size: Authorisations kept by card, the older ones
+                             are folded. The count rules can't limit more.
+        :type history_size: int
+
+        :param history: Returns the authorisations made since a time, oldest
+                        first, see IssuerDatabase.get_authorisations.
+        :type history: callable
+
+        :param clock: Returns the current time, in seconds since the epoch.
+        :type clock: callable
+
+        :raises: ValueError
+        """
+        index = defaultdict(list)
+        for rule in rules:
+            if rule.max_count is not None and (
+                    rule.max_count > history_size):
+                raise ValueError('Velocity rule "{}" counts more than {} '
+                                 'authorisations.'.format(rule.name,
+                                                          history_size))
+            for key in rule.keys:
+                index[key].append(rule)
+
+        self._chains = {key: RuleChain(chain_rules)
+                        for key, chain_rules in index.items()}
+        self._window = max((rule.window for rule in rules), default=0)
+        self._size = history_size
+        self._cards = OrderedDict()
+        self._lock = threading.Lock()
+        self._history = history
+        self._clock = clock
+
+    def _get_chains(self, currency, mcc, country):
+        """Returns the chains of the rules applying to an authorisation."""
+        chains = []
+        for key in product((mcc, None), (country, None), (currency, None)):
+            chain = self._chains.get(key)
+            if chain is not None:
+                chains.append(chain)
+        return chains
+
+    def start(self):
+        """Rebuilds the cards histories in background, the authorisations
+        wait for it. Otherwise they're rebuilt by the first one."""
+        threading.Thread(target=self.load, daemon=True).start()
+
+    def load(self):
+        """Rebuilds the cards histories from the database, once."""
+        with self._lock:
+            self._load(self._clock())
+
+    def _load(self, now):
+        history, self._history = self._history, None
+        if history is None:
+            return
+
+        for (card_id, transaction_id, timestamp, amount, currency,
+                mcc, country) in history(now - self._window):
+            self._append(card_id, (timestamp, transaction_id, amount,
+                                   currency, mcc, country))
+
+    def _append(self, card_id, entry):
+        card = self._cards.get(card_id)
+        if card is None:
+            card = self._cards[card_id] = CardHistory()
+        else:
+            self._cards.move_to_end(card_id)
+        card.append(entry, self._size)
+
+    def _prune(self, now):
+        """Drops the cards which last authorisation left every window,
+        the least recently used first."""
+        start = now - self._window
+        while self._cards:
+            card_id, card = next(iter(self._cards.items()))
+            if card.last > start:
+                break
+            del self._cards[card_id]
+
+    def authorise(self, card_id, transaction_id, amount, currency, mcc,
+                  country):
+        """Evaluates the rules of an authorisation and records it. A replay
+        of a recorded authorisation isn't evaluated again.
+
+        :param card_id: The card unique identification
+        :type card_id: str
+
+        :param transaction_id:  Unique transaction id
+        :type transaction_id: str
+
+        :param amount: Amount to be billed
+        :type amount: Decimal
+
+        :param currency: Billing currency code, 3 char long.
+        :type currency: str
+
+        :param mcc: Merchant category code, 4 digits
+        :type mcc: int
+
+        :param country: Merchant country abbreviated.
+        :type country: str
+
+        :returns: bool -- If the authorisation was recorded, False on a
+                  replay.
+
+        :raises: VelocityExceeded
+        """
+        amount = Decimal(str(amount))
+        mcc = int(mcc)
+        now = self._clock()
+
+        with self._lock:
+            self._load(now)
+
+            card = self._cards.get(card_id)
+            entries = card.entries if card is not None else ()
+            folded = (card.get_folded(now - self._window)
+                      if card is not None else ())
+
+            for entry in entries:
+                if entry[1] == transaction_id:
+                    return False
+
+            count = len(entries) + 1
+            total = amount
+            for entry in entries:
+                if entry[3] == currency:
+                    total += entry[2]
+            for entry in folded:
+                count += entry[1]
+                if entry[3] == currency:
+                    total += entry[2]
+
+            for chain in self._get_chains(currency, mcc, country):
+                exceeded = chain.check(entries, now, count, total, amount,
+                                       currency, mcc, country, folded)
+                if exceeded is not None:
+                    raise VelocityExceeded(exceeded)
+
+            self._append(card_id, (now, transaction_id, amount, currency,
+                                   mcc, country))
+            self._prune(now)
+
+        return True
+
+    def discard(self, card_id, transaction_id):
+        """Forgets a recorded authorisation, the database didn't approve it.
+
+        :param card_id: The card unique identification
+        :type card_id: str
+
+        :param transaction_id:  Unique transaction id
+        :type transaction_id: str
+        """
+        with self._lock:
+            card = self._cards.get(card_id)
+            if card is None:
+                return
+
+            for position, entry in enumerate(card.entries):
+                if entry[1] == transaction_id:
+                    card.entries[position] = DISCARDED
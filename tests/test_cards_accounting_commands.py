@@ -0,0 +1,204 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+from django.utils import timezone
+
+from cards.accounting.models import Account, Transaction
+from cards.issuer import CardsIssuerDatabase
+from cards.ledger import LedgerWriter
+
+
+class LoadPresentmentsTests(TestCase):
+    CARD_ID = 'CARD123'
+    CURRENCY = 'BRL'
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+        Account.objects.create(card_id=self.CARD_ID, currency=self.CURRENCY)
+
+        issuerdb = CardsIssuerDatabase()
+        issuerdb.load_money(self.CARD_ID, 300, self.CURRENCY)
+        for transaction_id in ('TR1', 'TR2', 'TR3'):
+            issuerdb.make_authorisation(self.CARD_ID, transaction_id,
+                                        'Game Store', 'BR', 1234,
+                                        100, self.CURRENCY,
+                                        100, self.CURRENCY)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def _call(self, path, **params):
+        call_command('load_presentments', path, stdout=StringIO(), **params)
+
+    def _presented(self):
+        return sorted(Transaction.objects
+                      .filter(transaction_type=Transaction.PRESENTMENT)
+                      .values_list('transaction_id', flat=True))
+
+    def _rejects(self, path):
+        with open(path + '.rejects') as f:
+            return [json.loads(line) for line in f]
+
+    def test_load_csv(self):
+        path = self._write('clearing.csv',
+                           'transaction_id,settlement_amount,'
+                           'settlement_currency\n'
+                           'TR1,95,BRL\n'
+                           'MISSING,95,BRL\n'
+                           'TR2,-1,BRL\n'
+                           'TR3,90.50,BRL\n')
+
+        self._call(path, chunk_size=2)
+
+        self.assertEqual(self._presented(), ['TR1', 'TR3'])
+
+        rejects = self._rejects(path)
+        self.assertEqual([r['line'] for r in rejects],
+                         ['MISSING,95,BRL', 'TR2,-1,BRL'])
+        self.assertEqual(rejects[0]['reason'], 'Authorisation not found')
+        self.assertIn('settlement_amount', rejects[1]['reason'])
+
+        # The whole file was committed
+        with open(path + '.offset') as f:
+            self.assertEqual(int(f.read()), os.path.getsize(path))
+
+        self.assertFalse(Account.objects.unreconciled().exists())
+
+    def test_load_jsonl_resume(self):
+        first = json.dumps({'transaction_id': 'TR1',
+                            'settlement_amount': 95,
+                            'settlement_currency': 'BRL'}) + '\n'
+        path = self._write('clearing.jsonl',
+                           first +
+                           'not json\n' +
+                           json.dumps({'transaction_id': 'TR2',
+                                       'settlement_amount': 95,
+                                       'settlement_currency': 'BRL'}) + '\n')
+
+        # Resumes after the first line, as saved by a previous run
+        self._write('clearing.jsonl.offset', str(len(first)))
+
+        self._call(path)
+
+        self.assertEqual(self._presented(), ['TR2'])
+        self.assertEqual([r['line'] for r in self._rejects(path)],
+                         ['not json'])
+
+        # An explicit offset has precedence over the state file
+        self._call(path, offset=0)
+
+        self.assertEqual(self._presented(), ['TR1', 'TR2'])
+
+    def test_resume_after_crash(self):
+        """The rows committed after the saved offset are skipped, not
+        rejected."""
+        path = self._write('clearing.csv',
+                           'transaction_id,settlement_amount,'
+                           'settlement_currency\n'
+                           'TR1,95,BRL\n'
+                           'TR2,95,BRL\n')
+        self._call(path)
+
+        # Crashed before saving the offset
+        os.remove(path + '.offset')
+        stdout = StringIO()
+        call_command('load_presentments', path, stdout=stdout)
+
+        self.assertEqual(self._presented(), ['TR1', 'TR2'])
+        self.assertFalse(os.path.getsize(path + '.rejects'))
+        self.assertIn('0 presentments set, 2 already set, 0 rejected',
+                      stdout.getvalue())
+        self.assertFalse(Account.objects.unreconciled().exists())
+
+    def test_undecodable_row(self):
+        path = os.path.join(self.tmpdir, 'clearing.csv')
+        with open(path, 'wb') as f:
+            f.write(b'transaction_id,settlement_amount,settlement_currency\n'
+                    b'TR1,95,BRL\n'
+                    b'TR\xff,95,BRL\n'
+                    b'TR2,95,BRL\n')
+
+        self._call(path)
+
+        self.assertEqual(self._presented(), ['TR1', 'TR2'])
+        self.assertEqual(self._rejects(path),
+                         [{'line': 'TR\ufffd,95,BRL',
+                           'reason': 'Malformed row'}])
+
+
+class RecoverLedgerLogTests(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.addCleanup(CardsIssuerDatabase.invalidate_system_accounts)
+
+    def test_recover(self):
+        acc = Account.objects.create(card_id='CARD123', currency='BRL')
+        issuer_acc = CardsIssuerDatabase()._get_issuer_account('BRL')
+        path = os.path.join(self.tmpdir, 'ledger.log')
+
+        ledger = LedgerWriter(path, apply_interval_ms=None)
+        ledger.post([(issuer_acc.pk, -100), (acc.pk, 100)])
+        ledger.stop()
+
+        out = StringIO()
+        call_command('recover_ledger_log', path, stdout=out)
+        self.assertIn('Recovered 1 entries', out.getvalue())
+
+        call_command('recover_ledger_log', path, stdout=StringIO())
+
+        acc.refresh_from_db()
+        self.assertEqual(acc.balance, 100)
+        self.assertFalse(Account.objects.unreconciled().exists())
+
+
+class SettleTests(TestCase):
+
+    def setUp(self):
+        self.addCleanup(CardsIssuerDatabase.invalidate_system_accounts)
+        self.issuerdb = CardsIssuerDatabase()
+        Account.objects.create(card_id='CARD123', currency='BRL')
+        self.issuerdb.load_money('CARD123', 100, 'BRL')
+        for transaction_id in ('T1', 'T2'):
+            self.issuerdb.make_authorisation('CARD123', transaction_id,
+                                             'Game Store', 'BR', 1234,
+                                             10, 'BRL', 10, 'BRL')
+        self.issuerdb.set_presentment('T1', 9, 'BRL')
+
+    def _call(self, **params):
+        out = StringIO()
+        call_command('settle', stdout=out, **params)
+        return out.getvalue()
+
+    def test_settle(self):
+        today = timezone.localdate().isoformat()
+        output = self._call(date=today, expiry_days=0)
+
+        self.assertIn('Expired 1 authorisations', output)
+        self.assertIn('Settlement {} BRL: 9.00 (1 presentments)'.format(today),
+                      output)
+        self.assertEqual(Transaction.objects.get(transaction_id='T2')
+                         .transaction_type, Transaction.EXPIRED)
+        self.assertFalse(Account.objects.unreconciled().exists())
+
+    def test_nothing_to_settle(self):
+        output = self._call()
+
+        self.assertIn('Expired 0 authorisations', output)
+        self.assertIn('No presentments settled', output)
+        self.assertEqual(Transaction.objects.authorisations().count(), 1)
+
+    def test_invalid_date(self):
+        with self.assertRaises(CommandError):
+            self._call(date='yesterday')
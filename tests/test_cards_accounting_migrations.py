@@ -0,0 +1,148 @@
+from decimal import Decimal
+
+from django.db import IntegrityError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+from cards.accounting import models
+
+
+class BaselineSchemaTests(TransactionTestCase):
+    """A database created before the migrations has the 0001 tables and no
+    migrations history, it's upgraded faking the initial migration."""
+
+    initial = [('accounting', '0001_initial')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('accounting', None)])
+
+        self.apps = executor.loader.project_state(self.initial).apps
+        with connection.schema_editor() as editor:
+            for model in self.apps.get_app_config('accounting').get_models():
+                editor.create_model(model)
+
+    def tearDown(self):
+        self.migrate()
+
+    def migrate(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes(),
+                         fake_initial=True)
+
+    def test_balances_backfilled(self):
+        """The maintained balances are computed from the ledger."""
+        Account = self.apps.get_model('accounting', 'Account')
+        Batch = self.apps.get_model('accounting', 'Batch')
+        Journal = self.apps.get_model('accounting', 'Journal')
+        Transaction = self.apps.get_model('accounting', 'Transaction')
+
+        # The baseline Account had no maintained balances
+        self.assertEqual([field.name for field in Account._meta.fields],
+                         ['id', 'card_id', 'currency'])
+
+        account = Account.objects.create(card_id='card-brl', currency='BRL')
+        empty = Account.objects.create(card_id='card-usd', currency='USD')
+        batch = Batch.objects.create(description='Load')
+        Journal.objects.create(batch=batch, account=account,
+                               amount=Decimal(100))
+        fields = dict(account=account,
+                      merchant_name='Merchant',
+                      merchant_country='BR',
+                      merchant_mcc=5411,
+                      billing_amount=Decimal(30),
+                      billing_currency='BRL',
+                      transaction_amount=Decimal(30),
+                      transaction_currency='BRL')
+        Transaction.objects.create(transaction_id='TR1', **fields)
+        Transaction.objects.create(transaction_id='TR2',
+                                   transaction_type='p', **fields)
+
+        self.migrate()
+
+        self.assertEqual(
+            list(models.Account.objects
+                 .order_by('pk')
+                 .values_list('pk', 'balance', 'held_amount')),
+            [(account.pk, Decimal(70), Decimal(30)),
+             (empty.pk, Decimal(0), Decimal(0))])
+        self.assertFalse(models.Account.objects.unreconciled().exists())
+
+
+class UniqueTransactionIdTests(TransactionTestCase):
+    """The 0004 migration resolves the duplicated transaction ids before
+    making them unique."""
+
+    before = [('accounting', '0003_hot_query_indexes')]
+    after = [('accounting', '0004_unique_transaction_id')]
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate(self.before)
+        self.executor.loader.build_graph()
+
+        apps = self.executor.loader.project_state(self.before).apps
+        self.Account = apps.get_model('accounting', 'Account')
+        self.Transaction = apps.get_model('accounting', 'Transaction')
+        self.account = self.Account.objects.create(card_id='card-brl',
+                                                   currency='BRL',
+                                                   balance=Decimal(60),
+                                                   held_amount=Decimal(40))
+
+    def tearDown(self):
+        # The unresolved duplicates would fail the migration again
+        self.Transaction.objects.all().delete()
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def create_authorisation(self, transaction_id, **kwargs):
+        fields = dict(transaction_id=transaction_id,
+                      transaction_type='a',
+                      account=self.account,
+                      merchant_name='Merchant',
+                      merchant_country='BR',
+                      merchant_mcc=5411,
+                      billing_amount=Decimal(20),
+                      billing_currency='BRL',
+                      transaction_amount=Decimal(20),
+                      transaction_currency='BRL')
+        fields.update(kwargs)
+        return self.Transaction.objects.create(**fields)
+
+    def migrate(self):
+        self.executor.migrate(self.after)
+        return self.executor.loader.project_state(self.after).apps
+
+    def test_retries_removed(self):
+        """The retries are removed and their held funds released."""
+        original = self.create_authorisation('TR1')
+        self.create_authorisation('TR1')
+        other = self.create_authorisation('TR2', billing_amount=Decimal(1))
+
+        apps = self.migrate()
+        Account = apps.get_model('accounting', 'Account')
+        Transaction = apps.get_model('accounting', 'Transaction')
+
+        self.assertEqual(
+            sorted(Transaction.objects.values_list('pk', flat=True)),
+            [original.pk, other.pk])
+        self.assertEqual(
+            Account.objects.values_list('balance', 'held_amount').get(),
+            (Decimal(80), Decimal(20)))
+
+    def test_conflicts_reported(self):
+        """A duplicate with a different payload fails the migration, nothing
+        is changed."""
+        self.create_authorisation('TR1')
+        self.create_authorisation('TR1')
+        self.create_authorisation('TR2')
+        self.create_authorisation('TR2', billing_amount=Decimal(5))
+
+        with self.assertRaisesRegex(IntegrityError,
+                                    '1 transaction ids .*: TR2$'):
+            self.migrate()
+
+        self.assertEqual(self.Transaction.objects.count(), 4)
+        self.assertEqual(
+            self.Account.objects.values_list('balance', 'held_amount').get(),
+            (Decimal(60), Decimal(40)))
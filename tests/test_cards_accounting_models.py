@@ -1,7 +1,10 @@
-from django.db import IntegrityError
+from unittest import skipUnless
+
+from django.db import IntegrityError, connection
 from django.test import TestCase
 
-from cards.accounting.models import Account, Transaction, Batch
+from cards.accounting.models import (Account, AccountCheckpoint, Transaction,
+                                     Batch, )
 
 
 class ModelsTests(TestCase):
@@ -35,9 +38,52 @@ class ModelsTests(TestCase):
             .filter(pk=self.acc.id)
             .balance()
             .get()
-            .balance,
+            .ledger_balance,
             1)
 
+    def test_account_authorisations_sum(self):
+        """Every open authorisation is summarized, no matter how many journals
+        the Account has."""
+        batch = Batch.objects.create(description='Bank Deposit')
+
+        self.acc.journals.create(amount=100, batch=batch)
+        self.acc.journals.create(amount=100, batch=batch)
+
+        for transaction_id in ('tr-1', 'tr-2'):
+            self.acc.transactions.create(
+                transaction_id=transaction_id,
+                transaction_type=Transaction.AUTHORISATION,
+                merchant_mcc=0,
+                billing_amount=30,
+                transaction_amount=30)
+
+        acc = Account.objects.filter(pk=self.acc.id).balance().get()
+
+        self.assertEqual(acc.authorisations_sum, 60)
+        self.assertEqual(acc.ledger_balance, 140)
+
+    def test_account_move_funds(self):
+        """The maintained balance is updated in place."""
+        Account.objects.filter(pk=self.acc.id).move_funds(100)
+        Account.objects.filter(pk=self.acc.id).move_funds(-30, 30)
+
+        self.acc.refresh_from_db()
+
+        self.assertEqual(self.acc.balance, 70)
+        self.assertEqual(self.acc.held_amount, 30)
+
+    def test_account_unreconciled(self):
+        """Accounts which maintained balance diverges from the ledger are
+        filtered."""
+        self.assertFalse(Account.objects.unreconciled().exists())
+
+        batch = Batch.objects.create(description='Bank Deposit')
+        self.acc.journals.create(amount=100, batch=batch)
+
+        self.assertQuerysetEqual(Account.objects.unreconciled(),
+                                 [self.acc.pk],
+                                 transform=lambda acc: acc.pk)
+
     def test_account_journals_sum(self):
         """Check if the summarize for Account journals are being calculated
         properly."""
@@ -62,3 +108,69 @@ class ModelsTests(TestCase):
             .get()
             .journals_sum,
             50)
+
+    def test_account_journals_sum_checkpoint(self):
+        """Only the journals after the latest checkpoint are summarized on top
+        of the checkpoint balance."""
+        batch = Batch.objects.create(description='Bank Deposit')
+
+        journal = self.acc.journals.create(amount=100, batch=batch)
+
+        self.assertEqual(AccountCheckpoint.objects.create_until(journal.pk), 1)
+
+        # Nothing new to checkpoint
+        self.assertEqual(AccountCheckpoint.objects.create_until(journal.pk), 0)
+
+        self.acc.journals.create(amount=-30, batch=batch)
+
+        acc = Account.objects.filter(pk=self.acc.id).journals_sum().get()
+
+        self.assertEqual(acc.checkpoint_balance, 100)
+        self.assertEqual(acc.checkpoint_journal_id, journal.pk)
+        self.assertEqual(acc.journals_sum, 70)
+
+        # The checkpoint balance is used instead of the journals before it
+        AccountCheckpoint.objects.update(balance=1000)
+
+        self.assertEqual(
+            Account.objects
+            .filter(pk=self.acc.id)
+            .journals_sum()
+            .get()
+            .journals_sum,
+            970)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Checks the SQLite query plans.')
+class IndexesTests(TestCase):
+    def explain(self, queryset):
+        """Returns the SQLite query plan details as a single string."""
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+
+    def test_authorisation_lookup(self):
+        """The presentment finds its authorisation by the unique index."""
+        plan = self.explain(
+            Transaction.objects
+            .only('account_id', 'billing_amount')
+            .filter(transaction_id='tr-1',
+                    transaction_type=Transaction.AUTHORISATION))
+
+        self.assertRegex(plan, r'USING INDEX \S+ \(transaction_id=\?\)')
+
+    def test_authorisations_sum(self):
+        """The held funds are summarized from a covering index, the table is
+        never read."""
+        plan = self.explain(Account.objects.all().authorisations_sum())
+
+        self.assertRegex(
+            plan, r'COVERING INDEX accounting_tr_(account|open_auth)_idx')
+
+    def test_journals_sum(self):
+        """Only the journals after the checkpoint are read, from a covering
+        index."""
+        plan = self.explain(Account.objects.all().journals_sum())
+
+        self.assertIn('COVERING INDEX accounting_jr_account_idx', plan)
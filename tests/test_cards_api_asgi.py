@@ -0,0 +1,230 @@
+import asyncio
+import json
+import threading
+from unittest.mock import patch
+from urllib.parse import urlencode
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import (RequestFactory, TransactionTestCase,
+                         override_settings, )
+
+from cards import issuer
+from cards.api import idempotency
+from cards.api.asgi import application
+from cards.api.views import AuthorisationView
+from cards.issuer import CardsIssuerDatabase
+from issuer.velocity import VelocityLimits, compile_rule
+
+
+def request(path, payload=None, method='POST', content_type=None):
+    """Calls the ASGI application, returns the status and the body."""
+    body = payload if isinstance(payload, bytes) else \
+        json.dumps(payload).encode('utf-8')
+    scope = {'type': 'http',
+             'method': method,
+             'path': path,
+             'headers': [(b'content-type',
+                          content_type or b'application/json')]}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.new_event_loop().run_until_complete(
+        application(scope, receive, send))
+
+    return messages[0]['status'], messages[1]['body']
+
+
+class ApplicationTests(TransactionTestCase):
+    """The database runs on the async pool threads, the data has to be
+    committed to be seen by them."""
+    AUTHORISATION_URL = '/api/authorisation/'
+    PRESENTMENT_URL = '/api/presentment/'
+
+    CARD_ID = 'CARD123'
+    CURRENCY = 'BRL'
+
+    AUTHORISATION = {
+        'card_id': CARD_ID,
+        'transaction_id': 'IDDQD666',
+        'merchant_name': 'Game Store',
+        'merchant_country': 'BR',
+        'merchant_mcc': 1234,
+        'billing_amount': 100,
+        'billing_currency': CURRENCY,
+        'transaction_amount': 100,
+        'transaction_currency': CURRENCY,
+    }
+
+    PRESENTMENT = {
+        'transaction_id': 'IDDQD666',
+        'settlement_amount': 95,
+        'settlement_currency': CURRENCY,
+    }
+
+    def setUp(self):
+        # The flush between tests removes the committed rows.
+        issuer.database.invalidate()
+        idempotency.clear()
+
+    def _add_funds(self, amount):
+        issuerdb = CardsIssuerDatabase()
+        issuerdb.create_account(self.CARD_ID, self.CURRENCY)
+        issuerdb.load_money(self.CARD_ID, amount, self.CURRENCY)
+
+    def test_authorisation_and_presentment(self):
+        self._add_funds(100)
+
+        self.assertEqual(request(self.AUTHORISATION_URL, self.AUTHORISATION),
+                         (201, b''))
+
+        # Replays are answered from the responses cache
+        with patch('cards.issuer.async_service.make_authorisation') as mock:
+            self.assertEqual(
+                request(self.AUTHORISATION_URL, self.AUTHORISATION)[0], 201)
+        self.assertFalse(mock.called)
+
+        data = dict(self.AUTHORISATION, billing_amount=1)
+        self.assertEqual(request(self.AUTHORISATION_URL, data)[0], 409)
+
+        self.assertEqual(request(self.PRESENTMENT_URL, self.PRESENTMENT)[0],
+                         200)
+
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        IDEMPOTENCY_CACHE={'MAX_SIZE': 10, 'TTL': 60, 'BACKEND': 'default'})
+    def test_authorisation_replay_shared_backend(self):
+        """The shared backend is called on the pool, not on the event
+        loop thread."""
+        caches['default'].clear()
+        self._add_funds(100)
+        threads = []
+
+        def recorded(method):
+            def call(cache, *args, **kwargs):
+                threads.append(threading.current_thread())
+                return method(cache, *args, **kwargs)
+            return call
+
+        with patch.object(LocMemCache, 'get', recorded(LocMemCache.get)), \
+                patch.object(LocMemCache, 'set', recorded(LocMemCache.set)):
+            with patch.dict(idempotency.CACHES, clear=True):
+                self.assertEqual(
+                    request(self.AUTHORISATION_URL, self.AUTHORISATION)[0],
+                    201)
+
+            with patch.dict(idempotency.CACHES, clear=True), \
+                    patch('cards.issuer.async_service.make_authorisation') \
+                    as mock:
+                self.assertEqual(
+                    request(self.AUTHORISATION_URL, self.AUTHORISATION)[0],
+                    201)
+
+        self.assertFalse(mock.called)
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_authorisation_403(self):
+        self._add_funds(10)
+
+        self.assertEqual(
+            request(self.AUTHORISATION_URL, self.AUTHORISATION)[0], 403)
+
+    def test_authorisation_velocity_403(self):
+        """The async webhooks apply the velocity limits of the service."""
+        self._add_funds(500)
+        velocity = VelocityLimits([compile_rule({'name': 'hourly',
+                                                 'window': 3600,
+                                                 'max_count': 1})])
+
+        with patch.object(issuer.service, '_velocity', velocity):
+            self.assertEqual(
+                request(self.AUTHORISATION_URL, self.AUTHORISATION)[0], 201)
+
+            data = dict(self.AUTHORISATION, transaction_id='IDKFA777')
+            self.assertEqual(request(self.AUTHORISATION_URL, data)[0], 403)
+
+    def test_not_found(self):
+        self.assertEqual(
+            request(self.AUTHORISATION_URL, self.AUTHORISATION)[0], 404)
+        self.assertEqual(
+            request(self.PRESENTMENT_URL, self.PRESENTMENT)[0], 404)
+        self.assertEqual(request('/api/unknown/', {})[0], 404)
+
+    def test_bad_requests(self):
+        status, body = request(self.AUTHORISATION_URL,
+                               dict(self.AUTHORISATION, billing_amount=0))
+        self.assertEqual(status, 400)
+        self.assertIn('billing_amount', json.loads(body.decode('utf-8')))
+
+        for currency in (['BRL'], {'BRL': 1}):
+            for field in ('billing_currency', 'transaction_currency'):
+                status, body = request(self.AUTHORISATION_URL,
+                                       dict(self.AUTHORISATION,
+                                            **{field: currency}))
+                self.assertEqual(status, 400)
+                self.assertIn(field, json.loads(body.decode('utf-8')))
+
+        self.assertEqual(request(self.PRESENTMENT_URL, b'{')[0], 400)
+        self.assertEqual(request(self.PRESENTMENT_URL, method='GET')[0], 405)
+
+    def test_request_too_large(self):
+        """The body is limited as the WSGI requests are."""
+        size = len(json.dumps(self.AUTHORISATION))
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=size):
+            self.assertEqual(
+                request(self.AUTHORISATION_URL, self.AUTHORISATION)[0], 404)
+
+            data = dict(self.AUTHORISATION, merchant_name='Game Stores')
+            status, body = request(self.AUTHORISATION_URL, data)
+            self.assertEqual(status, 413)
+            self.assertIn(b'too large', body)
+
+    def test_form_encoded(self):
+        self.assertEqual(
+            request(self.PRESENTMENT_URL,
+                    b'transaction_id=IDDQD666&settlement_amount=95&'
+                    b'settlement_currency=BRL',
+                    content_type=b'application/x-www-form-urlencoded')[0],
+            404)
+
+    def test_form_blank(self):
+        status, body = request(
+            self.PRESENTMENT_URL,
+            b'transaction_id=&settlement_amount=95&settlement_currency=BRL',
+            content_type=b'application/x-www-form-urlencoded')
+        self.assertEqual(status, 400)
+        self.assertEqual(json.loads(body.decode('utf-8')),
+                         {'transaction_id': ['This field may not be blank.']})
+
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        IDEMPOTENCY_CACHE={'MAX_SIZE': 10, 'TTL': 60, 'BACKEND': 'default'})
+    def test_form_replay_other_handler(self):
+        """A form retry answered by the WSGI view is a replay for the ASGI
+        handler."""
+        caches['default'].clear()
+        self._add_funds(100)
+        body = urlencode(self.AUTHORISATION)
+        content_type = 'application/x-www-form-urlencoded'
+
+        with patch.dict(idempotency.CACHES, clear=True):
+            wsgi_request = RequestFactory().post(
+                self.AUTHORISATION_URL, body, content_type=content_type)
+            self.assertEqual(
+                AuthorisationView.as_view()(wsgi_request).status_code, 201)
+
+        with patch.dict(idempotency.CACHES, clear=True), \
+                patch('cards.issuer.async_service.make_authorisation') as mock:
+            self.assertEqual(
+                request(self.AUTHORISATION_URL, body.encode('utf-8'),
+                        content_type=content_type.encode('latin-1'))[0],
+                201)
+        self.assertFalse(mock.called)
@@ -0,0 +1,146 @@
+import json
+from unittest.mock import patch
+
+from django.test import RequestFactory, TestCase
+
+from cards import issuer
+from cards.api import fast, idempotency
+from cards.api.serializers import AuthorisationSerializer
+from cards.api.views import AuthorisationView
+from cards.issuer import CardsIssuerDatabase
+
+
+class ValidatorTests(TestCase):
+    PAYLOAD = {
+        'card_id': 'CARD123',
+        'transaction_id': 'IDDQD666',
+        'merchant_name': 'Game Store',
+        'merchant_country': 'BR',
+        'merchant_mcc': 1234,
+        'billing_amount': '100.50',
+        'billing_currency': 'BRL',
+        'transaction_amount': 100,
+        'transaction_currency': 'BRL',
+    }
+
+    INVALID = [
+        {'card_id': ''},
+        {'merchant_mcc': 'x'},
+        {'merchant_mcc': '1234.5'},
+        {'merchant_mcc': True},
+        {'merchant_mcc': 'x' * 1001},
+        {'billing_amount': '0.5'},
+        {'billing_amount': '1.005'},
+        {'billing_amount': '1000000000'},
+        {'billing_amount': 'NaN'},
+        {'billing_currency': 'XXX'},
+        {'billing_currency': ['BRL']},
+        {'transaction_currency': {'BRL': 1}},
+    ]
+
+    def test_same_values(self):
+        serializer = AuthorisationSerializer(data=self.PAYLOAD)
+        serializer.is_valid()
+
+        self.assertEqual(fast.validate_authorisation(self.PAYLOAD),
+                         (dict(serializer.validated_data), {}))
+
+    def test_same_errors(self):
+        """Invalid fields for the serializer are invalid for the validator,
+        with the same message."""
+        for invalid in self.INVALID:
+            data = dict(self.PAYLOAD, **invalid)
+            serializer = AuthorisationSerializer(data=data)
+            serializer.is_valid()
+
+            values, errors = fast.validate_authorisation(data)
+
+            self.assertEqual(errors, serializer.errors, invalid)
+
+    def test_required(self):
+        values, errors = fast.validate_authorisation({})
+
+        self.assertEqual(set(errors), set(self.PAYLOAD))
+
+
+class AuthorisationTests(TestCase):
+    CARD_ID = 'CARD123'
+    CURRENCY = 'BRL'
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        idempotency.clear()
+        issuer.database.invalidate()
+
+    def _post(self, data, view=fast.authorisation):
+        payload = dict(ValidatorTests.PAYLOAD, **data)
+        request = self.factory.post('/api/fast/authorisation/', payload,
+                                    content_type='application/json')
+        return view(request)
+
+    def test_201(self):
+        issuerdb = CardsIssuerDatabase()
+        issuerdb.create_account(self.CARD_ID, self.CURRENCY)
+        issuerdb.load_money(self.CARD_ID, 200, self.CURRENCY)
+
+        self.assertEqual(self._post({}).status_code, 201)
+
+        # Replays are answered from the responses cache
+        with patch('cards.issuer.service.make_authorisation') as service:
+            self.assertEqual(self._post({}).status_code, 201)
+        self.assertFalse(service.called)
+
+        # Different payload for the same transaction id
+        self.assertEqual(self._post({'billing_amount': 1}).status_code, 409)
+
+    def test_403(self):
+        with patch('cards.issuer.service.make_authorisation',
+                   return_value=False):
+            self.assertEqual(self._post({}).status_code, 403)
+
+    def test_404(self):
+        self.assertEqual(self._post({}).status_code, 404)
+
+    def test_400(self):
+        response = self._post({'billing_currency': 'XXX'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'billing_currency', response.content)
+
+        request = self.factory.post('/api/fast/authorisation/', '[1',
+                                    content_type='application/json')
+        self.assertEqual(fast.authorisation(request).status_code, 400)
+
+    def test_same_responses(self):
+        """The fast path answers as the DRF view."""
+        cases = [({}, True),
+                 ({}, False),
+                 ({'billing_currency': 'XXX'}, True),
+                 ({'billing_currency': ['BRL'],
+                   'transaction_currency': {'BRL': 1}}, True),
+                 ({'billing_currency': {'BRL': 1},
+                   'transaction_currency': ['BRL']}, True),
+                 ({'merchant_mcc': 'x', 'card_id': ''}, True),
+                 ({'merchant_mcc': '1234.0'}, True),
+                 ({'merchant_mcc': '1234.00 '}, True),
+                 ({'merchant_mcc': '1_234'}, True),
+                 ({'merchant_mcc': '1234.5'}, True),
+                 ({'merchant_mcc': True}, True),
+                 ({'merchant_mcc': 1234.0}, True)]
+        for data, approved in cases:
+            responses = []
+            for view in (AuthorisationView.as_view(), fast.authorisation):
+                idempotency.clear()
+                with patch('cards.issuer.service.make_authorisation',
+                           return_value=approved):
+                    response = self._post(data, view)
+                if hasattr(response, 'render'):
+                    response.render()
+                responses.append((response.status_code,
+                                  json.loads(response.content or 'null')))
+
+            self.assertEqual(responses[0], responses[1], data)
+
+    def test_405(self):
+        request = self.factory.get('/api/fast/authorisation/')
+        self.assertEqual(fast.authorisation(request).status_code, 405)
@@ -1,16 +1,23 @@
-from django.urls import reverse_lazy
+from unittest.mock import patch
+
+from django.test import override_settings
+from django.urls import reverse, reverse_lazy
 
 from rest_framework import status
 from rest_framework.test import APITestCase, APIRequestFactory
 
-from cards.accounting.models import Account, Batch
-from cards.api.views import AuthorisationView, PresentmentView
+from cards.accounting.models import Account
+from cards import balances, issuer
+from cards.api import idempotency
+from cards.api.views import (AuthorisationView, PresentmentView,
+                             PresentmentsView, IdempotencyStatsView, )
 from cards.issuer import CardsIssuerDatabase
 
 
 class BaseViewTests(APITestCase):
     AUTHORISATION_URL = reverse_lazy('authorisation')
     PRESENTMENT_URL = reverse_lazy('presentment')
+    PRESENTMENTS_URL = reverse_lazy('presentments')
 
     CARD_ID = 'CARD123'
     CURRENCY = 'BRL'
@@ -44,16 +51,18 @@ class BaseViewTests(APITestCase):
                                currency=self.BILLING_CURRENCY)
 
     def _add_funds(self, amount=BILLING_AMOUNT):
-        acc, nil = Account.objects.get_or_create(
-            card_id=self.CARD_ID,
-            currency=self.BILLING_CURRENCY)
+        Account.objects.get_or_create(card_id=self.CARD_ID,
+                                      currency=self.BILLING_CURRENCY)
 
-        # Here we are loading funds into account in the wrong way.
-        acc.journals.create(amount=amount, batch=Batch.objects.create())
+        CardsIssuerDatabase().load_money(self.CARD_ID,
+                                         amount,
+                                         self.BILLING_CURRENCY)
 
     def setUp(self):
         self.factory = APIRequestFactory()
         self.view = self.view_class.as_view()
+        idempotency.clear()
+        issuer.database.invalidate()
 
 
 class AuthorisationTests(BaseViewTests):
@@ -84,6 +93,94 @@ class AuthorisationTests(BaseViewTests):
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_authorization_201_replay(self):
+        """Scheme retries get the original outcome."""
+        self._create_account()
+        self._add_funds()
+
+        for i in range(2):
+            request = self.factory.post(self.AUTHORISATION_URL,
+                                        self.POST_DATA)
+            response = self.view(request)
+
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_authorization_409_duplicate(self):
+        self._create_account()
+        self._add_funds(self.BILLING_AMOUNT * 2)
+
+        request = self.factory.post(self.AUTHORISATION_URL, self.POST_DATA)
+        self.view(request)
+
+        data = dict(self.POST_DATA, billing_amount=1)
+        request = self.factory.post(self.AUTHORISATION_URL, data)
+        response = self.view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_authorization_replay_cached(self):
+        """Scheme retries are answered from the responses cache, the service
+        isn't called."""
+        self._create_account()
+        self._add_funds()
+
+        request = self.factory.post(self.AUTHORISATION_URL, self.POST_DATA,
+                                    format='json')
+        self.view(request)
+
+        with patch('cards.issuer.service.make_authorisation') as service:
+            request = self.factory.post(self.AUTHORISATION_URL,
+                                        self.POST_DATA,
+                                        format='json')
+            response = self.view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(service.called)
+        self.assertEqual(idempotency.get_cache('authorisation').stats(),
+                         {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_authorization_declined_not_cached(self):
+        """Only final outcomes are cached, a declined authorisation is
+        evaluated again once funds are loaded."""
+        self._create_account()
+
+        with patch('cards.issuer.service.make_authorisation',
+                   return_value=False):
+            request = self.factory.post(self.AUTHORISATION_URL,
+                                        self.POST_DATA)
+            self.assertEqual(self.view(request).status_code,
+                             status.HTTP_403_FORBIDDEN)
+
+        self._add_funds()
+
+        request = self.factory.post(self.AUTHORISATION_URL, self.POST_DATA)
+        self.assertEqual(self.view(request).status_code,
+                         status.HTTP_201_CREATED)
+
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        IDEMPOTENCY_CACHE={'MAX_SIZE': 10, 'TTL': 60, 'BACKEND': 'default'})
+    def test_authorization_replay_shared_backend(self):
+        """Responses cached by another process are found on the shared
+        backend."""
+        self._create_account()
+        self._add_funds()
+
+        with patch.dict(idempotency.CACHES, clear=True):
+            request = self.factory.post(self.AUTHORISATION_URL,
+                                        self.POST_DATA)
+            self.view(request)
+
+        with patch.dict(idempotency.CACHES, clear=True), \
+                patch('cards.issuer.service.make_authorisation') as service:
+            request = self.factory.post(self.AUTHORISATION_URL,
+                                        self.POST_DATA)
+            response = self.view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(service.called)
+
     def test_authorization_403_no_funds(self):
 
         self._create_account()
@@ -144,3 +241,137 @@ class PresentmentTests(BaseViewTests):
         response = self.view(request)
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class PresentmentsTests(BaseViewTests):
+    view_class = PresentmentsView
+
+    POST_DATA = PresentmentTests.POST_DATA
+
+    _make_authorisation = PresentmentTests._make_authorisation
+
+    def test_presentments_400_invalid_params(self):
+        request = self.factory.post(self.PRESENTMENTS_URL,
+                                    [{'invalid-fields': 'invalid-values'}],
+                                    format='json')
+        response = self.view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_presentments_200_per_item_status(self):
+        self._add_funds()
+        self._make_authorisation()
+
+        missing = dict(self.POST_DATA, transaction_id='MISSING')
+
+        request = self.factory.post(self.PRESENTMENTS_URL,
+                                    [self.POST_DATA, missing],
+                                    format='json')
+        response = self.view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [
+            {'transaction_id': self.TRANSACTION_ID,
+             'status': status.HTTP_200_OK},
+            {'transaction_id': 'MISSING',
+             'status': status.HTTP_404_NOT_FOUND},
+        ])
+
+
+class IdempotencyStatsTests(BaseViewTests):
+    view_class = IdempotencyStatsView
+
+    def test_stats(self):
+        idempotency.get_cache('presentment').get('tr-1', 'digest')
+
+        response = self.view(self.factory.get('/idempotency/'))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['presentment'],
+                         {'hits': 0, 'misses': 1, 'size': 0})
+
+
+@patch('cards.issuer.transaction.on_commit', lambda fn, using=None: fn())
+class StatementTests(APITestCase):
+
+    def setUp(self):
+        self.addCleanup(CardsIssuerDatabase.invalidate_system_accounts)
+        issuerdb = CardsIssuerDatabase()
+        issuerdb.create_account('CARD123', 'BRL')
+        for i in range(3):
+            issuerdb.load_money('CARD123', 100, 'BRL')
+        for transaction_id, amount in (('T1', 10), ('T2', 20)):
+            issuerdb.make_authorisation('CARD123', transaction_id,
+                                        'Game Store', 'BR', 1234,
+                                        amount, 'BRL', amount, 'BRL')
+        issuerdb.set_presentment('T1', 9, 'BRL')
+        self.url = reverse('statement', args=['CARD123', 'BRL'])
+
+    def _entries(self, response):
+        return [(i['type'], i['amount']) for i in response.data['results']]
+
+    def test_statement(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['balance'],
+                          response.data['held_amount']), (270, 20))
+        self.assertEqual(self._entries(response), [('journal', -10),
+                                                   ('authorisation', -20),
+                                                   ('journal', 100),
+                                                   ('journal', 100),
+                                                   ('journal', 100)])
+        self.assertIsNone(response.data['next'])
+
+    def test_pages(self):
+        """Every entry is listed once, in the single page order."""
+        entries = []
+        url = self.url + '?limit=2'
+        while url:
+            with self.assertNumQueries(3):
+                response = self.client.get(url)
+            self.assertLessEqual(len(response.data['results']), 2)
+            entries.extend(self._entries(response))
+            url = response.data['next']
+
+        self.assertEqual(entries,
+                         self._entries(self.client.get(self.url)))
+
+    def test_account_not_found(self):
+        response = self.client.get(reverse('statement',
+                                           args=['CARD123', 'USD']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_params(self):
+        for query in ('cursor=invalid', 'limit=0', 'limit=a'):
+            response = self.client.get('{}?{}'.format(self.url, query))
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+
+
+class BalanceTests(APITestCase):
+    URL = reverse_lazy('balance')
+
+    def setUp(self):
+        balances.clear()
+        Account.objects.create(card_id='CARD123', currency='BRL',
+                               balance=10)
+
+    def test_balance(self):
+        response = self.client.get(self.URL, {'card_id': 'CARD123',
+                                              'currency': 'BRL'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'card_id': 'CARD123',
+                                         'currency': 'BRL',
+                                         'balance': 10})
+
+    def test_account_not_found(self):
+        response = self.client.get(self.URL, {'card_id': 'CARD123',
+                                              'currency': 'USD'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_params(self):
+        for params in ({}, {'card_id': 'CARD123', 'currency': 'XXX'}):
+            response = self.client.get(self.URL, params)
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
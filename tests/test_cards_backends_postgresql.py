@@ -0,0 +1,99 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from django.db import OperationalError
+from psycopg2 import OperationalError as PsycopgOperationalError
+from psycopg2.pool import PoolError
+
+from cards.backends.postgresql.base import DatabaseWrapper
+
+
+class DatabaseWrapperTests(TestCase):
+    SETTINGS = {
+        'ENGINE': 'cards.backends.postgresql',
+        'NAME': 'cards',
+        'USER': 'cards',
+        'PASSWORD': '',
+        'HOST': 'localhost',
+        'PORT': '5432',
+        'CONN_MAX_AGE': 600,
+        'AUTOCOMMIT': True,
+        'ATOMIC_REQUESTS': False,
+        'TIME_ZONE': None,
+        'OPTIONS': {
+            'POOL_MIN_SIZE': 1,
+            'POOL_MAX_SIZE': 5,
+            'HEALTH_CHECKS': True,
+        },
+    }
+
+    def setUp(self):
+        self.wrapper = DatabaseWrapper(dict(self.SETTINGS), 'pooled')
+
+    def test_connection_params(self):
+        """The pool options aren't given to psycopg2. """
+        params = self.wrapper.get_connection_params()
+
+        self.assertEqual(params['database'], 'cards')
+        self.assertNotIn('POOL_MAX_SIZE', params)
+        self.assertNotIn('HEALTH_CHECKS', params)
+
+    @patch('cards.backends.postgresql.base.pool.ThreadedConnectionPool')
+    def test_pooled_connection(self, pool_mock):
+        connection = MagicMock(closed=0)
+        pool_mock.return_value.getconn.return_value = connection
+        pools = patch.dict('cards.backends.postgresql.base.POOLS')
+        pools.start()
+        self.addCleanup(pools.stop)
+
+        self.assertIs(self.wrapper.get_new_connection({'database': 'cards'}),
+                      connection)
+        pool_mock.assert_called_with(1, 5, database='cards')
+
+        self.wrapper.connection = connection
+        self.wrapper._close()
+
+        pool_mock.return_value.putconn.assert_called_with(connection,
+                                                          close=False)
+        connection.close.assert_not_called()
+
+    @patch('cards.backends.postgresql.base.pool.ThreadedConnectionPool')
+    def test_pooled_health_check(self, pool_mock):
+        """A broken connection taken from the pool is replaced. """
+        broken = MagicMock(closed=0)
+        broken.cursor.return_value.__enter__.return_value.execute \
+            .side_effect = PsycopgOperationalError('server closed')
+        connection = MagicMock(closed=0)
+        pool_mock.return_value.getconn.side_effect = [broken, connection]
+        pools = patch.dict('cards.backends.postgresql.base.POOLS')
+        pools.start()
+        self.addCleanup(pools.stop)
+
+        self.assertIs(self.wrapper.get_new_connection({'database': 'cards'}),
+                      connection)
+        pool_mock.return_value.putconn.assert_called_with(broken, close=True)
+
+    @patch('cards.backends.postgresql.base.pool.ThreadedConnectionPool')
+    def test_pool_exhausted(self, pool_mock):
+        """The pool errors are Django database errors."""
+        pool_mock.return_value.getconn.side_effect = PoolError(
+            'connection pool exhausted')
+        pools = patch.dict('cards.backends.postgresql.base.POOLS')
+        pools.start()
+        self.addCleanup(pools.stop)
+
+        with self.assertRaisesRegex(OperationalError, 'pooled pool'):
+            self.wrapper.get_new_connection({'database': 'cards'})
+
+    def test_health_check(self):
+        """Broken connections are replaced once per request. """
+        self.wrapper.connection = MagicMock()
+        self.wrapper.is_usable = MagicMock(return_value=False)
+        self.wrapper.close = MagicMock()
+
+        with patch('django.db.backends.base.base.BaseDatabaseWrapper'
+                   '.ensure_connection'):
+            self.wrapper.ensure_connection()
+            self.wrapper.ensure_connection()
+
+        self.wrapper.close.assert_called_once_with()
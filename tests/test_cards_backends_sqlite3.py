@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from cards.backends.sqlite3.base import DatabaseWrapper
+
+
+class DatabaseWrapperTests(TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+
+        self.wrapper = DatabaseWrapper({
+            'ENGINE': 'cards.backends.sqlite3',
+            'NAME': os.path.join(tmpdir, 'db.sqlite3'),
+            'CONN_MAX_AGE': 0,
+            'AUTOCOMMIT': True,
+            'ATOMIC_REQUESTS': False,
+            'TIME_ZONE': None,
+            'OPTIONS': {
+                'timeout': 2,
+                'IMMEDIATE_TRANSACTIONS': True,
+                'PRAGMAS': (('journal_mode', 'WAL'),
+                            ('synchronous', 'NORMAL')),
+            },
+        }, 'tuned')
+
+    def _pragma(self, connection, name):
+        return connection.execute('PRAGMA {}'.format(name)).fetchone()[0]
+
+    def test_connection_params(self):
+        params = self.wrapper.get_connection_params()
+
+        self.assertEqual(params['timeout'], 2)
+        self.assertNotIn('PRAGMAS', params)
+        self.assertNotIn('IMMEDIATE_TRANSACTIONS', params)
+
+    def test_pragmas(self):
+        connection = self.wrapper.get_new_connection(
+            self.wrapper.get_connection_params())
+        self.addCleanup(connection.close)
+
+        self.assertEqual(self._pragma(connection, 'journal_mode'), 'wal')
+        # NORMAL
+        self.assertEqual(self._pragma(connection, 'synchronous'), 1)
+        self.assertEqual(self._pragma(connection, 'busy_timeout'), 2000)
+
+    def test_immediate_transactions(self):
+        self.wrapper.cursor = MagicMock()
+
+        self.wrapper._start_transaction_under_autocommit()
+
+        self.wrapper.cursor().execute.assert_called_with('BEGIN IMMEDIATE')
@@ -0,0 +1,88 @@
+from unittest.mock import patch
+import time
+
+from django.test import TestCase
+
+from cards import balances
+from cards.accounting.models import Account
+from cards.issuer import CardsIssuerDatabase, CardsReadDatabase
+
+
+def on_commit(fn, using=None):
+    """Runs transaction.on_commit callbacks right away, test cases never
+    commit."""
+    fn()
+
+
+class BalancesCacheTests(TestCase):
+
+    def setUp(self):
+        balances.clear()
+
+    def test_cache_balance(self):
+        self.assertIsNone(balances.get_cached('CARD123', 'BRL'))
+
+        balances.cache_balance('CARD123', 'BRL', ('default', 1), 10,
+                               time.monotonic())
+        self.assertEqual(balances.get_cached('CARD123', 'BRL'), 10)
+
+        balances.invalidate([1], 'default')
+        self.assertIsNone(balances.get_cached('CARD123', 'BRL'))
+
+    def test_read_before_invalidation_not_cached(self):
+        read_at = time.monotonic()
+        balances.invalidate([1], 'default')
+
+        balances.cache_balance('CARD123', 'BRL', ('default', 1), 10, read_at)
+        self.assertIsNone(balances.get_cached('CARD123', 'BRL'))
+
+    def test_invalidated_on_commit(self):
+        balances.cache_balance('CARD123', 'BRL', ('default', 1), 10,
+                               time.monotonic())
+
+        balances.invalidate_on_commit([1], 'default')
+        self.assertEqual(balances.get_cached('CARD123', 'BRL'), 10)
+
+        with patch('cards.balances.transaction.on_commit', on_commit):
+            balances.invalidate_on_commit([1], 'default')
+        self.assertIsNone(balances.get_cached('CARD123', 'BRL'))
+
+
+@patch('cards.issuer.transaction.on_commit', on_commit)
+class BalanceInvalidationTests(TestCase):
+    """The writes of the issuer database invalidate the cached balances."""
+
+    def setUp(self):
+        balances.clear()
+        self.addCleanup(CardsIssuerDatabase.invalidate_system_accounts)
+        self.issuerdb = CardsIssuerDatabase()
+        self.readdb = CardsReadDatabase()
+        Account.objects.create(card_id='CARD123', currency='BRL')
+
+    def _balance(self, queries):
+        with self.assertNumQueries(queries):
+            return self.readdb.get_balance('CARD123', 'BRL')
+
+    def test_cached(self):
+        self.assertEqual(self._balance(1), 0)
+        self.assertEqual(self._balance(0), 0)
+
+    def test_load_money(self):
+        self._balance(1)
+        self.issuerdb.load_money('CARD123', 100, 'BRL')
+        self.assertEqual(self._balance(1), 100)
+
+    def test_make_authorisation(self):
+        self.issuerdb.load_money('CARD123', 100, 'BRL')
+        self._balance(1)
+        self.issuerdb.make_authorisation('CARD123', 'T1', 'Game Store',
+                                         'BR', 1234, 10, 'BRL', 10, 'BRL')
+        self.assertEqual(self._balance(1), 90)
+
+    def test_set_presentment(self):
+        self.issuerdb.load_money('CARD123', 100, 'BRL')
+        self.issuerdb.make_authorisation('CARD123', 'T1', 'Game Store',
+                                         'BR', 1234, 10, 'BRL', 10, 'BRL')
+        self._balance(1)
+        self.issuerdb.set_presentment('T1', 9, 'BRL')
+        self.assertEqual(self._balance(1), 90)
@@ -0,0 +1,43 @@
+from unittest import TestCase
+
+from cards.cache import LRUCache
+
+
+class LRUCacheTests(TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = LRUCache(2, ttl=10, clock=lambda: self.now)
+
+    def test_expired(self):
+        self.cache.set('a', 1)
+
+        self.now = 9
+        self.assertEqual(self.cache.get('a'), 1)
+
+        self.now = 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_least_recently_used_evicted(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('c'), 3)
+
+    def test_disabled(self):
+        cache = LRUCache(0, ttl=10)
+        cache.set('a', 1)
+
+        self.assertIsNone(cache.get('a'))
+
+    def test_clear(self):
+        self.cache.set('a', 1)
+        self.cache.get('a')
+        self.cache.clear()
+
+        self.assertEqual(self.cache.stats(),
+                         {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 2})
@@ -1,8 +1,23 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest.mock import patch
+import os
+import tempfile
+import time
 
-from cards.accounting.models import Account, Transaction
-from cards.issuer import CardsIssuerDatabase, account_not_found
-from issuer.db import InsufficientFunds, AccountNotFound, AuthorisationNotFound
+from django.db import connection, OperationalError
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from cards.accounting.models import Account, Transaction, Batch
+from cards.issuer import (CardsIssuerDatabase, CardsReadDatabase,
+                          account_not_found, retry_on_conflict, )
+from cards.ledger import LedgerWriter
+from cards.memory import MemoryIssuerDatabase, AccountRecord
+from issuer.db import (InsufficientFunds, AccountNotFound,
+                       AuthorisationNotFound, DuplicateTransaction, )
+from issuer.fx import RateTable
+from issuer.service import IssuerService
 
 
 class DecoratorTests(TestCase):
@@ -16,7 +31,179 @@ class DecoratorTests(TestCase):
             self._raise_exception()
 
 
-class CardsIssuerDatabaseTests(TestCase):
+class RetryOnConflictTests(TestCase):
+
+    def test_not_retried_inside_transaction(self):
+        calls = []
+
+        @retry_on_conflict
+        def locked():
+            calls.append(1)
+            raise OperationalError('database is locked')
+
+        with self.assertRaises(OperationalError):
+            locked()
+
+        self.assertEqual(len(calls), 1)
+
+    @patch('cards.issuer.connection')
+    def test_retried(self, connection_mock):
+        connection_mock.in_atomic_block = False
+        errors = [OperationalError('database is locked'),
+                  OperationalError('could not serialize access')]
+
+        @retry_on_conflict
+        def conflict():
+            if errors:
+                raise errors.pop()
+            return True
+
+        self.assertTrue(conflict())
+
+    @patch('cards.issuer.connection')
+    def test_not_conflict_not_retried(self, connection_mock):
+        connection_mock.in_atomic_block = False
+
+        @retry_on_conflict
+        def broken():
+            raise OperationalError('no such table')
+
+        with self.assertRaises(OperationalError):
+            broken()
+
+
+def on_commit(fn, using=None):
+    """Runs transaction.on_commit callbacks right away, test cases never
+    commit."""
+    fn()
+
+
+class SystemAccountsCacheTests(TestCase):
+    CURRENCIES = ['BRL', 'USD']
+
+    def setUp(self):
+        self.issuerdb = CardsIssuerDatabase()
+
+    def tearDown(self):
+        CardsIssuerDatabase.invalidate_system_accounts()
+
+    def test_not_cached_before_commit(self):
+        self.issuerdb._get_scheme_account('BRL')
+
+        with self.assertNumQueries(1):
+            self.issuerdb._get_scheme_account('BRL')
+
+    @patch('cards.issuer.transaction.on_commit', on_commit)
+    def test_cached_after_commit(self):
+        acc = self.issuerdb._get_scheme_account('BRL')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.issuerdb._get_scheme_account('BRL'), acc)
+
+        CardsIssuerDatabase.invalidate_system_accounts()
+
+        with self.assertNumQueries(1):
+            self.issuerdb._get_scheme_account('BRL')
+
+    @patch('cards.issuer.transaction.on_commit', on_commit)
+    def test_warm_system_accounts(self):
+        issuer_acc = Account.objects.create(
+            card_id=CardsIssuerDatabase.ISSUER_CARD_ID,
+            currency='BRL')
+
+        self.issuerdb.warm_system_accounts(self.CURRENCIES)
+
+        # Only the missing accounts are created
+        self.assertEqual(Account.objects.count(), 4)
+
+        with self.assertNumQueries(0):
+            for currency in self.CURRENCIES:
+                self.issuerdb._get_issuer_account(currency)
+                self.issuerdb._get_scheme_account(currency)
+
+            self.assertEqual(self.issuerdb._get_issuer_account('BRL'),
+                             issuer_acc)
+
+    def test_warm_on_first_lookup(self):
+        issuerdb = CardsIssuerDatabase(self.CURRENCIES)
+
+        acc = issuerdb._get_scheme_account('USD')
+
+        self.assertEqual((acc.card_id, acc.currency),
+                         (CardsIssuerDatabase.SCHEME_CARD_ID, 'USD'))
+        self.assertEqual(Account.objects.count(), 4)
+
+
+class SystemAccountsBucketsTests(TestCase):
+    CURRENCY = 'BRL'
+
+    def setUp(self):
+        self.addCleanup(CardsIssuerDatabase.invalidate_system_accounts)
+        self.issuerdb = CardsIssuerDatabase(system_buckets=4)
+        self.accounts = [Account.objects.create(card_id='CARD{}'.format(i),
+                                                currency=self.CURRENCY)
+                         for i in range(8)]
+
+    def _issuer_balances(self):
+        return dict(Account.objects
+                    .filter(card_id__startswith='__ISSUER')
+                    .values_list('card_id', 'balance'))
+
+    def test_load_money(self):
+        for acc in self.accounts:
+            self.issuerdb.load_money(acc.card_id, 10, self.CURRENCY)
+
+        # Every bucket is debited by its Accounts loads
+        self.assertEqual(self._issuer_balances(), {
+            '__ISSUER_CARD_ID__': -20,
+            '__ISSUER_CARD_ID__:1': -20,
+            '__ISSUER_CARD_ID__:2': -20,
+            '__ISSUER_CARD_ID__:3': -20,
+        })
+        self.assertEqual(
+            self.issuerdb._get_balance(CardsIssuerDatabase.ISSUER_CARD_ID,
+                                       self.CURRENCY),
+            -80)
+
+    def test_load_money_bulk(self):
+        self.issuerdb.load_money_bulk([(acc.card_id, 10, self.CURRENCY)
+                                       for acc in self.accounts])
+
+        self.assertEqual(set(self._issuer_balances().values()), {-20})
+
+    def test_set_presentments(self):
+        self.issuerdb.load_money_bulk([(acc.card_id, 10, self.CURRENCY)
+                                       for acc in self.accounts])
+        for i, acc in enumerate(self.accounts):
+            self.issuerdb.make_authorisation(acc.card_id, 'T{}'.format(i),
+                                             'Game Store', 'BR', 1234,
+                                             10, self.CURRENCY,
+                                             10, self.CURRENCY)
+
+        self.issuerdb.set_presentment('T0', 9, self.CURRENCY)
+        self.issuerdb.set_presentments([('T{}'.format(i), 9, self.CURRENCY)
+                                        for i in range(1, 8)])
+
+        balances = self.issuerdb.get_system_balances()
+        self.assertEqual(
+            balances[(CardsIssuerDatabase.SCHEME_CARD_ID, self.CURRENCY)],
+            (72, 0))
+        self.assertEqual(
+            balances[(CardsIssuerDatabase.ISSUER_CARD_ID, self.CURRENCY)],
+            (-72, 0))
+        self.assertEqual(Account.objects
+                         .filter(card_id__startswith='__SCHEME')
+                         .count(), 4)
+        self.assertFalse(Account.objects.unreconciled().exists())
+
+
+class IssuerDatabaseTests:
+    """Tests shared by the issuer database engines."""
+    database_class = CardsIssuerDatabase
+
+    # Queries of an open authorisation replay
+    REPLAY_QUERIES = 1
+
     CARD_ID = 'CARD123'
     CURRENCY = 'BRL'
 
@@ -41,7 +228,7 @@ class CardsIssuerDatabaseTests(TestCase):
         self.acc = Account.objects.create(card_id=self.CARD_ID,
                                           currency=self.CURRENCY)
 
-        self.issuerdb = CardsIssuerDatabase()
+        self.issuerdb = self.database_class()
 
     def test_set_presentment_authorisation_not_found(self):
         """ Tests AuthorisationNotFound raising. """
@@ -87,8 +274,12 @@ class CardsIssuerDatabaseTests(TestCase):
         # Check accounts balances
         accounts = Account.objects.balance()
 
+        # The maintained balances should match the ledger
+        self.assertFalse(Account.objects.unreconciled().exists())
+
         # The cardholder account should be empty
         self.assertEqual(accounts.get(pk=self.acc.id).balance, 0)
+        self.assertEqual(accounts.get(pk=self.acc.id).held_amount, 0)
 
         # The scheme account should have the settlement amount
         self.assertEqual(accounts.get(pk=self
@@ -109,6 +300,63 @@ class CardsIssuerDatabaseTests(TestCase):
                          .balance + self.BILLING_AMOUNT,
                          self.PROFITS)
 
+    def test_set_presentments(self):
+        """A clearing run sets the found authorisations to presentment in a
+        single batch and skips the missing ones."""
+        self.issuerdb.load_money(self.CARD_ID, 300, self.BILLING_CURRENCY)
+
+        for transaction_id in ('TR1', 'TR2'):
+            self.issuerdb.make_authorisation(
+                self.CARD_ID,
+                transaction_id,
+                self.MERCHANT_NAME,
+                self.MERCHANT_COUNTRY,
+                self.MERCHANT_MCC,
+                self.BILLING_AMOUNT,
+                self.BILLING_CURRENCY,
+                self.TRANSACTION_AMOUNT,
+                self.TRANSACTION_CURRENCY)
+
+        results = self.issuerdb.set_presentments([
+            ('TR1', self.SETTLEMENT_AMOUNT, self.SETTLEMENT_CURRENCY),
+            ('MISSING', self.SETTLEMENT_AMOUNT, self.SETTLEMENT_CURRENCY),
+            ('TR2', 90, self.SETTLEMENT_CURRENCY),
+            ('TR1', self.SETTLEMENT_AMOUNT, self.SETTLEMENT_CURRENCY),
+        ])
+
+        self.assertEqual(results, [True, False, True, False])
+
+        presentments = Transaction.objects.filter(
+            transaction_type=Transaction.PRESENTMENT)
+        self.assertEqual(
+            sorted(presentments.values_list('transaction_id',
+                                            'settlement_amount',
+                                            'settlement_currency')),
+            [('TR1', self.SETTLEMENT_AMOUNT, self.SETTLEMENT_CURRENCY),
+             ('TR2', 90, self.SETTLEMENT_CURRENCY)])
+
+        # Both presentments share the clearing batch
+        self.assertEqual(
+            presentments.values('presentment_batch').distinct().count(), 1)
+
+        self.assertFalse(Account.objects.unreconciled().exists())
+
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.balance, 100)
+        self.assertEqual(self.acc.held_amount, 0)
+
+        scheme_acc = Account.objects.get(
+            card_id=CardsIssuerDatabase.SCHEME_CARD_ID,
+            currency=self.SETTLEMENT_CURRENCY)
+        self.assertEqual(scheme_acc.balance, self.SETTLEMENT_AMOUNT + 90)
+
+    def test_set_presentments_not_found(self):
+        self.assertEqual(
+            self.issuerdb.set_presentments([
+                ('MISSING', self.SETTLEMENT_AMOUNT, self.SETTLEMENT_CURRENCY),
+            ]),
+            [False])
+
     def test_get_scheme_account(self):
         acc = self.issuerdb._get_scheme_account(self.BILLING_CURRENCY)
         self.assertEqual(acc.currency, self.BILLING_CURRENCY)
@@ -126,6 +374,40 @@ class CardsIssuerDatabaseTests(TestCase):
 
         self.assertEqual(acc.balance, 100)
 
+    def test_create_account(self):
+        self.issuerdb.create_account('NEWCARD', self.CURRENCY)
+
+        self.assertTrue(self.issuerdb.account_exists('NEWCARD',
+                                                     self.CURRENCY))
+
+    def test_load_money_bulk(self):
+        """Loads into existing and new Accounts, debiting the Issuer once per
+        currency."""
+        count = self.issuerdb.load_money_bulk([
+            (self.CARD_ID, 100, self.CURRENCY),
+            ('NEWCARD', 50, self.CURRENCY),
+            ('NEWCARD', 20, 'USD'),
+            (self.CARD_ID, 10, self.CURRENCY),
+        ])
+
+        self.assertEqual(count, 4)
+
+        balances = dict(((card_id, currency), balance)
+                        for card_id, currency, balance
+                        in Account.objects.values_list('card_id',
+                                                       'currency',
+                                                       'balance'))
+        issuer_id = CardsIssuerDatabase.ISSUER_CARD_ID
+        self.assertEqual(balances, {
+            (self.CARD_ID, self.CURRENCY): 110,
+            ('NEWCARD', self.CURRENCY): 50,
+            ('NEWCARD', 'USD'): 20,
+            (issuer_id, self.CURRENCY): -160,
+            (issuer_id, 'USD'): -20,
+        })
+
+        self.assertFalse(Account.objects.unreconciled().exists())
+
     def test_make_authorisation_insuficient_funds(self):
         with self.assertRaises(InsufficientFunds):
             self.issuerdb.make_authorisation(
@@ -175,3 +457,569 @@ class CardsIssuerDatabaseTests(TestCase):
         self.assertEqual(
             Account.objects.filter(id=self.acc.id).balance().get().balance,
             0)
+
+        # The hold is maintained along the balance
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.held_amount, self.BILLING_AMOUNT)
+        self.assertFalse(Account.objects.unreconciled().exists())
+
+    def _make_authorisation(self, **kwargs):
+        params = dict(card_id=self.CARD_ID,
+                      transaction_id=self.TRANSACTION_ID,
+                      merchant_name=self.MERCHANT_NAME,
+                      merchant_country=self.MERCHANT_COUNTRY,
+                      merchant_mcc=self.MERCHANT_MCC,
+                      billing_amount=self.BILLING_AMOUNT,
+                      billing_currency=self.BILLING_CURRENCY,
+                      transaction_amount=self.TRANSACTION_AMOUNT,
+                      transaction_currency=self.TRANSACTION_CURRENCY)
+        params.update(kwargs)
+        return self.issuerdb.make_authorisation(**params)
+
+    def test_make_authorisation_replay(self):
+        """A replay with the same payload is a single lookup, the funds
+        aren't held again."""
+        self.issuerdb.load_money(self.CARD_ID,
+                                 self.BILLING_AMOUNT,
+                                 self.BILLING_CURRENCY)
+        self._make_authorisation()
+
+        # The payload is compared by value, as posted by the Scheme
+        with self.assertNumQueries(self.REPLAY_QUERIES):
+            self._make_authorisation(billing_amount='100.00',
+                                     transaction_amount='100.0',
+                                     merchant_mcc='1234')
+
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.held_amount, self.BILLING_AMOUNT)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+        # Still a replay after the presentment
+        self.issuerdb.set_presentment(self.TRANSACTION_ID,
+                                      self.SETTLEMENT_AMOUNT,
+                                      self.SETTLEMENT_CURRENCY)
+        with self.assertNumQueries(1):
+            self._make_authorisation()
+
+    def test_make_authorisation_duplicate(self):
+        """A transaction id reused with a different payload is refused."""
+        self.issuerdb.load_money(self.CARD_ID,
+                                 self.BILLING_AMOUNT,
+                                 self.BILLING_CURRENCY)
+        self._make_authorisation(billing_amount=10)
+
+        with self.assertRaises(DuplicateTransaction):
+            self._make_authorisation(billing_amount=20)
+
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.held_amount, 10)
+
+    def test_make_authorisation_concurrent_replay(self):
+        """A replay recorded between the lookup and the insert rolls the
+        hold back and returns the original outcome."""
+        self.issuerdb.load_money(self.CARD_ID,
+                                 self.BILLING_AMOUNT,
+                                 self.BILLING_CURRENCY)
+        self._make_authorisation(billing_amount=10)
+
+        with patch.object(self.issuerdb, '_is_replay',
+                          side_effect=[False, True]):
+            self._make_authorisation(billing_amount=10)
+
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.held_amount, 10)
+        self.assertEqual(self.acc.balance, self.BILLING_AMOUNT - 10)
+
+    def test_make_authorisation_ignores_unposted_journals(self):
+        """Authorisations check the maintained balance, journals written
+        outside the issuer database aren't available until reconciled."""
+        self.acc.journals.create(amount=self.BILLING_AMOUNT,
+                                 batch=Batch.objects.create())
+
+        with self.assertRaises(InsufficientFunds):
+            self.issuerdb.make_authorisation(
+                self.CARD_ID,
+                self.TRANSACTION_ID,
+                self.MERCHANT_NAME,
+                self.MERCHANT_COUNTRY,
+                self.MERCHANT_MCC,
+                self.BILLING_AMOUNT,
+                self.BILLING_CURRENCY,
+                self.TRANSACTION_AMOUNT,
+                self.TRANSACTION_CURRENCY)
+
+    def test_reconcile_balances(self):
+        self.acc.journals.create(amount=self.BILLING_AMOUNT,
+                                 batch=Batch.objects.create())
+
+        self.assertEqual(self.issuerdb.get_unreconciled_accounts(),
+                         [(self.CARD_ID, self.CURRENCY, 0, self.BILLING_AMOUNT,
+                           0, 0)])
+
+        self.assertEqual(self.issuerdb.reconcile_balances(), 1)
+
+        self.assertEqual(self.issuerdb.get_unreconciled_accounts(), [])
+        self.assertEqual(
+            self.issuerdb._get_balance(self.CARD_ID, self.CURRENCY),
+            self.BILLING_AMOUNT)
+
+    def test_expire_authorisations(self):
+        self.issuerdb.load_money(self.CARD_ID, 300, self.CURRENCY)
+        for transaction_id in ('T1', 'T2', 'T3'):
+            self._make_authorisation(transaction_id=transaction_id)
+        self.issuerdb.set_presentment('T3', self.SETTLEMENT_AMOUNT,
+                                      self.SETTLEMENT_CURRENCY)
+        self.assertEqual(
+            self.issuerdb._get_balance(self.CARD_ID, self.CURRENCY), 0)
+
+        # A chunk by authorisation
+        until = timezone.now()
+        self.assertEqual(self.issuerdb.expire_authorisations(until, 1), 2)
+        self.assertEqual(self.issuerdb.expire_authorisations(until, 1), 0)
+
+        self.assertEqual(
+            sorted(Transaction.objects.values_list('transaction_id',
+                                                   'transaction_type')),
+            [('T1', Transaction.EXPIRED),
+             ('T2', Transaction.EXPIRED),
+             ('T3', Transaction.PRESENTMENT)])
+        self.acc.refresh_from_db()
+        self.assertEqual((self.acc.balance, self.acc.held_amount), (200, 0))
+        self.assertEqual(
+            self.issuerdb._get_balance(self.CARD_ID, self.CURRENCY), 200)
+        self.assertEqual(self.issuerdb.get_unreconciled_accounts(), [])
+
+        # Expired authorisations can't be presented, their replays are
+        # still recognised.
+        with self.assertRaises(AuthorisationNotFound):
+            self.issuerdb.set_presentment('T1', self.SETTLEMENT_AMOUNT,
+                                          self.SETTLEMENT_CURRENCY)
+        self._make_authorisation(transaction_id='T1')
+        self.assertEqual(Transaction.objects.count(), 3)
+
+    def test_expire_authorisations_until(self):
+        self.issuerdb.load_money(self.CARD_ID, 100, self.CURRENCY)
+        self._make_authorisation()
+
+        until = timezone.now() - timedelta(days=1)
+        self.assertEqual(self.issuerdb.expire_authorisations(until), 0)
+
+    def test_get_statement_same_date(self):
+        """Entries created at the same time are listed by kind and id,
+        each one once."""
+        with patch('django.db.models.fields.timezone.now',
+                   return_value=timezone.now()):
+            self.issuerdb.load_money(self.CARD_ID, 300, self.CURRENCY)
+            for transaction_id in ('T1', 'T2'):
+                self._make_authorisation(transaction_id=transaction_id)
+            self.issuerdb.load_money(self.CARD_ID, 50, self.CURRENCY)
+
+        balance, entries, position = CardsReadDatabase().get_statement(
+            self.CARD_ID, self.CURRENCY)
+        self.assertEqual(balance, (150, 200))
+        self.assertEqual([(i['type'], i['amount']) for i in entries],
+                         [('authorisation', -100),
+                          ('authorisation', -100),
+                          ('journal', 50),
+                          ('journal', 300)])
+        self.assertIsNone(position)
+
+        pages = []
+        while True:
+            balance, page, position = CardsReadDatabase().get_statement(
+                self.CARD_ID, self.CURRENCY, position, 1)
+            pages.extend(page)
+            if position is None:
+                break
+        self.assertEqual(pages, entries)
+
+    def test_get_statement_account_not_found(self):
+        with self.assertRaises(AccountNotFound):
+            CardsReadDatabase().get_statement(self.CARD_ID, 'USD')
+
+    def test_get_settlement_totals(self):
+        self.issuerdb.load_money(self.CARD_ID, 300, self.CURRENCY)
+        for transaction_id in ('T1', 'T2', 'T3'):
+            self._make_authorisation(transaction_id=transaction_id)
+        self.issuerdb.set_presentments([('T1', 95, 'BRL'),
+                                        ('T2', 90, 'BRL'),
+                                        ('T3', 20, 'USD')])
+
+        start = timezone.now() - timedelta(hours=1)
+        self.assertEqual(
+            self.issuerdb.get_settlement_totals(start,
+                                                start + timedelta(days=1)),
+            {'BRL': (185, 2), 'USD': (20, 1)})
+        self.assertEqual(
+            self.issuerdb.get_settlement_totals(start - timedelta(days=1),
+                                                start),
+            {})
+
+    def test_get_balances(self):
+        self.issuerdb.load_money(self.CARD_ID, 10, self.CURRENCY)
+        self.issuerdb.create_account(self.CARD_ID, 'USD')
+
+        self.assertEqual(self.issuerdb.get_balances(self.CARD_ID),
+                         {self.CURRENCY: 10, 'USD': 0})
+        self.assertEqual(self.issuerdb.get_balances('CARD999'), {})
+
+    def test_get_authorisations(self):
+        self.issuerdb.load_money(self.CARD_ID, 100, self.CURRENCY)
+        self._make_authorisation(billing_amount=10)
+        Transaction.objects.update(creation_date=timezone.now() -
+                                   timedelta(hours=2))
+        self._make_authorisation(transaction_id='T2', billing_amount=20)
+
+        since = time.time() - 3600
+        self.assertEqual(
+            [(card_id, transaction_id, amount, currency, mcc, country)
+             for card_id, transaction_id, timestamp, amount, currency, mcc,
+             country in self.issuerdb.get_authorisations(since)],
+            [(self.CARD_ID, 'T2', 20, self.BILLING_CURRENCY,
+              self.MERCHANT_MCC, self.MERCHANT_COUNTRY)])
+        self.assertGreater(self.issuerdb.get_authorisations(0)[1][2], since)
+
+    def test_cross_currency_authorisation(self):
+        """A USD authorisation is held from the BRL Account, the card has
+        no USD one."""
+        currencies = ['USD', self.CURRENCY]
+        service = IssuerService(
+            self.issuerdb, currencies,
+            rates=RateTable([('USD', self.CURRENCY, '5')], currencies))
+        self.issuerdb.load_money(self.CARD_ID, 100, self.CURRENCY)
+
+        def authorise(card_id, transaction_id, amount):
+            return service.make_authorisation(
+                card_id, transaction_id, self.MERCHANT_NAME,
+                self.MERCHANT_COUNTRY, self.MERCHANT_MCC, amount, 'USD',
+                amount, 'USD')
+
+        self.assertTrue(authorise(self.CARD_ID, 'T1', 15))
+        self.assertEqual(
+            Transaction.objects.values_list('billing_amount',
+                                            'billing_currency').get(),
+            (75, self.CURRENCY))
+
+        # Replays are idempotent, the funds are held once
+        self.assertTrue(authorise(self.CARD_ID, 'T1', 15))
+        self.acc.refresh_from_db()
+        self.assertEqual((self.acc.balance, self.acc.held_amount), (25, 75))
+
+        with self.assertRaises(DuplicateTransaction):
+            authorise(self.CARD_ID, 'T1', 16)
+
+        self.assertFalse(authorise(self.CARD_ID, 'T2', 10))
+
+        with self.assertRaises(AccountNotFound):
+            authorise('CARD999', 'T3', 10)
+
+
+class CardsIssuerDatabaseTests(IssuerDatabaseTests, TestCase):
+
+    @patch('cards.issuer.transaction.on_commit', on_commit)
+    def test_set_presentment_queries(self):
+        """Pins the statements issued by a presentment with warm system
+        accounts: SAVEPOINT, SELECT authorisation, INSERT batch, INSERT
+        journals, UPDATE accounts, UPDATE transaction, RELEASE SAVEPOINT."""
+        self.addCleanup(CardsIssuerDatabase.invalidate_system_accounts)
+        self.issuerdb.warm_system_accounts([self.SETTLEMENT_CURRENCY])
+
+        self.issuerdb.load_money(self.CARD_ID,
+                                 self.BILLING_AMOUNT,
+                                 self.BILLING_CURRENCY)
+        self.issuerdb.make_authorisation(
+            self.CARD_ID,
+            self.TRANSACTION_ID,
+            self.MERCHANT_NAME,
+            self.MERCHANT_COUNTRY,
+            self.MERCHANT_MCC,
+            self.BILLING_AMOUNT,
+            self.BILLING_CURRENCY,
+            self.TRANSACTION_AMOUNT,
+            self.TRANSACTION_CURRENCY)
+
+        with self.assertNumQueries(7):
+            self.issuerdb.set_presentment(self.TRANSACTION_ID,
+                                          self.SETTLEMENT_AMOUNT,
+                                          self.SETTLEMENT_CURRENCY)
+
+        self.assertFalse(Account.objects.unreconciled().exists())
+
+    @patch('cards.issuer.transaction.on_commit', on_commit)
+    def test_load_money_queries(self):
+        """Pins the statements issued by a load: SAVEPOINT, SELECT account,
+        INSERT batch, INSERT journals, UPDATE accounts, RELEASE SAVEPOINT."""
+        self.addCleanup(CardsIssuerDatabase.invalidate_system_accounts)
+        self.issuerdb.warm_system_accounts([self.CURRENCY])
+
+        with self.assertNumQueries(6):
+            self.issuerdb.load_money(self.CARD_ID, 100, self.CURRENCY)
+
+        self.assertFalse(Account.objects.unreconciled().exists())
+
+
+class MemoryIssuerDatabaseTests(IssuerDatabaseTests, TestCase):
+    database_class = MemoryIssuerDatabase
+
+    REPLAY_QUERIES = 0
+
+    def test_declined_from_memory(self):
+        """The decline only checks the transaction id, no Account is read or
+        locked."""
+        self.issuerdb.load_money(self.CARD_ID, 10, self.CURRENCY)
+
+        with self.assertNumQueries(1), self.assertRaises(InsufficientFunds):
+            self._make_authorisation()
+
+    def test_approved_writes_through(self):
+        """The approved hold is written with its authorisation, the balance
+        isn't read back."""
+        self.issuerdb.load_money(self.CARD_ID,
+                                 self.BILLING_AMOUNT,
+                                 self.BILLING_CURRENCY)
+
+        # SAVEPOINT, UPDATE account, INSERT transaction, RELEASE SAVEPOINT
+        with self.assertNumQueries(4):
+            self._make_authorisation()
+
+        self.assertEqual(self.issuerdb._get_balance(self.CARD_ID,
+                                                    self.CURRENCY), 0)
+        self.assertFalse(Account.objects.unreconciled().exists())
+
+    def test_spent_by_another_writer(self):
+        """An Account spent behind the engine is declined, never overdrawn,
+        and reloaded."""
+        self.issuerdb.load_money(self.CARD_ID,
+                                 self.BILLING_AMOUNT,
+                                 self.BILLING_CURRENCY)
+
+        CardsIssuerDatabase().make_authorisation(
+            self.CARD_ID, 'OTHER', self.MERCHANT_NAME, self.MERCHANT_COUNTRY,
+            self.MERCHANT_MCC, 60, self.BILLING_CURRENCY, 60,
+            self.TRANSACTION_CURRENCY)
+
+        with self.assertRaises(InsufficientFunds):
+            self._make_authorisation()
+
+        self.assertEqual(self.issuerdb._get_balance(self.CARD_ID,
+                                                    self.CURRENCY), 40)
+        self._make_authorisation(billing_amount=40)
+
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.balance, 0)
+
+    def test_record_slots(self):
+        record = AccountRecord(1, 0)
+
+        with self.assertRaises(AttributeError):
+            record.card_id = self.CARD_ID
+
+    @patch.object(MemoryIssuerDatabase, 'MAX_HOLDS', 2)
+    def test_holds_bounded(self):
+        """The oldest holds are dropped, their replays are looked up on the
+        database."""
+        self.issuerdb.load_money(self.CARD_ID, 30, self.BILLING_CURRENCY)
+        for transaction_id in ['TR1', 'TR2', 'TR3']:
+            self._make_authorisation(transaction_id=transaction_id,
+                                     billing_amount=10)
+
+        self.assertEqual(list(self.issuerdb._holds), ['TR2', 'TR3'])
+
+        # Replayed with no funds left
+        self._make_authorisation(transaction_id='TR1', billing_amount=10)
+        with self.assertRaises(DuplicateTransaction):
+            self._make_authorisation(transaction_id='TR1', billing_amount=5)
+
+
+def on_commit(fn, using=None):
+    """Runs transaction.on_commit callbacks right away, test cases never
+    commit."""
+    fn()
+
+
+class MemoryLedgerTests(TestCase):
+    """The in memory engine posts the approved holds to the ledger log."""
+    CARD_ID = 'CARD123'
+    CURRENCY = 'BRL'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        patcher = patch('cards.issuer.transaction.on_commit', on_commit)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.addCleanup(CardsIssuerDatabase.invalidate_system_accounts)
+        self.acc = Account.objects.create(card_id=self.CARD_ID,
+                                          currency=self.CURRENCY)
+        self.ledger = LedgerWriter(os.path.join(directory.name, 'ledger.log'),
+                                   apply_interval_ms=None)
+        self.addCleanup(self.ledger.stop)
+        self.issuerdb = MemoryIssuerDatabase(ledger=self.ledger)
+        self.issuerdb.load_money(self.CARD_ID, 100, self.CURRENCY)
+        self.ledger.flush()
+
+    def _make_authorisation(self, transaction_id, amount):
+        self.issuerdb.make_authorisation(self.CARD_ID, transaction_id,
+                                         'Game Store', 'BR', 1234, amount,
+                                         self.CURRENCY, amount,
+                                         self.CURRENCY)
+
+    def test_approved_posted(self):
+        """The approval only looks the transaction id up, the hold and the
+        authorisation are written by the ledger."""
+        with self.assertNumQueries(1):
+            self._make_authorisation('TR1', 60)
+
+        self.assertFalse(Transaction.objects.exists())
+        self.assertEqual(self.ledger.flush(), 1)
+
+        self.acc.refresh_from_db()
+        self.assertEqual((self.acc.balance, self.acc.held_amount), (40, 60))
+        self.assertEqual(
+            Transaction.objects.values_list('transaction_id',
+                                            'transaction_type').get(),
+            ('TR1', Transaction.AUTHORISATION))
+        self.assertFalse(Account.objects.unreconciled().exists())
+
+        # Replays are answered from memory, written or not
+        with self.assertNumQueries(0):
+            self._make_authorisation('TR1', 60)
+        with self.assertRaises(DuplicateTransaction):
+            self._make_authorisation('TR1', 50)
+
+    def test_reload_keeps_pending_holds(self):
+        """An Account reloaded before its holds are written doesn't give
+        them back."""
+        self._make_authorisation('TR1', 60)
+        self.issuerdb.invalidate()
+
+        self.assertEqual(self.issuerdb._get_balance(self.CARD_ID,
+                                                    self.CURRENCY), 40)
+        with self.assertRaises(InsufficientFunds):
+            self._make_authorisation('TR2', 60)
+
+        # Not written, the replay is still answered from memory
+        self._make_authorisation('TR1', 60)
+        self.assertEqual(self.ledger.flush(), 1)
+
+    def test_presentment_writes_hold(self):
+        self._make_authorisation('TR1', 60)
+        self.issuerdb.set_presentment('TR1', 55, self.CURRENCY)
+        self.ledger.flush()
+
+        self.acc.refresh_from_db()
+        self.assertEqual((self.acc.balance, self.acc.held_amount), (40, 0))
+        self.assertEqual(Transaction.objects.get().transaction_type,
+                         Transaction.PRESENTMENT)
+        self.assertFalse(Account.objects.unreconciled().exists())
+
+    @patch.object(MemoryIssuerDatabase, 'MAX_HOLDS', 1)
+    def test_pending_holds_kept(self):
+        """The holds are only dropped once written."""
+        self._make_authorisation('TR1', 10)
+        self._make_authorisation('TR2', 10)
+        self.assertEqual(list(self.issuerdb._holds), ['TR1', 'TR2'])
+
+        self.ledger.flush()
+        self._make_authorisation('TR3', 10)
+        self.assertEqual(list(self.issuerdb._holds), ['TR3'])
+
+
+class ConcurrentAuthorisationTests(TransactionTestCase):
+    """Stress tests concurrent authorisations for a single card, the
+    authorisations exceeding the balance must be declined."""
+    CARD_ID = 'CARD123'
+    CURRENCY = 'BRL'
+
+    BALANCE = 500
+    AMOUNT = 10
+
+    THREADS = 8
+    AUTHORISATIONS = 20
+
+    def setUp(self):
+        # The flush between tests removes the committed system accounts.
+        CardsIssuerDatabase.invalidate_system_accounts()
+
+        Account.objects.create(card_id=self.CARD_ID, currency=self.CURRENCY)
+        CardsIssuerDatabase().load_money(self.CARD_ID,
+                                         self.BALANCE,
+                                         self.CURRENCY)
+
+    def _authorise(self, issuerdb, thread):
+        approved = 0
+        try:
+            for i in range(self.AUTHORISATIONS):
+                try:
+                    issuerdb.make_authorisation(
+                        self.CARD_ID,
+                        'T{}-{}'.format(thread, i),
+                        'Game Store', 'BR', 1234,
+                        self.AMOUNT, self.CURRENCY,
+                        self.AMOUNT, self.CURRENCY)
+                except InsufficientFunds:
+                    pass
+                else:
+                    approved += 1
+        finally:
+            connection.close()
+
+        return approved
+
+    # SQLite shared cache databases fail right away on locked tables, all the
+    # contention is resolved by retries.
+    @patch('cards.issuer.CONFLICT_RETRIES', 1000)
+    def _stress(self, locking, database_class=CardsIssuerDatabase,
+                ledger=None):
+        issuerdb = database_class(locking=locking, ledger=ledger)
+
+        with ThreadPoolExecutor(self.THREADS) as executor:
+            approved = sum(executor.map(self._authorise,
+                                        [issuerdb] * self.THREADS,
+                                        range(self.THREADS)))
+
+        if ledger is not None:
+            ledger.flush()
+
+        acc = Account.objects.balance().get(card_id=self.CARD_ID,
+                                            currency=self.CURRENCY)
+
+        # No overdraft, every approved authorisation was held.
+        self.assertEqual(approved, self.BALANCE // self.AMOUNT)
+        self.assertEqual(acc.balance, 0)
+        self.assertEqual(acc.held_amount, self.BALANCE)
+        self.assertEqual(acc.ledger_balance, 0)
+        self.assertEqual(
+            Transaction.objects.authorisations().count(), approved)
+
+    def test_select_for_update(self):
+        self._stress(CardsIssuerDatabase.SELECT_FOR_UPDATE)
+
+    def test_conditional_update(self):
+        self._stress(CardsIssuerDatabase.CONDITIONAL_UPDATE)
+
+    def test_memory(self):
+        self._stress(None, MemoryIssuerDatabase)
+
+    def test_memory_ledger(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        ledger = LedgerWriter(os.path.join(directory.name, 'ledger.log'),
+                              apply_interval_ms=5)
+        self.addCleanup(ledger.stop)
+
+        # The Accounts are reloaded while their holds are written
+        authorise = MemoryIssuerDatabase.make_authorisation
+        calls = iter(range(self.THREADS * self.AUTHORISATIONS))
+
+        def make_authorisation(issuerdb, *args):
+            if next(calls) % 10 == 0:
+                issuerdb.invalidate()
+            return authorise(issuerdb, *args)
+
+        with patch.object(MemoryIssuerDatabase, 'make_authorisation',
+                          make_authorisation):
+            self._stress(None, MemoryIssuerDatabase, ledger)
@@ -0,0 +1,317 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+import io
+import os
+import tempfile
+import time
+
+from django.test import TestCase, TransactionTestCase
+
+from cards.accounting.models import (Account, Transaction, Batch,
+                                     LedgerLogPosition, )
+from cards.issuer import CardsIssuerDatabase
+from cards.ledger import LedgerLog, LedgerWriter, encode_record, read_records
+
+
+def on_commit(fn, using=None):
+    """Runs transaction.on_commit callbacks right away, test cases never
+    commit."""
+    fn()
+
+
+class RecordsTests(TestCase):
+
+    def test_read_records(self):
+        data = encode_record({'seq': 1}) + encode_record({'seq': 2})
+        entries, length = read_records(io.BytesIO(data))
+        self.assertEqual(entries, [{'seq': 1}, {'seq': 2}])
+        self.assertEqual(length, len(data))
+
+    def test_torn_record(self):
+        record = encode_record({'seq': 1})
+        data = record + encode_record({'seq': 2})[:-1]
+        self.assertEqual(read_records(io.BytesIO(data)),
+                         ([{'seq': 1}], len(record)))
+
+    def test_corrupted_record(self):
+        record = encode_record({'seq': 1})
+        data = record + encode_record({'seq': 2}).replace(b'2', b'3')
+        self.assertEqual(read_records(io.BytesIO(data)),
+                         ([{'seq': 1}], len(record)))
+
+
+class LedgerLogTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'ledger.log')
+
+    def _open(self, **kwargs):
+        log = LedgerLog(self.path, **kwargs)
+        self.addCleanup(log.close)
+        return log, log.open()
+
+    def test_append(self):
+        log, entries = self._open()
+        self.assertEqual(entries, [])
+        self.assertEqual(log.append({'amount': 1}), 1)
+        self.assertEqual(log.append({'amount': 2}), 2)
+        log.close()
+
+        log, entries = self._open()
+        self.assertEqual(entries, [{'amount': 1, 'seq': 1},
+                                   {'amount': 2, 'seq': 2}])
+        self.assertEqual(log.append({}), 3)
+
+    def test_torn_tail_truncated(self):
+        with open(self.path, 'wb') as stream:
+            stream.write(encode_record({'seq': 1}) + b'\x00\x00')
+
+        log, entries = self._open()
+        self.assertEqual(entries, [{'seq': 1}])
+        self.assertEqual(log.append({}), 2)
+        log.close()
+
+        log, entries = self._open()
+        self.assertEqual([i['seq'] for i in entries], [1, 2])
+
+    def test_closed(self):
+        log, entries = self._open()
+        log.close()
+        with self.assertRaises(OSError):
+            log.append({})
+
+    def test_group_commit(self):
+        """Concurrent appends are written by a single fsync."""
+        log, entries = self._open(group_entries=8, group_interval=1)
+
+        with patch('cards.ledger.os.fsync') as fsync:
+            with ThreadPoolExecutor(8) as executor:
+                seqs = list(executor.map(log.append, [{}] * 8))
+
+        self.assertEqual(sorted(seqs), list(range(1, 9)))
+        self.assertEqual(fsync.call_count, 1)
+
+    def test_durable_callback(self):
+        durable = []
+        log, entries = self._open(on_durable=durable.extend)
+        log.append({})
+        log.append({})
+        self.assertEqual(durable, [{'seq': 1}, {'seq': 2}])
+
+    def test_rotate(self):
+        log, entries = self._open()
+        log.append({'amount': 1})
+        self.assertFalse(log.rotate(0))
+        self.assertTrue(log.rotate(1))
+        log.append({'amount': 2})
+        log.close()
+
+        log, entries = self._open()
+        self.assertEqual(entries, [{'seq': 1, 'checkpoint': True},
+                                   {'amount': 2, 'seq': 2}])
+
+
+@patch('cards.issuer.transaction.on_commit', on_commit)
+class LedgerWriterTests(TestCase):
+    CARD_ID = 'CARD123'
+    CURRENCY = 'BRL'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'ledger.log')
+
+        self.addCleanup(CardsIssuerDatabase.invalidate_system_accounts)
+        self.acc = Account.objects.create(card_id=self.CARD_ID,
+                                          currency=self.CURRENCY)
+        self.ledger = self._writer()
+        self.issuerdb = CardsIssuerDatabase(ledger=self.ledger)
+
+    def _writer(self):
+        writer = LedgerWriter(self.path, name='test', apply_interval_ms=None)
+        self.addCleanup(writer.stop)
+        return writer
+
+    def _authorise(self, transaction_id, amount):
+        self.issuerdb.make_authorisation(self.CARD_ID, transaction_id,
+                                         'Game Store', 'BR', 1234,
+                                         amount, self.CURRENCY,
+                                         amount, self.CURRENCY)
+
+    def test_load_money(self):
+        """The load is written to the database by the flush."""
+        self.issuerdb.load_money(self.CARD_ID, 100, self.CURRENCY)
+
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.balance, 0)
+        self.assertFalse(Batch.objects.exists())
+        self.assertEqual(self.ledger.pending(), 1)
+
+        self.assertEqual(self.ledger.flush(), 1)
+
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.balance, 100)
+        self.assertEqual(self.ledger.pending(), 0)
+        self.assertEqual(LedgerLogPosition.objects.get(name='test').seq, 1)
+        self.assertFalse(Account.objects.unreconciled().exists())
+
+    def test_flush_single_batch(self):
+        """The entries are written as a single Batch: SAVEPOINT, SELECT
+        position, INSERT batch, INSERT journals, UPDATE accounts, UPDATE
+        position, RELEASE SAVEPOINT."""
+        LedgerLogPosition.objects.create(name='test')
+        self.issuerdb.load_money(self.CARD_ID, 100, self.CURRENCY)
+        self.issuerdb.load_money(self.CARD_ID, 50, self.CURRENCY)
+
+        with self.assertNumQueries(7):
+            self.assertEqual(self.ledger.flush(), 2)
+
+        self.assertEqual(Batch.objects.count(), 1)
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.balance, 150)
+
+    def test_pending_debits(self):
+        """The holds not written are debits, the loads aren't counted."""
+        self.issuerdb.load_money(self.CARD_ID, 100, self.CURRENCY)
+        self.assertEqual(self.ledger.written_seq(), 0)
+        self.ledger.flush()
+        self.assertEqual(self.ledger.written_seq(), 1)
+
+        self.ledger.post([], {self.acc.pk: 30})
+        self.issuerdb.load_money(self.CARD_ID, 20, self.CURRENCY)
+
+        self.assertEqual(self.ledger.written_seq(), 1)
+        # The issuer account is debited by the load
+        debits = self.ledger.pending_debits()
+        self.assertEqual(debits[self.acc.pk], 30)
+        self.assertEqual(sum(debits.values()), 50)
+        self.assertEqual(self.ledger.pending_debits('other'), {})
+
+        # Only the held amounts are changed
+        self.ledger.flush()
+        self.assertEqual(self.ledger.written_seq(), 3)
+        self.assertEqual(Batch.objects.count(), 2)
+        self.acc.refresh_from_db()
+        self.assertEqual((self.acc.balance, self.acc.held_amount), (90, 30))
+
+    def test_set_presentment(self):
+        """The authorisation is presented at once, its Batch is linked when
+        it's written."""
+        self.issuerdb.load_money(self.CARD_ID, 100, self.CURRENCY)
+        self.ledger.flush()
+        self._authorise('T1', 100)
+
+        self.issuerdb.set_presentment('T1', 95, self.CURRENCY)
+
+        tr = Transaction.objects.get(transaction_id='T1')
+        self.assertEqual(tr.transaction_type, Transaction.PRESENTMENT)
+        self.assertEqual(tr.settlement_amount, 95)
+        self.assertIsNone(tr.presentment_batch)
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.held_amount, 100)
+
+        self.ledger.flush()
+
+        tr.refresh_from_db()
+        self.assertIsNotNone(tr.presentment_batch)
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.balance, 0)
+        self.assertEqual(self.acc.held_amount, 0)
+        self.assertFalse(Account.objects.unreconciled().exists())
+
+    def test_recover(self):
+        """The entries not written before the stop are written once on the
+        next start."""
+        self.issuerdb.load_money(self.CARD_ID, 100, self.CURRENCY)
+        self.ledger.flush()
+        self.issuerdb.load_money(self.CARD_ID, 50, self.CURRENCY)
+        self.ledger.stop()
+
+        self.assertEqual(self._writer().flush(), 2)
+        self.assertEqual(self._writer().flush(), 2)
+
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.balance, 150)
+        self.assertEqual(Batch.objects.count(), 2)
+
+    def test_rolled_back_presentment(self):
+        """The entry which presentments were rolled back waits for them, it's
+        dropped on recovery."""
+        self.issuerdb.load_money(self.CARD_ID, 100, self.CURRENCY)
+        self.ledger.flush()
+        self._authorise('T1', 10)
+        tr = Transaction.objects.get(transaction_id='T1')
+        self.ledger.post([(self.acc.pk, -10)],
+                         {self.acc.pk: -10},
+                         [(tr.pk, 10, self.CURRENCY)])
+
+        self.assertEqual(self.ledger.flush(), 0)
+        self.assertEqual(self.ledger.pending(), 1)
+        self.ledger.stop()
+
+        self.assertEqual(self._writer().flush(), 2)
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.balance, 90)
+        self.assertEqual(self.acc.held_amount, 10)
+
+    def test_presented_twice(self):
+        """An authorisation posted twice is written once."""
+        self.issuerdb.load_money(self.CARD_ID, 100, self.CURRENCY)
+        self.ledger.flush()
+        self._authorise('T1', 10)
+        tr = Transaction.objects.get(transaction_id='T1')
+        presentments = [(tr.pk, 10, self.CURRENCY)]
+        self.issuerdb._post_batch([(self.acc.pk, -10)],
+                                  {self.acc.pk: -10},
+                                  presentments)
+        self.issuerdb._post_batch([(self.acc.pk, -10)],
+                                  {self.acc.pk: -10},
+                                  presentments)
+
+        self.assertEqual(self.ledger.flush(), 2)
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.balance, 90)
+        self.assertEqual(self.acc.held_amount, 0)
+
+    def test_rotate(self):
+        self.ledger._rotate_size = 0
+        self.issuerdb.load_money(self.CARD_ID, 100, self.CURRENCY)
+        self.ledger.flush()
+        self.issuerdb.load_money(self.CARD_ID, 50, self.CURRENCY)
+        self.ledger.stop()
+
+        self.assertEqual(self._writer().flush(), 2)
+        self.acc.refresh_from_db()
+        self.assertEqual(self.acc.balance, 150)
+
+
+class LedgerWriterThreadTests(TransactionTestCase):
+
+    def setUp(self):
+        # The flush between tests removes the committed system accounts.
+        CardsIssuerDatabase.invalidate_system_accounts()
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.ledger = LedgerWriter(os.path.join(directory.name, 'ledger.log'),
+                                   apply_interval_ms=10)
+        self.addCleanup(self.ledger.stop)
+
+    def test_written_in_background(self):
+        acc = Account.objects.create(card_id='CARD123', currency='BRL')
+        issuerdb = CardsIssuerDatabase(ledger=self.ledger)
+
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(issuerdb.load_money,
+                              ['CARD123'] * 20, [5] * 20, ['BRL'] * 20))
+
+        deadline = time.monotonic() + 5
+        while self.ledger.pending() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        acc.refresh_from_db()
+        self.assertEqual(acc.balance, 100)
+        self.assertFalse(Account.objects.unreconciled().exists())
@@ -0,0 +1,121 @@
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+
+from cards import balances, replicas
+from cards.accounting.models import Account
+from cards.issuer import CardsReadDatabase
+from cards.replicas import (ReplicaRouter, clear_replica_lags,
+                            get_read_db, get_replica_lag,
+                            replication_lag, )
+from issuer.db import AccountNotFound
+
+
+REPLICAS = {'default': ['replica1', 'replica2']}
+
+
+class GetReplicaLagTests(TestCase):
+
+    def setUp(self):
+        self.addCleanup(clear_replica_lags)
+
+    def test_no_lag_query(self):
+        """SQLite has no replication, it's never behind."""
+        self.assertEqual(get_replica_lag('default'), 0)
+
+    @patch.dict(replicas.LAG_QUERIES, {'sqlite': 'SELECT 1, 1, 0, 2.5'})
+    def test_checked_once_by_interval(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_replica_lag('default', lambda: 10), 2.5)
+            self.assertEqual(get_replica_lag('default', lambda: 10.5), 2.5)
+
+        with self.assertNumQueries(1):
+            get_replica_lag('default', lambda: 11)
+
+    @patch.dict(replicas.LAG_QUERIES, {'sqlite': 'SELECT * FROM missing'})
+    def test_unavailable(self):
+        self.assertIsNone(get_replica_lag('default'))
+
+    @patch.dict(replicas.LAG_QUERIES, {'sqlite': 'SELECT 1, 0, 1, NULL'})
+    def test_disconnected(self):
+        """A replica which lost the primary replayed everything it received,
+        it's stale anyway."""
+        self.assertEqual(get_replica_lag('default'), replicas.STALE)
+
+        # Whatever the staleness bound
+        with override_settings(REPLICAS={'shard1': ['default']}):
+            self.assertEqual(get_read_db('shard1', max_lag=10 ** 9),
+                             'shard1')
+
+    def test_replication_lag(self):
+        self.assertEqual(replication_lag(False, False, False, None), 0)
+        self.assertEqual(replication_lag(True, True, True, None), 0)
+        self.assertEqual(replication_lag(True, True, False, 2.5), 2.5)
+        self.assertEqual(replication_lag(True, True, False, None),
+                         replicas.STALE)
+        self.assertEqual(replication_lag(True, None, True, 0),
+                         replicas.STALE)
+
+
+@override_settings(REPLICAS=REPLICAS, REPLICA_MAX_LAG=5)
+class GetReadDbTests(TestCase):
+
+    def _lags(self, lags):
+        return patch('cards.replicas.get_replica_lag', lags.get)
+
+    def test_fresh_replica(self):
+        with self._lags({'replica1': 10, 'replica2': 1}):
+            self.assertEqual(get_read_db('default'), 'replica2')
+            self.assertIn(get_read_db('default', max_lag=20),
+                          REPLICAS['default'])
+
+    def test_no_fresh_replica(self):
+        with self._lags({'replica1': 10, 'replica2': None}):
+            self.assertEqual(get_read_db('default'), 'default')
+
+    def test_no_replicas(self):
+        self.assertEqual(get_read_db('shard1'), 'shard1')
+
+
+@override_settings(REPLICAS=REPLICAS)
+class ReplicaRouterTests(TestCase):
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    @patch('cards.replicas.get_read_db', return_value='replica1')
+    def test_db_for_read(self, get_read_db):
+        self.assertIsNone(self.router.db_for_read(Account))
+
+        # Out of a transaction only, a test case runs inside one.
+        with patch('cards.replicas.connections') as connections:
+            connections.__getitem__().in_atomic_block = False
+            self.assertEqual(self.router.db_for_read(Account), 'replica1')
+            self.assertIsNone(self.router.db_for_read(
+                Account, instance=Account()))
+
+            get_read_db.return_value = 'default'
+            self.assertIsNone(self.router.db_for_read(Account))
+
+    def test_allow_migrate(self):
+        self.assertFalse(self.router.allow_migrate('replica1', 'accounting'))
+        self.assertIsNone(self.router.allow_migrate('default', 'accounting'))
+
+
+class CardsReadDatabaseTests(TestCase):
+
+    def setUp(self):
+        balances.clear()
+        self.readdb = CardsReadDatabase(max_lag=1)
+        Account.objects.create(card_id='CARD123', currency='BRL', balance=10)
+
+    @patch('cards.issuer.get_read_db', return_value='default')
+    def test_read_from_replica(self, get_read_db):
+        self.assertEqual(self.readdb.get_balance('CARD123', 'BRL'), 10)
+        self.assertTrue(self.readdb.account_exists('CARD123', 'BRL'))
+        get_read_db.assert_called_with('default', 1)
+
+    def test_account_not_found(self):
+        self.assertFalse(self.readdb.account_exists('CARD123', 'USD'))
+        with self.assertRaises(AccountNotFound):
+            self.readdb.get_balance('CARD123', 'USD')
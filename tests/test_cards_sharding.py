@@ -0,0 +1,150 @@
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.db import connections
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from cards.accounting.models import Account, Transaction, TransactionRoute
+from cards.issuer import CardsIssuerDatabase
+from cards.memory import MemoryIssuerDatabase
+from cards.sharding import ShardRouter, get_shard
+from issuer.db import AuthorisationNotFound, DuplicateTransaction
+
+
+SHARDS = ['default', 'shard1']
+
+
+class GetShardTests(SimpleTestCase):
+
+    def test_single_shard(self):
+        self.assertEqual(get_shard('CARD123', ['default']), 'default')
+
+    def test_spread(self):
+        shards = [get_shard('CARD{}'.format(i), SHARDS) for i in range(1000)]
+        self.assertEqual(set(shards), set(SHARDS))
+        self.assertGreater(shards.count('shard1'), 400)
+
+
+@override_settings(SHARDS=SHARDS)
+class ShardRouterTests(SimpleTestCase):
+
+    def test_allow_migrate(self):
+        router = ShardRouter()
+        self.assertTrue(router.allow_migrate('shard1', 'accounting'))
+        self.assertFalse(router.allow_migrate('shard1', 'auth'))
+        self.assertIsNone(router.allow_migrate('default', 'auth'))
+        self.assertIsNone(router.allow_migrate('other', 'auth'))
+
+
+@override_settings(SHARDS=SHARDS)
+class ShardedIssuerDatabaseTests(TransactionTestCase):
+    """CARD123 lives on the default database, CARD124 on shard1."""
+    multi_db = True
+    CURRENCY = 'BRL'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.databases['shard1'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(cls.directory.name, 'shard1.sqlite3'),
+        }
+        super().setUpClass()
+        call_command('migrate', database='shard1', verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['shard1'].close()
+        del connections.databases['shard1']
+        delattr(connections._connections, 'shard1')
+        cls.directory.cleanup()
+
+    def setUp(self):
+        CardsIssuerDatabase.invalidate_system_accounts()
+        self.issuerdb = self.engine()
+        for card_id in ('CARD123', 'CARD124'):
+            self.issuerdb.create_account(card_id, self.CURRENCY)
+            self.issuerdb.load_money(card_id, 100, self.CURRENCY)
+
+    engine = CardsIssuerDatabase
+
+    def _authorise(self, card_id, transaction_id, amount=10):
+        self.issuerdb.make_authorisation(card_id, transaction_id,
+                                         'Game Store', 'BR', 1234,
+                                         amount, self.CURRENCY,
+                                         amount, self.CURRENCY)
+
+    def test_accounts_partitioned(self):
+        self.assertEqual(
+            list(Account.objects.values_list('card_id', 'balance')
+                 .filter(card_id__startswith='CARD')),
+            [('CARD123', 100)])
+        self.assertEqual(
+            list(Account.objects.using('shard1')
+                 .values_list('card_id', 'balance')
+                 .filter(card_id__startswith='CARD')),
+            [('CARD124', 100)])
+        self.assertEqual(self.issuerdb._get_balance('CARD124',
+                                                    self.CURRENCY), 100)
+        self.assertTrue(self.issuerdb.account_exists('CARD124',
+                                                     self.CURRENCY))
+
+    def test_authorisation_routed(self):
+        self._authorise('CARD124', 'T1')
+
+        self.assertTrue(Transaction.objects.using('shard1')
+                        .filter(transaction_id='T1').exists())
+        self.assertEqual(TransactionRoute.objects.get().shard, 'shard1')
+
+        # Replays are idempotent, the id is unique across the shards.
+        self._authorise('CARD124', 'T1')
+        with self.assertRaises(DuplicateTransaction):
+            self._authorise('CARD123', 'T1')
+
+    def test_set_presentment(self):
+        self._authorise('CARD124', 'T1')
+        self.issuerdb.invalidate()
+
+        self.issuerdb.set_presentment('T1', 8, self.CURRENCY)
+
+        with self.assertRaises(AuthorisationNotFound):
+            self.issuerdb.set_presentment('T2', 8, self.CURRENCY)
+
+        acc = Account.objects.using('shard1').get(card_id='CARD124')
+        self.assertEqual((acc.balance, acc.held_amount), (90, 0))
+
+    def test_set_presentments(self):
+        self._authorise('CARD123', 'T1')
+        self._authorise('CARD124', 'T2')
+        self._authorise('CARD123', 'T3')
+
+        self.assertEqual(
+            self.issuerdb.set_presentments([('T1', 8, self.CURRENCY),
+                                            ('T4', 8, self.CURRENCY),
+                                            ('T2', 9, self.CURRENCY),
+                                            ('T3', 8, self.CURRENCY)]),
+            [True, False, True, True])
+
+        self.assertEqual(self.issuerdb.get_unreconciled_accounts(), [])
+        self.assertEqual(
+            self.issuerdb.get_system_balances()[
+                (CardsIssuerDatabase.SCHEME_CARD_ID, self.CURRENCY)],
+            (25, 0))
+
+    def test_load_money_bulk(self):
+        self.issuerdb.load_money_bulk([('CARD123', 5, self.CURRENCY),
+                                       ('CARD124', 5, self.CURRENCY),
+                                       ('CARD125', 5, self.CURRENCY)])
+
+        self.assertEqual(self.issuerdb._get_balance('CARD124',
+                                                    self.CURRENCY), 105)
+        self.assertEqual(
+            self.issuerdb.get_system_balances()[
+                (CardsIssuerDatabase.ISSUER_CARD_ID, self.CURRENCY)],
+            (-215, 0))
+
+
+class ShardedMemoryIssuerDatabaseTests(ShardedIssuerDatabaseTests):
+    engine = MemoryIssuerDatabase
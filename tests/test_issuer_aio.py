@@ -0,0 +1,89 @@
+from decimal import Decimal
+from unittest.mock import MagicMock
+from unittest import TestCase
+import asyncio
+import threading
+
+from issuer.aio import AsyncIssuerService, ThreadedIssuerDatabase
+from issuer.db import InsufficientFunds, AuthorisationNotFound
+from issuer.fx import RateTable
+from issuer.service import IssuerService
+
+
+def run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+class AsyncIssuerServiceTests(TestCase):
+    CARD_ID = 'CARD123'
+    CURRENCY = 'BRL'
+
+    TRANSACTION_ID = 'IDDQD666'
+
+    AUTHORISATION = (CARD_ID, TRANSACTION_ID, 'Game Store', 'BR', 1234, 100,
+                     CURRENCY, 100, CURRENCY)
+
+    def setUp(self):
+        self.db_mock = MagicMock()
+        self.db = ThreadedIssuerDatabase(self.db_mock, max_workers=2)
+        self.issuer_service = IssuerService(self.db_mock,
+                                            [self.CURRENCY, 'USD'])
+        self.service = AsyncIssuerService(self.db, self.issuer_service)
+
+    def tearDown(self):
+        self.db.shutdown()
+
+    def test_make_authorisation(self):
+        self.assertTrue(run(self.service.make_authorisation(
+            *self.AUTHORISATION)))
+
+        self.db_mock.make_authorisation.assert_called_with(
+            *self.AUTHORISATION)
+
+    def test_make_authorisation_false(self):
+        self.db_mock.make_authorisation.side_effect = InsufficientFunds
+
+        self.assertFalse(run(self.service.make_authorisation(
+            *self.AUTHORISATION)))
+
+    def test_make_authorisation_invalid_currency(self):
+        with self.assertRaises(ValueError):
+            run(self.service.make_authorisation(
+                *self.AUTHORISATION[:-1], 'INVALID_CURRENCY'))
+
+    def test_make_authorisation_converted(self):
+        """The billing amount is held from another Account of the card, as
+        IssuerService does."""
+        self.issuer_service.set_rates(
+            RateTable([('USD', self.CURRENCY, '5')], [self.CURRENCY, 'USD']))
+        self.db_mock.make_authorisation.side_effect = [InsufficientFunds,
+                                                       None]
+        self.db_mock.get_balances.return_value = {'USD': 50}
+
+        self.assertTrue(run(self.service.make_authorisation(
+            *self.AUTHORISATION)))
+
+        self.db_mock.make_authorisation.assert_called_with(
+            *self.AUTHORISATION[:5], Decimal('20.00'), 'USD', 100,
+            self.CURRENCY)
+
+    def test_set_presentment_not_found(self):
+        self.db_mock.set_presentment.side_effect = AuthorisationNotFound
+
+        with self.assertRaises(AuthorisationNotFound):
+            run(self.service.set_presentment(self.TRANSACTION_ID, 100,
+                                             self.CURRENCY))
+
+    def test_database_off_the_loop(self):
+        """The synchronous database runs on the pool threads, concurrent
+        calls don't wait on each other up to the pool size."""
+        barrier = threading.Barrier(2, timeout=5)
+        self.db_mock.make_authorisation.side_effect = \
+            lambda *args: barrier.wait()
+
+        async def authorise_twice():
+            return await asyncio.gather(
+                self.service.make_authorisation(*self.AUTHORISATION),
+                self.service.make_authorisation(*self.AUTHORISATION))
+
+        self.assertEqual(run(authorise_twice()), [True, True])
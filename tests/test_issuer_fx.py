@@ -0,0 +1,79 @@
+from decimal import Decimal
+import os
+import tempfile
+from unittest import TestCase
+
+from issuer.fx import CurrencyRegistry, RateTable, load_rates
+
+
+CURRENCIES = ['USD', 'EUR', 'BRL', 'JPY']
+
+
+class CurrencyRegistryTests(TestCase):
+
+    def test_registry(self):
+        currencies = CurrencyRegistry(CURRENCIES)
+
+        self.assertIn('EUR', currencies)
+        self.assertNotIn('GBP', currencies)
+        self.assertEqual(list(currencies), CURRENCIES)
+
+    def test_quantize(self):
+        currencies = CurrencyRegistry(CURRENCIES)
+
+        self.assertEqual(currencies.quantize(Decimal('1.001'), 'USD'),
+                         Decimal('1.01'))
+        self.assertEqual(currencies.quantize(Decimal('100.1'), 'JPY'),
+                         Decimal('101'))
+
+
+class RateTableTests(TestCase):
+
+    def setUp(self):
+        self.rates = RateTable([('USD', 'EUR', '0.8'),
+                                ('USD', 'JPY', '150'),
+                                ('EUR', 'USD', '1.3'),
+                                ('GBP', 'USD', '1.25')],
+                               CURRENCIES)
+
+    def test_published(self):
+        self.assertEqual(self.rates.convert(10, 'USD', 'EUR'),
+                         Decimal('8.00'))
+        # Published both ways, the inverse isn't derived
+        self.assertEqual(self.rates.convert(10, 'EUR', 'USD'),
+                         Decimal('13.00'))
+
+    def test_derived(self):
+        self.assertEqual(self.rates.convert(3, 'JPY', 'USD'),
+                         Decimal('0.02'))
+        self.assertEqual(self.rates.convert(1, 'EUR', 'JPY'),
+                         Decimal('195'))
+        self.assertEqual(self.rates.convert('1.5', 'USD', 'USD'),
+                         Decimal('1.50'))
+
+    def test_no_rate(self):
+        with self.assertRaises(ValueError):
+            self.rates.convert(10, 'USD', 'BRL')
+
+        with self.assertRaises(ValueError):
+            self.rates.convert(10, 'GBP', 'USD')
+
+    def test_invalid_rate(self):
+        with self.assertRaises(ValueError):
+            RateTable([('USD', 'EUR', '0')], CURRENCIES)
+
+
+class LoadRatesTests(TestCase):
+
+    def test_load_rates(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rates.csv')
+            with open(path, 'w') as rates_file:
+                rates_file.write('# source,target,rate\n'
+                                 'USD, BRL, 5.25\n'
+                                 '\n'
+                                 'USD,EUR,0.8\n')
+
+            rates = load_rates(path, CURRENCIES)
+
+        self.assertEqual(rates.convert(10, 'EUR', 'BRL'), Decimal('65.63'))
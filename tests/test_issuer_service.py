@@ -1,8 +1,12 @@
+from decimal import Decimal
 from unittest.mock import MagicMock
 from unittest import TestCase
 
-from issuer.db import InsufficientFunds, AuthorisationNotFound
+from issuer.db import (InsufficientFunds, AccountNotFound,
+                       AuthorisationNotFound, DuplicateTransaction, )
+from issuer.fx import RateTable
 from issuer.service import IssuerService
+from issuer.velocity import VelocityLimits, compile_rule
 
 
 class IssuerServiceTests(TestCase):
@@ -47,6 +51,23 @@ class IssuerServiceTests(TestCase):
         self.assertEqual(cm.exception.args,
                          ('Currency "INVALID_CURRENCY" not available.', ))
 
+    def test_load_money_bulk(self):
+        """The loads are posted in chunks. """
+        self.db_mock.load_money_bulk.side_effect = len
+
+        loads = ((card_id, 100, self.CURRENCY) for card_id in 'ABCDE')
+
+        self.assertEqual(self.service.load_money_bulk(loads, chunk_size=2), 5)
+
+        self.assertEqual(
+            [len(args[0]) for args, kwargs
+             in self.db_mock.load_money_bulk.call_args_list],
+            [2, 2, 1])
+
+    def test_load_money_bulk_invalid_currency(self):
+        with self.assertRaises(ValueError):
+            self.service.load_money_bulk([(self.CARD_ID, 100, 'INVALID')])
+
     def test_make_authorisation(self):
         """Tests make authorisation. """
 
@@ -91,6 +112,90 @@ class IssuerServiceTests(TestCase):
             self.TRANSACTION_AMOUNT,
             self.TRANSACTION_CURRENCY))
 
+    def _authorise(self, service, billing_amount=BILLING_AMOUNT):
+        return service.make_authorisation(self.CARD_ID,
+                                          self.TRANSACTION_ID,
+                                          self.MERCHANT_NAME,
+                                          self.MERCHANT_COUNTRY,
+                                          self.MERCHANT_MCC,
+                                          billing_amount,
+                                          self.BILLING_CURRENCY,
+                                          self.TRANSACTION_AMOUNT,
+                                          self.TRANSACTION_CURRENCY)
+
+    def test_make_authorisation_account_not_found(self):
+        """Without rates only the billing currency Account is used. """
+        self.db_mock.make_authorisation.side_effect = AccountNotFound
+
+        with self.assertRaises(AccountNotFound):
+            self._authorise(self.service)
+
+        self.db_mock.get_balances.assert_not_called()
+
+    def test_make_authorisation_converted(self):
+        """The converted amount is held from the first funded Account. """
+        service = IssuerService(self.db_mock, ['BRL', 'USD', 'EUR'],
+                                rates=RateTable([('BRL', 'USD', '0.2'),
+                                                 ('BRL', 'EUR', '0.15')],
+                                                ['BRL', 'USD', 'EUR']))
+        self.db_mock.make_authorisation.side_effect = [InsufficientFunds,
+                                                       None]
+        self.db_mock.get_balances.return_value = {'BRL': 0,
+                                                  'USD': 10,
+                                                  'EUR': 20}
+
+        self.assertTrue(self._authorise(service))
+
+        self.db_mock.make_authorisation.assert_called_with(
+            self.CARD_ID,
+            self.TRANSACTION_ID,
+            self.MERCHANT_NAME,
+            self.MERCHANT_COUNTRY,
+            self.MERCHANT_MCC,
+            Decimal('15.00'),
+            'EUR',
+            self.TRANSACTION_AMOUNT,
+            self.TRANSACTION_CURRENCY)
+
+        # No Account with enough funds
+        self.db_mock.make_authorisation.side_effect = InsufficientFunds
+        self.assertFalse(self._authorise(service, 1000))
+
+    def test_make_authorisation_duplicate(self):
+        service = IssuerService(self.db_mock, ['BRL', 'USD'],
+                                rates=RateTable([('BRL', 'USD', '0.2')],
+                                                ['BRL', 'USD']))
+        self.db_mock.make_authorisation.side_effect = DuplicateTransaction
+        self.db_mock.get_balances.return_value = {'USD': 0}
+
+        with self.assertRaises(DuplicateTransaction):
+            self._authorise(service)
+
+        # Looked up as a replay of a converted authorisation
+        self.assertEqual(self.db_mock.make_authorisation.call_count, 2)
+
+    def test_make_authorisation_velocity(self):
+        """Authorisations exceeding a rule don't reach the database, the
+        declined ones aren't counted."""
+        velocity = VelocityLimits([compile_rule({'name': 'hourly',
+                                                 'window': 3600,
+                                                 'max_count': 1})])
+        service = IssuerService(self.db_mock, [self.CURRENCY],
+                                velocity=velocity)
+
+        self.db_mock.make_authorisation.side_effect = InsufficientFunds
+        self.assertFalse(self._authorise(service))
+
+        self.db_mock.make_authorisation.side_effect = None
+        self.assertTrue(self._authorise(service))
+
+        self.db_mock.make_authorisation.reset_mock()
+        self.assertFalse(service.make_authorisation(
+            self.CARD_ID, 'OTHER', self.MERCHANT_NAME, self.MERCHANT_COUNTRY,
+            self.MERCHANT_MCC, self.BILLING_AMOUNT, self.BILLING_CURRENCY,
+            self.TRANSACTION_AMOUNT, self.TRANSACTION_CURRENCY))
+        self.db_mock.make_authorisation.assert_not_called()
+
     def test_set_presentment_authorisation_not_found(self):
         """Tests if error is raised when Authorisation doesn't exists. """
 
@@ -112,3 +217,32 @@ class IssuerServiceTests(TestCase):
         self.db_mock.set_presentment.assert_called_with(self.CARD_ID,
                                                         self.BILLING_AMOUNT,
                                                         self.BILLING_CURRENCY)
+
+    def test_set_presentments(self):
+        """Tests the presentments are set at once. """
+        presentments = [('TR1', self.BILLING_AMOUNT, self.BILLING_CURRENCY),
+                        ('TR2', self.BILLING_AMOUNT, self.BILLING_CURRENCY)]
+
+        self.db_mock.set_presentments.return_value = [True, False]
+
+        self.assertEqual(self.service.set_presentments(iter(presentments)),
+                         [True, False])
+
+        self.db_mock.set_presentments.assert_called_with(presentments)
+
+    def test_set_presentments_invalid_currency(self):
+        with self.assertRaises(ValueError):
+            self.service.set_presentments([('TR1', 100, 'INVALID')])
+
+        self.db_mock.set_presentments.assert_not_called()
+
+    def test_get_balance(self):
+        read_db = MagicMock()
+        read_db.get_balance.return_value = 10
+        service = IssuerService(self.db_mock, [self.CURRENCY], read_db)
+
+        self.assertEqual(service.get_balance(self.CARD_ID, self.CURRENCY), 10)
+        read_db.get_balance.assert_called_with(self.CARD_ID, self.CURRENCY)
+
+        with self.assertRaises(ValueError):
+            service.get_balance(self.CARD_ID, 'INVALID')
@@ -0,0 +1,247 @@
+from decimal import Decimal
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from issuer.velocity import (VelocityExceeded, VelocityLimits, compile_rule,
+                             load_rules, )
+
+
+class Clock:
+
+    def __init__(self, now=1000):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class CompileRuleTests(TestCase):
+
+    def test_invalid(self):
+        for rule in ({'window': 60, 'max_count': 1},
+                     {'name': 'r', 'max_count': 1},
+                     {'name': 'r', 'window': 60},
+                     {'name': 'r', 'window': 60, 'max_amount': 10},
+                     {'name': 'r', 'window': 60, 'max_count': 1,
+                      'per': ['merchant']}):
+            with self.assertRaises(ValueError):
+                compile_rule(rule)
+
+    def test_keys(self):
+        rule = compile_rule({'name': 'r', 'window': 60, 'max_count': 1,
+                             'mcc': [5411, 5412], 'country': ['BR']})
+        self.assertEqual(sorted(rule.keys), [(5411, 'BR', None),
+                                             (5412, 'BR', None)])
+
+    def test_load_rules(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rules.json')
+            with open(path, 'w') as rules_file:
+                json.dump([{'name': 'r', 'window': 60, 'max_count': 1}],
+                          rules_file)
+
+            self.assertEqual([r.name for r in load_rules(path)], ['r'])
+
+
+class VelocityLimitsTests(TestCase):
+    CARD_ID = 'CARD123'
+
+    def setUp(self):
+        self.clock = Clock()
+
+    def _limits(self, *rules, **kwargs):
+        return VelocityLimits([compile_rule(r) for r in rules],
+                              clock=self.clock, **kwargs)
+
+    def _authorise(self, limits, transaction_id, amount=10, mcc=1234,
+                   country='BR', currency='BRL'):
+        return limits.authorise(self.CARD_ID, transaction_id, amount,
+                                currency, mcc, country)
+
+    def test_max_count(self):
+        limits = self._limits({'name': 'hourly', 'window': 3600,
+                               'max_count': 2})
+
+        self.assertTrue(self._authorise(limits, 'T1'))
+        self.assertTrue(self._authorise(limits, 'T2'))
+        with self.assertRaises(VelocityExceeded) as cm:
+            self._authorise(limits, 'T3')
+        self.assertEqual(cm.exception.args, ('hourly', ))
+
+        # Replays aren't evaluated nor counted again
+        self.assertFalse(self._authorise(limits, 'T1'))
+
+        # The first authorisations leave the window
+        self.clock.now += 3600
+        self.assertTrue(self._authorise(limits, 'T3'))
+
+    def test_max_amount(self):
+        limits = self._limits({'name': 'daily', 'window': 86400,
+                               'max_amount': '25', 'currency': 'BRL'})
+
+        self._authorise(limits, 'T1', 10)
+        self._authorise(limits, 'T2', 10)
+        # Other currencies aren't limited nor summed
+        self._authorise(limits, 'T3', 100, currency='USD')
+
+        with self.assertRaises(VelocityExceeded):
+            self._authorise(limits, 'T4', 10)
+        self._authorise(limits, 'T4', 5)
+
+    def test_filters(self):
+        limits = self._limits({'name': 'gambling', 'window': 3600,
+                               'max_count': 1, 'mcc': [7995],
+                               'country': ['BR']})
+
+        self._authorise(limits, 'T1', mcc=7995)
+        self._authorise(limits, 'T2', mcc=7995, country='US')
+        self._authorise(limits, 'T3')
+
+        with self.assertRaises(VelocityExceeded):
+            self._authorise(limits, 'T4', mcc=7995)
+
+    def test_per_mcc(self):
+        limits = self._limits({'name': 'merchants', 'window': 3600,
+                               'max_count': 1, 'per': ['mcc']})
+
+        self._authorise(limits, 'T1', mcc=5411)
+        self._authorise(limits, 'T2', mcc=5412)
+
+        with self.assertRaises(VelocityExceeded):
+            self._authorise(limits, 'T3', mcc=5411)
+
+    def test_discard(self):
+        limits = self._limits({'name': 'hourly', 'window': 3600,
+                               'max_count': 1})
+
+        self._authorise(limits, 'T1')
+        limits.discard(self.CARD_ID, 'T1')
+        limits.discard('CARD999', 'T1')
+
+        self.assertTrue(self._authorise(limits, 'T2'))
+
+    def test_history_size(self):
+        rule = {'name': 'hourly', 'window': 3600, 'max_count': 3}
+
+        with self.assertRaises(ValueError):
+            self._limits(rule, history_size=2)
+
+        # The ring buffer keeps the last authorisations only
+        limits = self._limits({'name': 'daily', 'window': 86400,
+                               'max_amount': '30', 'currency': 'BRL'},
+                              history_size=2)
+        for transaction_id in ('T1', 'T2', 'T3'):
+            self.clock.now += 1
+            self._authorise(limits, transaction_id)
+
+        self.assertEqual(
+            [entry[1] for entry in limits._cards[self.CARD_ID].entries],
+            ['T3', 'T2'])
+
+    def test_amount_past_history_size(self):
+        """The authorisations left out of the history are still summed,
+        until the last of them leaves the window."""
+        limits = self._limits({'name': 'daily', 'window': 86400,
+                               'max_amount': '100', 'currency': 'BRL'},
+                              {'name': 'merchant', 'window': 86400,
+                               'max_amount': '60', 'currency': 'BRL',
+                               'mcc': [5411]},
+                              history_size=4)
+
+        for i in range(10):
+            self.clock.now += 60
+            self._authorise(limits, 'T{}'.format(i), mcc=5411 + i % 2)
+        self.assertEqual(len(limits._cards[self.CARD_ID].entries), 4)
+
+        with self.assertRaises(VelocityExceeded) as cm:
+            self._authorise(limits, 'T10', 1, mcc=5412)
+        self.assertEqual(cm.exception.args, ('daily', ))
+
+        # Another currency isn't summed, nor counted
+        self._authorise(limits, 'T10', 1, currency='USD')
+
+        # The folded authorisations leave the window with the last of them,
+        # T6 made at 1420
+        self.clock.now = 1420 + 86400 - 1
+        with self.assertRaises(VelocityExceeded):
+            self._authorise(limits, 'T11', 50, mcc=5411)
+        self.clock.now += 1
+        self._authorise(limits, 'T11', 50, mcc=5411)
+
+        # Only T7 is folded, by this authorisation
+        folded = limits._cards[self.CARD_ID].folded
+        self.assertEqual([entry[:2] for entry in folded.values()],
+                         [[1480, 1]])
+
+    def test_rebuilt_from_history(self):
+        loads = []
+
+        def history(since):
+            loads.append(since)
+            return [(self.CARD_ID, 'T1', 100, Decimal(10), 'BRL', 1234, 'BR'),
+                    (self.CARD_ID, 'T2', 900, Decimal(10), 'BRL', 1234, 'BR')]
+
+        limits = self._limits({'name': 'hourly', 'window': 3600,
+                               'max_count': 2}, history=history)
+
+        with self.assertRaises(VelocityExceeded):
+            self._authorise(limits, 'T3')
+        self.assertFalse(self._authorise(limits, 'T2'))
+
+        self.assertEqual(loads, [1000 - 3600])
+
+        # Once
+        limits.load()
+        self.assertEqual(len(loads), 1)
+
+    def test_prune(self):
+        limits = self._limits({'name': 'hourly', 'window': 3600,
+                               'max_count': 2})
+        limits.authorise('CARD124', 'T1', 10, 'BRL', 1234, 'BR')
+
+        self.clock.now += 3600
+        self._authorise(limits, 'T2')
+
+        self.assertEqual(list(limits._cards), [self.CARD_ID])
+
+    def test_chains(self):
+        limits = self._limits(
+            {'name': 'a', 'window': 60, 'max_count': 1, 'mcc': [7995]},
+            {'name': 'b', 'window': 60, 'max_count': 1, 'country': ['US']},
+            {'name': 'c', 'window': 60, 'max_count': 1, 'currency': 'BRL'},
+            {'name': 'd', 'window': 60, 'max_count': 1})
+
+        def names(currency, mcc, country):
+            return sorted(rule.name
+                          for chain in limits._get_chains(currency, mcc,
+                                                          country)
+                          for rule in chain.rules)
+
+        self.assertEqual(names('BRL', 7995, 'US'), ['a', 'b', 'c', 'd'])
+        self.assertEqual(names('USD', 5411, 'BR'), ['d'])
+
+    def test_only_rules_at_risk_evaluated(self):
+        limits = self._limits(
+            {'name': 'low', 'window': 60, 'max_count': 2},
+            {'name': 'high', 'window': 60, 'max_count': 20},
+            {'name': 'amount', 'window': 60, 'max_amount': 15,
+             'currency': 'BRL'})
+        chains = limits._get_chains('BRL', 1234, 'BR')
+
+        evaluated = []
+        for chain in chains:
+            for rule in chain.rules:
+                rule.allows = (lambda rule: lambda *args: evaluated.append(
+                    rule.name) or True)(rule)
+
+        for chain in chains:
+            chain.check([], 0, 3, Decimal(10), Decimal(10), 'BRL', 1234,
+                        'BR')
+        self.assertEqual(evaluated, ['low'])
+
+        for chain in chains:
+            chain.check([], 0, 3, Decimal(20), Decimal(10), 'BRL', 1234,
+                        'BR')
+        self.assertEqual(sorted(evaluated), ['amount', 'low', 'low'])